@@ -10,11 +10,21 @@ import logging
 import random
 import re
 import os
+import threading
+from functools import partial
 
-from geopy.geocoders import Nominatim
+from flatfindr.executor import ScrapeExecutor
 from flatfindr.facebook import Facebook
+from flatfindr.geo import CircleIndex
+from flatfindr.geocoding import Geocoder
 from flatfindr.logins import LOGINS
-from telegram import ParseMode, Update
+from flatfindr.metrics import DEFAULT_METRICS_PATH, Metrics
+from flatfindr.notifier import Notifier
+from flatfindr.planner import get_search, matches, plan_searches
+from flatfindr.pool import DriverPool
+from flatfindr.scraper import create_driver
+from flatfindr.thumbnails import MAX_IMAGES, ThumbnailCache
+from telegram import InputMediaPhoto, ParseMode, Update
 
 from telegram.ext import (
     Updater,
@@ -36,6 +46,29 @@ logger = logging.getLogger(__name__)
 
 LOCATION, RADIUS, MIN_PRICE, MAX_PRICE, MIN_BEDROOMS = range(5)
 
+# Warm webdrivers shared by the searches of all the chats
+DRIVER_POOL = DriverPool(partial(create_driver, headless=True))
+# Timing metrics of all the scrapes, written inside ./saves/metrics after each one
+METRICS = Metrics(DEFAULT_METRICS_PATH)
+# The scrapes run outside of the bot threads, at most one per webdriver of the pool
+SCRAPES = ScrapeExecutor(max_workers=DRIVER_POOL.max_size)
+# Users locations and ads addresses, cached inside ./saves/geocoding.json
+GEOCODER = Geocoder()
+# Photos of the new ads, downloaded inside ./saves/thumbnails while the scrapes go on
+THUMBNAILS = ThumbnailCache()
+# Maximum number of seconds an alert waits for the photos of its ad
+THUMBNAILS_TIMEOUT = 10
+# The alerts are sent by a single worker, within the Telegram flood limits, the texts waiting for the same chat coalesced into one message
+NOTIFIER = Notifier(digest=True, metrics=METRICS)
+# Maximum number of seconds to wait for the queued alerts when the bot stops
+NOTIFIER_TIMEOUT = 30
+DB_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    os.path.join("saves", "alfred.db"),
+)
+# Held by the scrapes while they load or save the database, so that each save merges the index files (.lsh, .phash, ...) saved by the others
+DB_LOCK = threading.RLock()
+
 
 def start(update: Update, context: CallbackContext) -> int:
     """Starts the conversation and asks the user about its prefered location."""
@@ -60,10 +93,13 @@ def location(update: Update, context: CallbackContext) -> int:
     )
     context.user_data["lat"] = user_location.latitude
     context.user_data["lng"] = user_location.longitude
-    geolocator = Nominatim(user_agent="geoapiExercises")
-    location = geolocator.reverse(f"{user_location.latitude},{user_location.longitude}")
+    try:
+        address = GEOCODER.reverse(user_location.latitude, user_location.longitude)
+    except Exception as e:
+        logger.warning(f"Error while reverse geocoding the location: {e}")
+        address = {}
     update.message.reply_text(
-        f"Wooo I love {location.raw.get('address', {}).get('city', location.raw.get('address', {}).get('suburb', 'nowhere'))}! "
+        f"Wooo I love {address.get('city', address.get('suburb', 'nowhere'))}! "
         "What is the radius (in km) around this position?",
     )
 
@@ -122,13 +158,7 @@ def min_bedrooms(update: Update, context: CallbackContext) -> int:
         "Next time, you can directly run the same search by using /run instead of /start.\n"
         "The active search can be canceled at any time using /stop. Type /help for a list of all commands."
     )
-    context.job_queue.run_repeating(
-        run_once,
-        interval=random.uniform(25, 35) * 60,
-        first=1,
-        context=(context, chat_id),
-        name=str(chat_id),
-    )
+    start_search(context, chat_id)
     return ConversationHandler.END
 
 
@@ -150,12 +180,20 @@ def run(update: Update, context: CallbackContext) -> None:
             + get_params(context)
         ),
     )
-    context.job_queue.run_repeating(
-        run_once,
-        interval=random.uniform(25, 35) * 60,
-        first=1,
-        context=(context, chat_id),
-        name=str(chat_id),
+    start_search(context, chat_id)
+
+
+def start_search(context: CallbackContext, chat_id: int) -> None:
+    """Register the search of a chat, so that it is part of the periodic searches, and run it right away.
+    A scrape still in flight for this chat is cancelled, as it was run with the previous criteria: the new search is then run once it is over.
+    """
+    context.bot_data.setdefault("searches", {})[chat_id] = get_search(context.user_data)
+    remove_job_if_exists(str(chat_id), context)
+    SCRAPES.cancel(
+        chat_id,
+        restart=lambda: context.job_queue.run_once(
+            run_searches, when=1, context=[chat_id], name=str(chat_id)
+        ),
     )
 
 
@@ -170,36 +208,123 @@ def remove_job_if_exists(name: str, context: CallbackContext) -> bool:
 
 
 def stop(update: Update, context: CallbackContext) -> None:
-    """Remove the job if the user changed their mind."""
+    """Remove the search if the user changed their mind."""
     chat_id = update.message.chat_id
-    job_removed = remove_job_if_exists(str(chat_id), context)
+    remove_job_if_exists(str(chat_id), context)
+    SCRAPES.cancel(chat_id)
+    search_removed = context.bot_data.get("searches", {}).pop(chat_id, None)
     text = (
         "Flat search successfully cancelled!"
-        if job_removed
+        if search_removed is not None
         else "You have no active flat search."
     )
     update.message.reply_text(text)
 
 
-def run_once(context: CallbackContext) -> None:
-    chat_id = context.job.context[1]
-    job_context = context.job.context[0]
-    ads_to_display = Facebook().run(
-        to_html=True,
-        min_price=job_context.user_data.get("min_price", 1200),
-        max_price=job_context.user_data.get("max_price", 1750),
-        min_bedrooms=job_context.user_data.get("min_bedrooms", 2),
-        lat=job_context.user_data.get("lat", 45.5254),
-        lng=job_context.user_data.get("lng", -73.5724),
-        radius=job_context.user_data.get("radius", 2),
-    )
-    for ad in ads_to_display:
-        context.bot.send_message(chat_id=chat_id, text=ad, parse_mode=ParseMode.HTML)
+def run_searches(context: CallbackContext) -> None:
+    """Submit the active searches, merged into as few Marketplace queries as possible, to the scrape executor.
+    If the job has a context, only the searches of these chat ids are run. The chats with a scrape already in flight are skipped.
+    This job returns right away, so that the bot stays responsive while scraping."""
+    searches = context.bot_data.get("searches", {})
+    if context.job.context is not None:
+        searches = {
+            chat_id: searches[chat_id]
+            for chat_id in context.job.context
+            if chat_id in searches
+        }
+    searches = {
+        chat_id: criteria
+        for chat_id, criteria in searches.items()
+        if not SCRAPES.is_busy(chat_id)
+    }
+    for query, chat_ids in plan_searches(searches):
+        task = SCRAPES.submit(partial(scrape_query, query, searches), chat_ids)
+        if task is None:
+            logger.warning(f"Too many searches in flight, skipping {query}")
+
+
+def scrape_query(query, searches, task) -> None:
+    """Run a Marketplace query and queue the new ads matching each chat's criteria to the notifier. Run by a worker of the scrape executor.
+
+    Args:
+        query (dict): The merged search criteria.
+        searches (dict): The search criteria of each chat, as {chat_id: criteria}.
+        task (flatfindr.executor.Task): The task of the scrape, whose keys are the chat ids still waiting for the results.
+    """
+    logger.info(f"Searching for {len(task.keys)} chat(s) with {query}")
+    with DRIVER_POOL.leased() as lease:
+        if task.cancelled.is_set():
+            return
+        fb = Facebook(
+            lease=lease,
+            db_path=DB_PATH,
+            cancelled=task.cancelled,
+            metrics=METRICS,
+            geocoder=GEOCODER,
+            thumbnails=THUMBNAILS,
+            db_lock=DB_LOCK,
+        )
+        fb.run(**query)
+    # The chats whose search circle contains an item are found without checking every chat
+    circles = CircleIndex()
+    for chat_id in list(task.keys):
+        search = get_search(searches[chat_id])
+        circles.add(chat_id, search["lat"], search["lng"], search["radius"])
+    for item_details in fb.new_items:
+        if item_details.get("lat", "") != "" and item_details.get("lng", "") != "":
+            chat_ids = circles.containing(item_details["lat"], item_details["lng"])
+        else:
+            chat_ids = list(circles.circles)
+        photos = None
+        # The chats that sent /stop in the meantime are not in the task anymore
+        for chat_id in chat_ids:
+            if chat_id in task.keys and matches(item_details, searches[chat_id]):
+                NOTIFIER.send_message(
+                    chat_id,
+                    fb.item_details_to_html(item_details),
+                    parse_mode=ParseMode.HTML,
+                )
+                if photos is None:
+                    photos = get_photos(item_details)
+                if len(photos) == 1:
+                    NOTIFIER.send_photo(chat_id, photos[0])
+                elif photos:
+                    # An album holds at least two photos
+                    NOTIFIER.send_media_group(
+                        chat_id, [InputMediaPhoto(photo) for photo in photos]
+                    )
+
+
+def get_photos(item_details) -> list:
+    """Get the thumbnails of an item images, waiting a little for those still being downloaded.
+
+    Args:
+        item_details (dict): A dictionnary with all the item details.
+
+    Returns:
+        list: The content of the thumbnails.
+    """
+    photos = []
+    for path in THUMBNAILS.wait(
+        item_details.get("images", [])[:MAX_IMAGES], timeout=THUMBNAILS_TIMEOUT
+    ):
+        try:
+            with open(path, "rb") as photo_file:
+                photos.append(photo_file.read())
+        except OSError:
+            pass
+    return photos
+
+
+def evict_drivers(context: CallbackContext) -> None:
+    """Quit the webdrivers that have been idle for too long."""
+    DRIVER_POOL.evict_idle()
 
 
 def test(update: Update, context: CallbackContext) -> None:
     fb = Facebook()
     fb.quit_driver()
+    fb.close_db()
     item_details = {
         "url": "https://www.facebook.com/marketplace/item/296710065762366/",
         "state": "new",
@@ -288,14 +413,30 @@ def main() -> None:
     dp.add_handler(MessageHandler(Filters.text | Filters.command, unknown))
     # log all errors
     dp.add_error_handler(error)
+    # run the searches of all the chats every 30 minutes or so
+    updater.job_queue.run_repeating(
+        run_searches, interval=random.uniform(25, 35) * 60, first=60, name="searches"
+    )
+    # quit the webdrivers unused for a while
+    updater.job_queue.run_repeating(
+        evict_drivers, interval=DRIVER_POOL.idle_timeout, first=DRIVER_POOL.idle_timeout
+    )
 
     # Start the Bot
+    NOTIFIER.start(updater.bot)
     updater.start_polling()
 
     # Run the bot until you press Ctrl-C or the process receives SIGINT,
     # SIGTERM or SIGABRT. This should be used most of the time, since
     # start_polling() is non-blocking and will stop the bot gracefully.
     updater.idle()
+    SCRAPES.close()
+    NOTIFIER.close(timeout=NOTIFIER_TIMEOUT)
+    DRIVER_POOL.close()
+    # The photos still being downloaded, and the thumbnails indexed since the last save
+    THUMBNAILS.close()
+    # The users locations looked up since the last scrape
+    GEOCODER.flush()
 
 
 if __name__ == "__main__":
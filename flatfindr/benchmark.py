@@ -0,0 +1,119 @@
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from flatfindr.facebook import Facebook
+from flatfindr.geocoding import Geocoder, LocalBackend
+from flatfindr.metrics import Metrics
+from flatfindr.politeness import Politeness
+from flatfindr.pool import Lease
+from flatfindr.replay import ReplayServer, load_index
+from flatfindr.scraper import create_driver
+
+RUNS = 3  # Number of runs of the benchmark, each one with an empty database
+
+"""
+End-to-end benchmark of the Facebook scraper, replaying a recording made with `flatfindr.replay` (no network access needed, only a local chromedriver).
+Each run starts from an empty database and times `get_items_links()`, then `update_db()` as a whole and `get_item_details()` for each item page.
+The politeness delays are disabled by default, so that the timings only measure the scraper and the browser.
+"""
+
+
+def summarize(timings):
+    """Get the statistics of a list of timings.
+
+    Args:
+        timings (list): The timings, in seconds.
+
+    Returns:
+        dict: The number of timings, and their mean, median, 95th percentile and maximum, in seconds.
+    """
+    if not timings:
+        return {"cnt": 0}
+    timings = sorted(timings)
+    return {
+        "cnt": len(timings),
+        "mean": statistics.mean(timings),
+        "median": statistics.median(timings),
+        "p95": timings[min(len(timings) - 1, int(0.95 * len(timings)))],
+        "max": timings[-1],
+    }
+
+
+def timed(timings, method):
+    """Wrap a method so that the duration of each of its calls is appended to a list.
+
+    Args:
+        timings (list): The list the durations (in seconds) are appended to.
+        method (callable): The method to time.
+
+    Returns:
+        callable: The wrapped method.
+    """
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - start)
+
+    return wrapper
+
+
+def benchmark(directory, runs=RUNS, max_items=30, headless=True, politeness=None):
+    """Replay a recording several times and time each stage of the scraper.
+
+    Args:
+        directory (str): The directory of the recording.
+        runs (int): The number of runs. Defaults to RUNS.
+        max_items (int): The maximum number of items scraped for each run. Defaults to 30.
+        headless (bool): Set to False if you want to watch the browser. Defaults to True.
+        politeness (flatfindr.politeness.Politeness): The delays to respect between actions. Defaults to None, meaning no delay.
+
+    Returns:
+        dict: The statistics of each stage, per run ('get_items_links', 'update_db') and per page ('get_item_details').
+    """
+    criteria = load_index(directory)["criteria"]
+    timings = {"get_items_links": [], "update_db": [], "get_item_details": []}
+    driver = create_driver(headless=headless)
+    if driver is None:
+        raise RuntimeError("The webdriver could not be launched")
+    try:
+        with ReplayServer(directory) as server, tempfile.TemporaryDirectory() as tmp:
+            for run in range(runs):
+                fb = Facebook(
+                    lease=Lease(driver),
+                    db_path=os.path.join(tmp, f"db-{run}.json"),
+                    politeness=politeness or Politeness(scale=0),
+                    metrics=Metrics(),  # Not mixed with the metrics of the real runs
+                    # Offline and not cached, so that each run geocodes the same way
+                    geocoder=Geocoder(
+                        backend=LocalBackend(center=(45.5254, -73.5724)),
+                        cache_path=None,
+                    ),
+                )
+                fb.main_url = server.url
+                # The item pages are timed as get_item_details(): scraping then classification
+                page_timings = []
+                fb.scrape_item_details = timed(page_timings, fb.scrape_item_details)
+                fb.classify_item = timed(page_timings, fb.classify_item)
+                timed(timings["get_items_links"], fb.get_items_links)(**criteria)
+                timed(timings["update_db"], fb.update_db)(max_items=max_items)
+                timings["get_item_details"] += [
+                    sum(page_timings[i : i + 2]) for i in range(0, len(page_timings), 2)
+                ]
+    finally:
+        driver.quit()
+    return {stage: summarize(stage_timings) for stage, stage_timings in timings.items()}
+
+
+if __name__ == "__main__":
+    # Usage: python -m flatfindr.benchmark ./saves/recording [runs]
+    report = benchmark(
+        sys.argv[1], runs=int(sys.argv[2]) if len(sys.argv) > 2 else RUNS
+    )
+    print(json.dumps(report, indent=2))
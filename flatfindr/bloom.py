@@ -0,0 +1,256 @@
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+
+from flatfindr.retention import get_url_hash
+
+# Number of urls before the false positive rate exceeds the target
+DEFAULT_CAPACITY = 1_000_000
+DEFAULT_ERROR_RATE = 0.001
+BLOOM_EXTENSION = ".bloom"
+MAGIC = b"FFBLOOM1"
+# Magic, number of bits, number of hashes, capacity, error rate
+HEADER = struct.Struct("<8sQQQd")
+# Number of added urls (not counting the false positives), right after the header
+COUNT = struct.Struct("<Q")
+DATA_OFFSET = 64
+MASK = (1 << 64) - 1
+
+"""
+Bloom filter of the seen items urls, stored inside a memory-mapped file (`db_path` + `.bloom`).
+It answers "never seen" for sure, and "maybe seen" with a tunable false positive rate: the scraper consults it before its exact index, see `Scraper.is_seen()`.
+Since the bits live in the page cache rather than in the heap, other processes can open the same file read-only to check the links they harvest, without loading the database.
+The urls are added through their tombstone hash (see `flatfindr.retention.get_url_hash()`), so that the filter can be rebuilt from the database and the tombstones.
+Once more urls than its capacity have been added, the filter is full and should be rebuilt with a larger capacity, see `Scraper.build_index()`.
+"""
+
+WRITE_LOCK = threading.Lock()  # Setting bits is a read-modify-write of a byte
+
+
+def get_parameters(capacity, error_rate):
+    """Get the optimal size of a Bloom filter.
+
+    Args:
+        capacity (int): The number of urls to hold.
+        error_rate (float): The target false positive rate, e.g. 0.001.
+
+    Returns:
+        tuple: The number of bits and the number of hash functions.
+    """
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    bits = max(8, (bits + 7) // 8 * 8)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def mix(value):
+    """Scramble a 64 bits integer (splitmix64 finalizer), to derive a second hash from the first one."""
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK
+    return value ^ (value >> 31)
+
+
+class BloomFilter:
+    def __init__(self, path=None, readonly=False):
+        """Open an existing filter, see `create()` to make a new one.
+
+        Args:
+            path (str): The path of the filter file. If None, an empty in-memory filter of the default size is made. Defaults to None.
+            readonly (bool): Set to True to open the file read-only, e.g. from another process than the scraper. Defaults to False.
+        """
+        self.path = path
+        self.readonly = readonly
+        if path is None:
+            self.file = None
+            bits, hashes = get_parameters(DEFAULT_CAPACITY, DEFAULT_ERROR_RATE)
+            self.mmap = mmap.mmap(-1, DATA_OFFSET + bits // 8)
+            self.mmap[: HEADER.size] = HEADER.pack(
+                MAGIC, bits, hashes, DEFAULT_CAPACITY, DEFAULT_ERROR_RATE
+            )
+        else:
+            self.file = open(path, "rb" if readonly else "r+b")
+            access = mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=access)
+            if len(self.mmap) < DATA_OFFSET:
+                self.close()
+                raise ValueError(f"`{path}` is not a valid Bloom filter")
+        magic, self.bits, self.hashes, self.capacity, self.error_rate = (
+            HEADER.unpack_from(self.mmap)
+        )
+        if magic != MAGIC or len(self.mmap) != DATA_OFFSET + self.bits // 8:
+            self.close()
+            raise ValueError(f"`{path}` is not a valid Bloom filter")
+
+    @classmethod
+    def create(
+        cls,
+        path,
+        url_hashes=(),
+        capacity=DEFAULT_CAPACITY,
+        error_rate=DEFAULT_ERROR_RATE,
+    ):
+        """Write a new filter (through a temporary file and an atomic rename, so that the readers keep a consistent one) and open it.
+
+        Args:
+            path (str): The path of the filter file.
+            url_hashes (iterable): The hashes of the urls to add, see `flatfindr.retention.get_url_hash()`. Defaults to ().
+            capacity (int): The number of urls to hold. Defaults to DEFAULT_CAPACITY.
+            error_rate (float): The target false positive rate. Defaults to DEFAULT_ERROR_RATE.
+
+        Returns:
+            BloomFilter: The filter.
+        """
+        bits, hashes = get_parameters(capacity, error_rate)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as bloom_file:
+            bloom_file.write(HEADER.pack(MAGIC, bits, hashes, capacity, error_rate))
+            bloom_file.truncate(DATA_OFFSET + bits // 8)
+        bloom = cls(tmp_path)
+        for url_hash in url_hashes:
+            bloom.add_hash(url_hash)
+        bloom.close()
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def __len__(self):
+        return COUNT.unpack_from(self.mmap, HEADER.size)[0]
+
+    def get_positions(self, url_hash):
+        """Get the positions of the bits of an url, by double hashing.
+
+        Args:
+            url_hash (str): The hash of the url, see `flatfindr.retention.get_url_hash()`.
+
+        Returns:
+            list: The bit positions.
+        """
+        first = int(url_hash, 16)
+        second = mix(first) | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add_hash(self, url_hash):
+        """Add an url to the filter, from its hash.
+
+        Args:
+            url_hash (str): The hash of the url, see `flatfindr.retention.get_url_hash()`.
+
+        Returns:
+            bool: True if the url was not in the filter yet.
+        """
+        added = False
+        with WRITE_LOCK:
+            for position in self.get_positions(url_hash):
+                idx = DATA_OFFSET + (position >> 3)
+                byte = self.mmap[idx]
+                if not byte & (1 << (position & 7)):
+                    self.mmap[idx] = byte | (1 << (position & 7))
+                    added = True
+            if added:
+                COUNT.pack_into(self.mmap, HEADER.size, len(self) + 1)
+        return added
+
+    def add(self, url):
+        """Add an url to the filter.
+
+        Args:
+            url (str): The url of the item.
+
+        Returns:
+            bool: True if the url was not in the filter yet.
+        """
+        return self.add_hash(get_url_hash(url))
+
+    def contains_hash(self, url_hash):
+        return all(
+            self.mmap[DATA_OFFSET + (position >> 3)] & (1 << (position & 7))
+            for position in self.get_positions(url_hash)
+        )
+
+    def __contains__(self, url):
+        return self.contains_hash(get_url_hash(url))
+
+    def is_full(self):
+        """Return True if more urls than the capacity have been added, i.e. the false positive rate is above its target."""
+        return len(self) > self.capacity
+
+    def flush(self):
+        if not self.readonly:
+            self.mmap.flush()
+
+    def close(self):
+        if not self.mmap.closed:
+            self.mmap.close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def open_seen_filter(
+    path, url_hashes, urls_cnt, recent_urls=(), error_rate=DEFAULT_ERROR_RATE
+):
+    """Open the filter of the seen urls, or rebuild it if it is missing, invalid, full or out of date.
+    If it can't be written, the filter is kept in memory.
+
+    Args:
+        path (str): The path of the filter file, e.g. `db_path` + BLOOM_EXTENSION.
+        url_hashes (callable): A function returning the hashes of all the seen urls, only called to rebuild the filter.
+        urls_cnt (int): The number of seen urls, to size a rebuilt filter: its capacity is at least twice this number.
+        recent_urls (iterable): The last seen urls. If one of them is not in the filter, e.g. because the database has been updated without it, the filter is rebuilt. Defaults to ().
+        error_rate (float): The target false positive rate. Defaults to DEFAULT_ERROR_RATE.
+
+    Returns:
+        BloomFilter: The filter.
+    """
+    try:
+        bloom = BloomFilter(path)
+        if (
+            not bloom.is_full()
+            and bloom.error_rate == error_rate
+            and all(url in bloom for url in recent_urls)
+        ):
+            return bloom
+        bloom.close()
+    except (OSError, ValueError):
+        pass
+    try:
+        return BloomFilter.create(
+            path,
+            url_hashes(),
+            capacity=max(DEFAULT_CAPACITY, 2 * urls_cnt),
+            error_rate=error_rate,
+        )
+    except OSError:
+        print(f"Error while writing the Bloom filter to `{path}`: it is kept in memory")
+        bloom = BloomFilter()
+        for url_hash in url_hashes():
+            bloom.add_hash(url_hash)
+        return bloom
+
+
+if __name__ == "__main__":
+    # Usage: python -m flatfindr.bloom ./saves/db.json [error_rate]
+    # Rebuild the filter of the seen urls of a database, e.g. with another false positive rate
+    from flatfindr.storage import get_storage
+
+    db_path = sys.argv[1]
+    error_rate = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ERROR_RATE
+    storage = get_storage(db_path)
+    db = storage.load()
+    if db is None:
+        raise FileNotFoundError(f"No database found at `{db_path}`")
+    url_hashes = [get_url_hash(url) for url in db["data"].column("url")]
+    url_hashes += [url_hash for url_hash, _, _ in storage.load_tombstones()]
+    bloom = BloomFilter.create(
+        db_path + BLOOM_EXTENSION,
+        url_hashes,
+        capacity=max(DEFAULT_CAPACITY, 2 * len(url_hashes)),
+        error_rate=error_rate,
+    )
+    print(
+        f"{len(bloom)} urls added to `{bloom.path}`: {bloom.bits // 8} bytes, {bloom.hashes} hashes"
+    )
+    bloom.close()
+    storage.close()
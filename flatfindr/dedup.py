@@ -0,0 +1,217 @@
+import hashlib
+import random
+import re
+
+from flatfindr.journal import JournaledDict
+
+NUM_PERM = 64  # Number of hash functions of a MinHash signature
+BANDS = 16  # Number of LSH bands, each of NUM_PERM / BANDS rows
+SHINGLE_SIZE = 3  # Number of words per shingle
+DUPLICATE_THRESHOLD = 0.7  # Estimated Jaccard similarity above which two descriptions are considered the same ad
+LSH_EXTENSION = ".lsh"
+SEED = 42
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+"""
+Near-duplicate detection of the items descriptions, using MinHash signatures and Locality Sensitive Hashing.
+Reposted ads often come back with a word or the price changed: their descriptions are no longer identical but they share most of their shingles.
+The index is persisted next to the database (`db_path` + `.lsh`), with a journal of its changes, see `flatfindr.journal.JournaledDict`.
+"""
+
+
+def get_shingles(text, size=SHINGLE_SIZE):
+    """Get the set of word shingles of a text, insensitive to case and punctuation.
+
+    Args:
+        text (str): The text to shingle, e.g. an item description.
+        size (int): The number of words per shingle. Defaults to SHINGLE_SIZE.
+
+    Returns:
+        set: The set of shingles, e.g. {'superbe 4 1', '4 1 2', ...}.
+    """
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+class NearDuplicateIndex:
+    def __init__(
+        self, path=None, threshold=DUPLICATE_THRESHOLD, num_perm=NUM_PERM, bands=BANDS
+    ):
+        """
+        Args:
+            path (str): The path where the index is persisted. If None, the index lives in memory only. Defaults to None.
+            threshold (float): The estimated similarity (between 0 and 1) above which a description is considered as already seen. Defaults to DUPLICATE_THRESHOLD.
+            num_perm (int): The number of hash functions of a signature. Defaults to NUM_PERM.
+            bands (int): The number of LSH bands. Must divide `num_perm`. Defaults to BANDS.
+        """
+        if num_perm % bands:
+            raise ValueError("`num_perm` should be a multiple of `bands`")
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(SEED)
+        self.permutations = [
+            (rng.randint(1, MERSENNE_PRIME - 1), rng.randint(0, MERSENNE_PRIME - 1))
+            for _ in range(num_perm)
+        ]
+        self.signatures = {}
+        self.buckets = {}
+        self.journal = (
+            JournaledDict(path, {"num_perm": num_perm, "seed": SEED}, "signatures")
+            if path
+            else None
+        )
+
+    def __len__(self):
+        return len(self.signatures)
+
+    @property
+    def dirty(self):
+        """True if the index changed since the last save."""
+        return self.journal is not None and bool(self.journal.changes)
+
+    def __contains__(self, key):
+        return key in self.signatures
+
+    def signature(self, text):
+        """Get the MinHash signature of a text.
+
+        Args:
+            text (str): The text, e.g. an item description.
+
+        Returns:
+            list: The signature, as a list of `num_perm` integers. Empty if the text has no words.
+        """
+        hashes = [
+            int.from_bytes(
+                hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(),
+                "big",
+            )
+            for shingle in get_shingles(text)
+        ]
+        if not hashes:
+            return []
+        return [
+            min((a * h + b) % MERSENNE_PRIME for h in hashes) & MAX_HASH
+            for a, b in self.permutations
+        ]
+
+    def get_bands(self, signature):
+        """Split a signature into its LSH bands.
+
+        Args:
+            signature (list): A MinHash signature.
+
+        Returns:
+            list: The bucket keys of the signature, one per band.
+        """
+        return [
+            (band, tuple(signature[band * self.rows : (band + 1) * self.rows]))
+            for band in range(self.bands)
+        ]
+
+    def add(self, key, text):
+        """Add a text to the index.
+
+        Args:
+            key (str): The key of the text, e.g. the item url.
+            text (str): The text, e.g. the item description.
+        """
+        signature = self.signature(text)
+        if not signature or key in self.signatures:
+            return
+        self.insert(key, signature)
+        if self.journal is not None:
+            self.journal.set(key, signature)
+
+    def insert(self, key, signature):
+        """Index a signature in `self.signatures` and the LSH buckets, without journaling it.
+
+        Args:
+            key (str): The key of the text, e.g. the item url.
+            signature (list): Its MinHash signature, see `signature()`.
+        """
+        self.signatures[key] = signature
+        for bucket in self.get_bands(signature):
+            self.buckets.setdefault(bucket, []).append(key)
+
+    def merge(self, key, signature):
+        """Apply a change of the index saved by another scraper of the same database.
+
+        Args:
+            key (str): The key of the text, e.g. the item url.
+            signature (list): Its new signature, or None if it has been removed.
+        """
+        self.remove(key)
+        if signature is not None:
+            self.insert(key, signature)
+
+    def remove(self, key):
+        """Remove a text from the index, if it is indexed.
+
+        Args:
+            key (str): The key of the text, e.g. the item url.
+        """
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for bucket in self.get_bands(signature):
+            keys = self.buckets[bucket]
+            keys.remove(key)
+            if not keys:
+                del self.buckets[bucket]
+        if self.journal is not None:
+            self.journal.remove(key)
+
+    def query(self, text):
+        """Get the indexed texts that are similar to the input text.
+        Only the texts sharing at least one LSH band with it are compared, so the cost doesn't grow with the size of the index.
+
+        Args:
+            text (str): The text, e.g. an item description.
+
+        Returns:
+            list: A list of (key, estimated similarity) tuples, with a similarity above `self.threshold`, sorted from the most similar.
+        """
+        signature = self.signature(text)
+        if not signature:
+            return []
+        candidates = set()
+        for bucket in self.get_bands(signature):
+            candidates.update(self.buckets.get(bucket, ()))
+        matches = []
+        for key in candidates:
+            similarity = (
+                sum(a == b for a, b in zip(signature, self.signatures[key]))
+                / self.num_perm
+            )
+            if similarity >= self.threshold:
+                matches.append((key, similarity))
+        return sorted(matches, key=lambda match: -match[1])
+
+    def is_near_duplicate(self, text):
+        """Return True if a similar text has already been indexed.
+
+        Args:
+            text (str): The text, e.g. an item description.
+        """
+        return bool(self.query(text))
+
+    def load(self):
+        """Load the signatures persisted at `self.path`, if any, and rebuild the LSH buckets."""
+        if self.journal is None:
+            return
+        # Signatures of other parameters are not comparable: they will be rebuilt from the database
+        signatures = self.journal.load() or {}
+        for key, signature in signatures.items():
+            self.insert(key, signature)
+
+    def save(self):
+        """Persist the changes of the signatures since the last save, after merging the ones saved by the other scrapers of the database."""
+        if self.journal is not None:
+            self.journal.save(lambda: self.signatures, self.merge)
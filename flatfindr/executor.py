@@ -0,0 +1,177 @@
+import threading
+from collections import deque
+
+MAX_WORKERS = 3  # Maximum number of scrapes running at the same time
+MAX_QUEUED = 20  # Maximum number of scrapes waiting for a worker
+
+"""
+A bounded executor for the scrapes of the bot.
+A scrape takes minutes: running it inside a job of the bot would delay the other jobs and make the bot sluggish.
+Instead, the job only submits the scrape, which is run by a fixed number of worker threads pulling from a bounded work queue.
+Each scrape is submitted for some keys (e.g. chat ids): a key never has two scrapes in flight, and can be cancelled at any time, then restarted once free.
+"""
+
+
+class Task:
+    def __init__(self, fn, keys):
+        """
+        Args:
+            fn (callable): The function to run, called with the task as its only argument.
+            keys (list): The keys (e.g. chat ids) the task is run for.
+        """
+        self.fn = fn
+        self.keys = set(keys)
+        # Set once the task has been cancelled for all its keys
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+    def discard(self, key):
+        """Cancel the task for a key. The task is cancelled once it has no key left.
+
+        Args:
+            key (hashable): The key, e.g. a chat id.
+        """
+        self.keys.discard(key)
+        if not self.keys:
+            self.cancelled.set()
+
+
+class ScrapeExecutor:
+    def __init__(self, max_workers=MAX_WORKERS, max_queued=MAX_QUEUED):
+        """
+        Args:
+            max_workers (int): The number of worker threads, i.e. the maximum number of scrapes running at the same time. Defaults to MAX_WORKERS.
+            max_queued (int): The maximum number of scrapes waiting for a worker. Defaults to MAX_QUEUED.
+        """
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.queue = deque()
+        self.in_flight = {}  # {key: task} for the queued and running tasks
+        # {key: function} called once the running task cancelled for the key is over, see `cancel()`
+        self.restarts = {}
+        self.closed = False
+        self.condition = threading.Condition()
+        self.workers = [
+            threading.Thread(target=self.work, daemon=True) for _ in range(max_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.queue)
+
+    def is_busy(self, key):
+        """Return True if a task is queued or running for a key.
+
+        Args:
+            key (hashable): The key, e.g. a chat id.
+        """
+        with self.condition:
+            return key in self.in_flight
+
+    def submit(self, fn, keys):
+        """Queue a task, without waiting for it to run.
+        The task is refused if one of its keys already has a task in flight, or if the work queue is full.
+
+        Args:
+            fn (callable): The function to run, called with the task as its only argument. It can check `task.cancelled` and `task.keys` to stop early.
+            keys (list): The keys (e.g. chat ids) the task is run for.
+
+        Returns:
+            Task: The queued task, or None if it has been refused.
+        """
+        with self.condition:
+            if (
+                self.closed
+                or len(self.queue) >= self.max_queued
+                or any(key in self.in_flight for key in keys)
+            ):
+                return None
+            task = Task(fn, keys)
+            for key in task.keys:
+                self.in_flight[key] = task
+            self.queue.append(task)
+            self.condition.notify()
+        return task
+
+    def cancel(self, key, restart=None):
+        """Cancel the task in flight for a key. A queued task with no key left is dropped, a running one is notified through `task.cancelled`.
+        The key stays busy until the running task is over, so that a new task for it never runs alongside the cancelled one (e.g. both saving the same database).
+
+        Args:
+            key (hashable): The key, e.g. a chat id.
+            restart (callable): A function called without arguments once the key is free, e.g. to submit a new task for it: right away if no task is running for it,
+                else by the worker once the running task is over. It replaces the one given by a previous cancel, if it has not been called yet. Defaults to None.
+
+        Returns:
+            bool: True if a task was in flight for this key.
+        """
+        with self.condition:
+            task = self.in_flight.get(key)
+            cancelled = task is not None and key in task.keys
+            if cancelled:
+                task.discard(key)
+                if task in self.queue:
+                    del self.in_flight[key]
+                    if task.cancelled.is_set():
+                        self.queue.remove(task)
+                        task.done.set()
+            self.restarts.pop(key, None)
+            if restart is not None and key in self.in_flight:
+                self.restarts[key] = restart
+                restart = None
+        if restart is not None:
+            restart()
+        return cancelled
+
+    def work(self):
+        """Loop of a worker thread: run the queued tasks one by one until the executor is closed."""
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                task = self.queue.popleft()
+            try:
+                task.fn(task)
+            except Exception as e:
+                print(f"Error while running a scrape: {e}")
+            finally:
+                with self.condition:
+                    # Including the keys the task has been cancelled for while running
+                    keys = [
+                        key for key, other in self.in_flight.items() if other is task
+                    ]
+                    for key in keys:
+                        del self.in_flight[key]
+                    restarts = [
+                        self.restarts.pop(key) for key in keys if key in self.restarts
+                    ]
+                for restart in restarts:
+                    try:
+                        restart()
+                    except Exception as e:
+                        print(f"Error while restarting a scrape: {e}")
+                task.done.set()
+
+    def close(self, wait=True):
+        """Cancel all the tasks in flight and stop the workers once their running task is over.
+
+        Args:
+            wait (bool): Set to False to return without waiting for the running tasks. Defaults to True.
+        """
+        with self.condition:
+            self.closed = True
+            for task in set(self.in_flight.values()):
+                task.cancelled.set()
+            for task in self.queue:
+                task.done.set()
+            self.queue.clear()
+            self.in_flight.clear()
+            self.restarts.clear()
+            self.condition.notify_all()
+        if wait:
+            for worker in self.workers:
+                worker.join()
@@ -1,8 +1,8 @@
 # facebook marketplace
-import random
-from datetime import date, timedelta
-from time import sleep
+from datetime import date, datetime, timedelta
 
+from flatfindr.filters import DEFAULT_RULES
+from flatfindr.payload import LISTING_KEY, extract_item_details
 from flatfindr.scraper import Scraper, ONE_WEEK
 
 from selenium.webdriver.common.by import By
@@ -10,6 +10,12 @@ from selenium.webdriver.common.by import By
 
 MAX_SURFACE = 200  # The max apartment surface after which it is considered that the surface is actually in square feet and not square metre.
 WEBSITE_NAME = "facebook"
+SESSION_COOKIE = "c_user"  # Only set once logged in
+ITEM_LINK = "/marketplace/item/"
+SCROLL_TIMEOUT = 5  # Maximum number of seconds to wait for new ads after a scroll
+SCROLL_PATIENCE = 2  # Number of consecutive scrolls without unseen ads after which the scrolling stops
+# The item details that must be found in the page payload, else the rendered texts of the page are parsed as well
+PAYLOAD_FEATURES = ("published", "price", "bedrooms", "description")
 KEYWORDS = {
     "published": "Mis en vente il y a ",
     "price": "$ / mois",
@@ -24,8 +30,55 @@ KEYWORDS = {
     "montreal": "Montréal, QC",
     "see_more": "Voir plus",
     "see_less": "Voir moins",
-    "next_img": "Voir l’image suivante",
 }
+# The sizes of the pictures of the apartment shown by the gallery
+IMAGE_SIZES = ("p720x720", "s960x960")
+# The smaller pictures of the gallery (e.g. its thumbnails strip) are kept if at least this wide, unlike the profile pictures
+MIN_IMAGE_WIDTH = 100
+
+# Click on every 'see more' button, give the page a moment to render the full description,
+# then return the text of every <span dir> element. Runs as a single webdriver round-trip.
+EXTRACT_DETAILS_SCRIPT = """
+const seeMore = arguments[0];
+const callback = arguments[arguments.length - 1];
+let clicked = false;
+for (const button of document.querySelectorAll("div[role='button']")) {
+    if (button.innerText === seeMore) {
+        button.click();
+        clicked = true;
+    }
+}
+const collect = () => callback(
+    Array.from(document.querySelectorAll("span[dir]"), (span) => span.innerText)
+);
+clicked ? setTimeout(collect, 500) : collect();
+"""
+
+# Return true once a <span dir> with the publication date or the description title is rendered
+ITEM_READY_SCRIPT = """
+return Array.from(document.querySelectorAll("span[dir]")).some(
+    (span) => span.innerText.includes(arguments[0]) || span.innerText === arguments[1]
+);
+"""
+# Return the deduplicated src of the gallery pictures, instead of clicking through the gallery one picture at a time
+GALLERY_SCRIPT = """
+const sizes = arguments[0];
+const minWidth = arguments[1];
+const images = new Set();
+for (const img of document.querySelectorAll("img[referrerpolicy='origin-when-cross-origin']")) {
+    if (sizes.some((size) => img.src.includes(size)) || img.naturalWidth >= minWidth) {
+        images.add(img.src);
+    }
+}
+return Array.from(images);
+"""
+LOGGED_IN_SCRIPT = "return document.getElementById('email') === null;"
+# Return the JSON payloads of the page that contain a given key
+PAYLOADS_SCRIPT = """
+return Array.from(
+    document.querySelectorAll("script[type='application/json']"), (script) => script.textContent
+).filter((payload) => payload.includes(arguments[0]));
+"""
 
 """
 Class for scraping the Facebook Marketplace, which inherits from the Scraper Class.
@@ -41,6 +94,13 @@ class Facebook(Scraper):
         Args:
             headless (bool): Set to False if you want the browser to run with a GUI (meaning a window will pop-up). Defaults to True.
             db_path (str): The path to the JSON database. Defaults to ./saves/db.json from the root of the flatfindr library.
+            lease (flatfindr.pool.Lease): A webdriver leased from a `flatfindr.pool.DriverPool`, used instead of launching a new browser. Defaults to None.
+            politeness (flatfindr.politeness.Politeness): The delays to respect between actions. Defaults to None, meaning the default `Politeness()`.
+            cancelled (threading.Event): An event set from another thread to stop the run early. Defaults to None.
+            metrics (flatfindr.metrics.Metrics): The metrics the timers and counters of the runs are added to. Defaults to None, meaning the metrics written inside ./saves/metrics.
+            retention (flatfindr.retention.Retention): The policy removing the old items from the database. Defaults to None, meaning the default `Retention()`.
+            geocoder (flatfindr.geocoding.Geocoder): The geocoder of the addresses of the new items without coordinates. Defaults to None, meaning the default `Geocoder()`.
+            thumbnails (flatfindr.thumbnails.ThumbnailCache): The cache where the thumbnails of the new items images are downloaded. Defaults to None, meaning no thumbnails.
         """
         super().__init__(website=WEBSITE_NAME, **kwargs)
 
@@ -50,19 +110,30 @@ class Facebook(Scraper):
         try:
             email_input = self.driver.find_element(By.ID, "email")
             email_input.send_keys(self.email)
-            sleep(random.uniform(0.2, 0.5))
+            self.politeness.pause("typing")
             password_input = self.driver.find_element(By.ID, "pass")
             password_input.send_keys(self.password)
-            sleep(random.uniform(0.2, 0.5))
+            self.politeness.pause("typing")
             login_button = self.driver.find_element(By.XPATH, "//*[@type='submit']")
             login_button.click()
-            sleep(random.uniform(2, 3))
-            # self.save_cookies()
+            # Wait for the log in form to be gone
+            self.wait_for(lambda driver: driver.execute_script(LOGGED_IN_SCRIPT))
+            if self.is_logged_in():
+                self.save_cookies()
         except Exception:
             print(
                 "Some exception occurred while trying to find username or password field"
             )
 
+    def is_logged_in(self):
+        """Return True if the webdriver is logged in: the session cookie is set and the log in form is not displayed."""
+        try:
+            return self.driver.get_cookie(SESSION_COOKIE) is not None and bool(
+                self.driver.execute_script(LOGGED_IN_SCRIPT)
+            )
+        except:
+            return False
+
     def get_items_links(
         self,
         min_price,
@@ -72,6 +143,7 @@ class Facebook(Scraper):
         lng,
         radius,
         scroll,
+        scroll_patience=SCROLL_PATIENCE,
     ):
         """Get links (i.e. url) of ads matching the search criteria.
 
@@ -82,7 +154,8 @@ class Facebook(Scraper):
             lat (float): The latitude of your prefered position for your next apartment.
             lng (float): The longitude of your prefered position for your next apartment.
             radius (int): The radius around your prefered position, in km.
-            scroll (int): The number of scrollings you want to do before stopping looking for new ads.
+            scroll (int): The maximum number of scrollings you want to do before stopping looking for new ads.
+            scroll_patience (int): The number of consecutive scrollings without any unseen ad after which the scrolling stops early. Defaults to SCROLL_PATIENCE.
 
         Returns:
             list: A list of all the flats url (or items links) that match the search criteria.
@@ -91,30 +164,42 @@ class Facebook(Scraper):
         price = f"minPrice={min_price}&maxPrice={max_price}"
         bedrooms = f"&minBedrooms={min_bedrooms}"
         pos = f"&exact=false&latitude={lat}&longitude={lng}&radius={radius}"
+        self.politeness.pause("page")
         self.driver.get(self.main_url + rentals + price + bedrooms + pos)
-        sleep(random.uniform(2, 2.5))
-
-        for _ in range(scroll):
-            try:
-                self.driver.execute_script(
-                    "window.scrollTo(0, document.body.scrollHeight);"
-                )
-                sleep(random.uniform(1.5, 2))
-            except:
-                pass
-
-        all_href = self.driver.find_elements(By.XPATH, "//a[@href]")
-        seen_links = [data[0] for data in self.db["data"]]
-        for item in all_href:
+        # Wait for the first feed cards
+        self.wait_for(lambda driver: self.count_links(ITEM_LINK) > 0)
+        # Add the links of the items that have never been scraped before.
+        # Then scroll until `scroll_patience` consecutive screens bring no unseen ad
+        idle_scrolls = 0 if self.add_items_links(self.harvest_links(ITEM_LINK)) else 1
+        self.scrolls_saved = 0
+        for i in range(scroll):
+            if idle_scrolls >= scroll_patience:
+                self.scrolls_saved = scroll - i
+                break
             try:
-                item_url = item.get_attribute("href")
-                if "/marketplace/item/" in item_url:
-                    item_url = item_url[: item_url.find("?")]
-                    # If this item has never been scraped before, we add it
-                    if item_url not in seen_links and item_url not in self.items_links:
-                        self.items_links.append(item_url)
+                links_cnt = self.count_links(ITEM_LINK)
+                self.politeness.pause("scroll")
+                with self.report.timer("scroll"):
+                    self.driver.execute_script(
+                        "window.scrollTo(0, document.body.scrollHeight);"
+                    )
+                    # Wait for new feed cards to be rendered
+                    self.wait_for(
+                        lambda driver: self.count_links(ITEM_LINK) > links_cnt,
+                        timeout=SCROLL_TIMEOUT,
+                    )
+                if self.add_items_links(self.harvest_links(ITEM_LINK)):
+                    idle_scrolls = 0
+                else:
+                    idle_scrolls += 1
             except:
-                pass
+                idle_scrolls += 1
+        self.report.count("scrolls_saved", self.scrolls_saved)
+        if self.scrolls_saved:
+            print(
+                f"{date.today().strftime('%Y-%m-%d')} {datetime.now().strftime('%H:%M:%S')} - "
+                f"{self.scrolls_saved}/{scroll} scrolls saved"
+            )
 
         return self.items_links
 
@@ -214,63 +299,27 @@ class Facebook(Scraper):
         return detail.replace(KEYWORDS["see_less"], "")
 
     def get_item_images(self):
-        """Get the item images/photos/pictures, as url.
+        """Get the item images/photos/pictures, as url, read from the gallery of the page in a single webdriver call.
 
         Returns:
             list: A list of all the item images url.
         """
-        images = []
-        cnt = 0
-        while cnt < 30:
-            # to avoid infinite loop, we stop after 30 clicks
-            try:
-                img = self.driver.find_element(
-                    By.XPATH, "//img[@referrerpolicy='origin-when-cross-origin']"
-                )
-                img_url = img.get_attribute("src")
-                if any(size in img_url for size in ("p720x720", "s960x960")):
-                    # If a picture of the apartment
-                    if img_url not in images:  # if unseen
-                        images.append(img_url)
-                    else:
-                        break  # if already seen
-            except:
-                print("Error while scraping images")
-            cnt += 1
-            try:
-                next_button = self.driver.find_element(
-                    By.XPATH, f"//div[@aria-label='{KEYWORDS['next_img']}']"
-                )
-                next_button.click()
-                sleep(random.uniform(1, 1.2))
-            except:  # only 1 picture for this ad so there is no next button
-                break
-        return images
+        try:
+            return self.driver.execute_script(
+                GALLERY_SCRIPT, IMAGE_SIZES, MIN_IMAGE_WIDTH
+            )
+        except:
+            print("Error while scraping images")
+            return []
 
-    def get_item_details(self, item_url, remove_swap=True, remove_first_floor=True):
-        """Go to the item url with the webdriver and scrap as much details as possible about the item.
+    def parse_item_details(self, item_details, details):
+        """Fill the item details from the texts of the item page.
 
         Args:
-            item_url (str): The url (or link) of the item.
-            remove_swap (bool): Set to False if you want to see ads about swaping apartments. Defaults to True.
-            remove_first_floor (bool): Set to False if you want to see ads with flats on ground floor. Defaults to True.
-
-        Returns:
-            dict: A dictionnary with all the item details.
+            item_details (dict): A dictionnary with the item details, updated in place.
+            details (list): The texts of all the `<span dir>` elements of the item page, in document order.
         """
-        item_details = super().get_item_details(item_url)
-        sleep(random.uniform(2, 2.5))
-
-        buttons = self.driver.find_elements(By.XPATH, "//div[@role='button']")
-        # Click on 'see more' button to get the full description
-        _ = [
-            button.click() for button in buttons if button.text == KEYWORDS["see_more"]
-        ]
-        sleep(random.uniform(0.4, 0.6))
-
-        details = self.driver.find_elements(By.XPATH, "//span[@dir]")
-        for i in range(len(details)):
-            detail = details[i].text
+        for i, detail in enumerate(details):
             if not item_details.get("published") and KEYWORDS["published"] in detail:
                 item_details["published"] = self.get_item_publication_date(detail)
             elif not item_details.get("price") and KEYWORDS["price"] in detail:
@@ -288,25 +337,57 @@ class Facebook(Scraper):
             elif (
                 not item_details.get("description")
                 and detail == KEYWORDS["description"]
+                and i + 1 < len(details)
             ):
-                detail = details[i + 1].text
-                item_details["description"] = self.get_item_description(detail)
-
-        if any(
-            (
-                self.is_old(item_details),
-                self.is_duplicate(item_details),
-                self.is_swap(item_details) and remove_swap,
-                self.is_first_floor(item_details) and remove_first_floor,
+                item_details["description"] = self.get_item_description(details[i + 1])
+
+    def scrape_item_details(self, item_url):
+        """Go to the item url with the webdriver and scrap as much details as possible about the item.
+        The details are read from the JSON payload of the page (see `flatfindr.payload`). If some of PAYLOAD_FEATURES are missing, the rendered texts of the page are parsed as well.
+        Whether the item is interesting is decided afterwards, see `Scraper.classify_item()`.
+
+        Args:
+            item_url (str): The url (or link) of the item.
+
+        Returns:
+            dict: A dictionnary with all the item details.
+        """
+        item_details = super().scrape_item_details(item_url)
+        # Read the details from the JSON payload of the page first
+        try:
+            payloads = self.driver.execute_script(PAYLOADS_SCRIPT, f'"{LISTING_KEY}"')
+        except:
+            print("Error while reading the payload of the page")
+            payloads = []
+        payload = extract_item_details(payloads)
+        if "furnished" in payload:
+            payload["furnished"] = KEYWORDS["furnished"][
+                0 if payload["furnished"] else 1
+            ]
+        item_details.update(payload)
+        if not item_details.get("images"):
+            item_details["images"] = self.get_item_images()
+        # A 0 bedroom (studio) or an empty description are found as well
+        if all(feature in item_details for feature in PAYLOAD_FEATURES):
+            return item_details
+
+        # Else, wait for the item details to be rendered
+        self.wait_for(
+            lambda driver: driver.execute_script(
+                ITEM_READY_SCRIPT, KEYWORDS["published"], KEYWORDS["description"]
             )
-        ):
-            # We are not interested by this ads
-            item_details["state"] = "NI"
-            item_details["description"] = ""
-            item_details["images"] = []
-        else:
-            item_details["state"] = "new"
-            item_details["images"] = []  # self.get_item_images()
+        )
+
+        # Click on 'see more' button to get the full description, then get the text of every span, in a single webdriver call
+        details = self.driver.execute_async_script(
+            EXTRACT_DETAILS_SCRIPT, KEYWORDS["see_more"]
+        )
+        # Only the details missing from the payload are parsed
+        self.parse_item_details(item_details, details)
+        if not item_details["images"]:
+            # The gallery may not have been rendered yet when first read
+            item_details["images"] = self.get_item_images()
+
         return item_details
 
     def run(
@@ -320,6 +401,9 @@ class Facebook(Scraper):
         lng=-73.5724,
         radius=2,
         scroll=10,
+        scroll_patience=SCROLL_PATIENCE,
+        rules=DEFAULT_RULES,
+        workers=1,
     ):
         """Main method to run a full search : log in, get links, scrap all the links, update the database with the new ads, quit the webdriver.
 
@@ -332,7 +416,10 @@ class Facebook(Scraper):
             lat (float): The latitude of your prefered position for your next apartment. Defaults to 45.5254.
             lng (float): The longitude of your prefered position for your next apartment. Defaults to -73.5724.
             radius (int): The radius around your prefered position, in km. Defaults to 2.
-            scroll (int): The number of scrollings you want to do before stopping looking for new ads. Defaults to 10.
+            scroll (int): The maximum number of scrollings you want to do before stopping looking for new ads. Defaults to 10.
+            scroll_patience (int): The number of consecutive scrollings without any unseen ad after which the scrolling stops early. Defaults to SCROLL_PATIENCE.
+            rules (flatfindr.filters.RuleSet): The filter rules applied to the items descriptions. Defaults to DEFAULT_RULES (no swaps, no ground floors).
+            workers (int): The number of webdrivers scraping the items pages at the same time. Defaults to 1.
 
         Returns:
             list: A list of all the string or html representations of the items details. It is usefull for printing all the details from the new flats you found.
@@ -347,4 +434,7 @@ class Facebook(Scraper):
             lng=lng,
             radius=radius,
             scroll=scroll,
+            scroll_patience=scroll_patience,
+            rules=rules,
+            workers=workers,
         )
@@ -0,0 +1,148 @@
+import re
+import unicodedata
+
+SWAP = ("swap", "transfer", "échange", "exchange")
+FIRST_FLOOR = (
+    "ground floor",
+    "first floor",
+    "rdc",
+    "rez-de-chaussée",
+    "rez de chaussée",
+)
+EXCLUDE = "exclude"
+INCLUDE = "include"
+
+"""
+Filter engine for the items descriptions.
+A RuleSet holds named rules, each with a list of phrases. An `exclude` rule marks the item as not interesting as soon as one of its phrases is found,
+while `include` rules require at least one of their phrases to be found.
+The phrases of all the rules are compiled into a single regular expression, and a description is normalized (case and accents) and scanned only once.
+As phrases can overlap (e.g. 'rez-de-chaussee' and 'chaussee'), the expression only looks ahead: it matches at every position where a phrase starts, with one optional group per rule, so that every rule found there is reported.
+"""
+
+
+def normalize(text):
+    """Normalize a text so that matching is insensitive to case, accents and repeated whitespaces.
+
+    Args:
+        text (str): The text to normalize, e.g. 'Rez-de-Chaussée'.
+
+    Returns:
+        str: The normalized text, e.g. 'rez-de-chaussee'.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.split())
+
+
+class Rule:
+    def __init__(self, name, phrases, action=EXCLUDE):
+        """
+        Args:
+            name (str): The name of the rule, e.g. 'swap'.
+            phrases (list): The phrases triggering the rule, e.g. ['swap', 'échange'].
+            action (str): EXCLUDE or INCLUDE. Defaults to EXCLUDE.
+        """
+        if action not in (EXCLUDE, INCLUDE):
+            raise ValueError(f"`action` should be '{EXCLUDE}' or '{INCLUDE}'")
+        self.name = name
+        self.phrases = tuple(phrases)
+        self.action = action
+
+
+class FilterResult:
+    def __init__(self, fired, excluded):
+        """
+        Args:
+            fired (list): The names of the rules whose phrases have been found.
+            excluded (bool): True if the item is not interesting according to the rules.
+        """
+        self.fired = fired
+        self.excluded = excluded
+
+    def __bool__(self):
+        return self.excluded
+
+    def __repr__(self):
+        return f"FilterResult(fired={self.fired}, excluded={self.excluded})"
+
+
+class RuleSet:
+    def __init__(self, rules=()):
+        """
+        Args:
+            rules (list): The rules of the set. Defaults to ().
+        """
+        self.rules = list(rules)
+        self.compile()
+
+    def compile(self):
+        """Compile the phrases of all the rules into a single regular expression, `self.pattern`.
+        Its group `r<i>` is the phrase of the i-th rule of `self.names` starting at the matched position, if any.
+        """
+        self.names = []  # The names of the rules with phrases, by group index
+        alternations = []
+        for rule in self.rules:
+            phrases = sorted(
+                {normalize(phrase) for phrase in rule.phrases if phrase.strip()},
+                key=len,
+                reverse=True,
+            )
+            if phrases:
+                self.names.append(rule.name)
+                alternations.append("|".join(map(re.escape, phrases)))
+        self.pattern = None
+        if alternations:
+            # Only the positions where a phrase starts are matched, then each rule is tried there
+            self.pattern = re.compile(
+                f"(?={'|'.join(alternations)})"
+                + "".join(
+                    f"(?=(?P<r{i}>{alternation})?)"
+                    for i, alternation in enumerate(alternations)
+                )
+            )
+        self.includes = {rule.name for rule in self.rules if rule.action == INCLUDE}
+
+    def extend(self, exclude=(), include=(), name="user"):
+        """Get a new rule set with additional phrases, e.g. supplied by a user.
+
+        Args:
+            exclude (list): The phrases marking an item as not interesting. Defaults to ().
+            include (list): The phrases of which at least one must be found. Defaults to ().
+            name (str): The prefix of the names of the new rules. Defaults to 'user'.
+
+        Returns:
+            RuleSet: The new rule set.
+        """
+        rules = list(self.rules)
+        if exclude:
+            rules.append(Rule(f"{name}_{EXCLUDE}", exclude, EXCLUDE))
+        if include:
+            rules.append(Rule(f"{name}_{INCLUDE}", include, INCLUDE))
+        return RuleSet(rules)
+
+    def evaluate(self, text):
+        """Find which rules fire on a text, even if their phrases overlap.
+
+        Args:
+            text (str): The text, e.g. an item description.
+
+        Returns:
+            FilterResult: The names of the rules that fired, and whether the item should be excluded.
+        """
+        fired = set()
+        if self.pattern is not None and text:
+            for match in self.pattern.finditer(normalize(text)):
+                for group in match.groupdict():
+                    if match.group(group) is not None:
+                        fired.add(self.names[int(group[1:])])
+                if len(fired) == len(self.names):
+                    break
+        fired_rules = [rule for rule in self.rules if rule.name in fired]
+        excluded = any(rule.action == EXCLUDE for rule in fired_rules) or bool(
+            self.includes and not self.includes & fired
+        )
+        return FilterResult([rule.name for rule in fired_rules], excluded)
+
+
+DEFAULT_RULES = RuleSet([Rule("swap", SWAP), Rule("first_floor", FIRST_FLOOR)])
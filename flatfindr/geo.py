@@ -0,0 +1,244 @@
+from math import cos, radians
+
+from flatfindr.planner import haversine
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+MAX_PRECISION = 7  # Cells of about 150 m
+KM_PER_DEGREE = 111.2  # Length of a degree of latitude
+
+"""
+Spatial indexes of the listings and of the users search circles, over a hierarchical geohash grid.
+A geohash of precision p is the cell of the grid containing a point, and its prefixes are the larger cells containing that cell.
+Each index holds its entries at every precision (points) or at the precision fitting their size (circles),
+so that a query only looks at a handful of cells instead of all the entries, whatever the number of listings and users.
+"""
+
+
+def encode(lat, lng, precision=MAX_PRECISION):
+    """Get the geohash of a point.
+
+    Args:
+        lat (float): The latitude of the point.
+        lng (float): The longitude of the point.
+        precision (int): The number of characters of the geohash. Defaults to MAX_PRECISION.
+
+    Returns:
+        str: The geohash, e.g. 'f25dvk' for Montreal.
+    """
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash = ""
+    bits, bit, even = 0, 0, True
+    while len(geohash) < precision:
+        value, value_range = (lng, lng_range) if even else (lat, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            value_range[0] = middle
+        else:
+            bits = bits * 2
+            value_range[1] = middle
+        even = not even
+        bit += 1
+        if bit == 5:
+            geohash += BASE32[bits]
+            bits, bit = 0, 0
+    return geohash
+
+
+def get_cell_size(precision):
+    """Get the size of the cells of a precision.
+
+    Args:
+        precision (int): The number of characters of the geohashes.
+
+    Returns:
+        tuple: The height and width of a cell, in degrees of latitude and longitude.
+    """
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180 / 2**lat_bits, 360 / 2**lng_bits
+
+
+def get_precision(lat, radius):
+    """Get the finest precision whose cells are larger than a circle, so that it is covered by a few cells only.
+
+    Args:
+        lat (float): The latitude of the center of the circle.
+        radius (float): The radius of the circle, in km.
+
+    Returns:
+        int: The precision, between 1 and MAX_PRECISION.
+    """
+    for precision in range(MAX_PRECISION, 0, -1):
+        height, width = get_cell_size(precision)
+        height_km = height * KM_PER_DEGREE
+        width_km = width * KM_PER_DEGREE * max(cos(radians(lat)), 0.01)
+        if min(height_km, width_km) >= radius:
+            return precision
+    return 1
+
+
+def get_covering_cells(lat, lng, radius, precision):
+    """Get the cells covering the bounding box of a circle.
+
+    Args:
+        lat (float): The latitude of the center of the circle.
+        lng (float): The longitude of the center of the circle.
+        radius (float): The radius of the circle, in km.
+        precision (int): The precision of the cells.
+
+    Returns:
+        set: The geohashes of the cells.
+    """
+    height, width = get_cell_size(precision)
+    d_lat = radius / KM_PER_DEGREE
+    d_lng = min(radius / (KM_PER_DEGREE * max(cos(radians(lat)), 0.01)), 180)
+    min_lat, max_lat = max(lat - d_lat, -90), min(lat + d_lat, 90 - 1e-9)
+    cells = set()
+    cell_lat = min_lat
+    while True:
+        cell_lng = lng - d_lng
+        while True:
+            wrapped_lng = (cell_lng + 180) % 360 - 180
+            cells.add(encode(cell_lat, wrapped_lng, precision))
+            if cell_lng >= lng + d_lng:
+                break
+            cell_lng = min(cell_lng + width, lng + d_lng)
+        if cell_lat >= max_lat:
+            break
+        cell_lat = min(cell_lat + height, max_lat)
+    return cells
+
+
+class PointIndex:
+    """Index of points, e.g. the coordinates of the listings, answering "which points fall inside this circle?"."""
+
+    def __init__(self):
+        self.points = {}  # {key: (lat, lng)}
+        self.cells = {}  # {geohash of any precision: set of keys}
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, key):
+        return key in self.points
+
+    def add(self, key, lat, lng):
+        """Add a point, or move it if the key is already indexed.
+
+        Args:
+            key: The key of the point, e.g. the item url.
+            lat (float): The latitude of the point.
+            lng (float): The longitude of the point.
+        """
+        if key in self.points:
+            self.remove(key)
+        self.points[key] = (lat, lng)
+        geohash = encode(lat, lng)
+        for precision in range(1, MAX_PRECISION + 1):
+            self.cells.setdefault(geohash[:precision], set()).add(key)
+
+    def remove(self, key):
+        """Remove a point, if it is indexed.
+
+        Args:
+            key: The key of the point.
+        """
+        point = self.points.pop(key, None)
+        if point is None:
+            return
+        geohash = encode(*point)
+        for precision in range(1, MAX_PRECISION + 1):
+            keys = self.cells[geohash[:precision]]
+            keys.discard(key)
+            if not keys:
+                del self.cells[geohash[:precision]]
+
+    def within(self, lat, lng, radius):
+        """Get the points inside a circle.
+
+        Args:
+            lat (float): The latitude of the center of the circle.
+            lng (float): The longitude of the center of the circle.
+            radius (float): The radius of the circle, in km.
+
+        Returns:
+            list: A list of (key, distance in km) tuples, from the closest.
+        """
+        precision = get_precision(lat, radius)
+        candidates = set()
+        for cell in get_covering_cells(lat, lng, radius, precision):
+            candidates.update(self.cells.get(cell, ()))
+        points = []
+        for key in candidates:
+            distance = haversine(lat, lng, *self.points[key])
+            if distance <= radius:
+                points.append((key, distance))
+        return sorted(points, key=lambda point: point[1])
+
+
+class CircleIndex:
+    """Index of circles, e.g. the search areas of the users, answering "which circles contain this point?"."""
+
+    def __init__(self):
+        self.circles = {}  # {key: (lat, lng, radius)}
+        self.cells = {}  # {geohash of the precision fitting the circle: set of keys}
+
+    def __len__(self):
+        return len(self.circles)
+
+    def __contains__(self, key):
+        return key in self.circles
+
+    def get_cells(self, lat, lng, radius):
+        return get_covering_cells(lat, lng, radius, get_precision(lat, radius))
+
+    def add(self, key, lat, lng, radius):
+        """Add a circle, or replace it if the key is already indexed.
+
+        Args:
+            key: The key of the circle, e.g. a chat id.
+            lat (float): The latitude of the center of the circle.
+            lng (float): The longitude of the center of the circle.
+            radius (float): The radius of the circle, in km.
+        """
+        if key in self.circles:
+            self.remove(key)
+        self.circles[key] = (lat, lng, radius)
+        for cell in self.get_cells(lat, lng, radius):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        """Remove a circle, if it is indexed.
+
+        Args:
+            key: The key of the circle.
+        """
+        circle = self.circles.pop(key, None)
+        if circle is None:
+            return
+        for cell in self.get_cells(*circle):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def containing(self, lat, lng):
+        """Get the circles containing a point.
+
+        Args:
+            lat (float): The latitude of the point.
+            lng (float): The longitude of the point.
+
+        Returns:
+            list: The keys of the circles.
+        """
+        geohash = encode(lat, lng)
+        candidates = set()
+        for precision in range(1, MAX_PRECISION + 1):
+            candidates.update(self.cells.get(geohash[:precision], ()))
+        return [
+            key
+            for key in candidates
+            if haversine(lat, lng, *self.circles[key][:2]) <= self.circles[key][2]
+        ]
@@ -0,0 +1,340 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from geopy.geocoders import Nominatim
+
+USER_AGENT = "flatfindr"
+# Appended to the items addresses, which don't hold the city
+DEFAULT_REGION = "Montréal, QC"
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    os.path.join("saves", "geocoding.json"),
+)
+CACHE_SIZE = 10000  # Maximum number of cached lookups, the oldest used evicted first
+CACHE_TTL = 90 * 24 * 3600  # Seconds a lookup is cached: addresses don't move
+NOT_FOUND_TTL = 24 * 3600  # Seconds a lookup without result is cached
+SAVE_EVERY = 20  # Number of new lookups after which the cache is persisted
+COORDINATES_DIGITS = 3  # The reverse lookups are rounded to about 100 m
+# Minimum number of seconds between two requests, see the Nominatim usage policy
+NOMINATIM_INTERVAL = 1
+KM_PER_DEGREE = 111.2
+
+"""
+Geocoding of the items addresses and of the users locations.
+A Geocoder puts a persistent cache in front of a pluggable backend:
+- the lookups are cached on disk (./saves/geocoding.json), keyed by the normalized address or by the rounded coordinates,
+  with a LRU eviction and a time to live, so that the same address is not looked up again. The new lookups are persisted in batches, and by `flush()`;
+- concurrent lookups of the same key wait for the first one instead of querying the backend again;
+- the backend is Nominatim (OpenStreetMap) by default, or a `LocalBackend` answering offline, e.g. for the tests and the benchmarks.
+"""
+
+
+def normalize_address(address):
+    """Normalize an address, so that the same address written differently gets the same cache key.
+
+    Args:
+        address (str): The address, e.g. "2212  Rue d'Iberville, Montréal, QC".
+
+    Returns:
+        str: The normalized address, e.g. "2212 rue d'iberville, montreal, qc".
+    """
+    address = unicodedata.normalize("NFKD", address)
+    address = "".join(char for char in address if not unicodedata.combining(char))
+    return " ".join(address.lower().replace("’", "'").split())
+
+
+class NominatimBackend:
+    """Geocode with Nominatim (OpenStreetMap), with at most one request every `interval` seconds."""
+
+    def __init__(self, user_agent=USER_AGENT, interval=NOMINATIM_INTERVAL):
+        """
+        Args:
+            user_agent (str): The user agent sent to Nominatim. Defaults to USER_AGENT.
+            interval (float): The minimum number of seconds between two requests. Defaults to NOMINATIM_INTERVAL.
+        """
+        self.client = Nominatim(user_agent=user_agent)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_request = 0
+
+    def wait(self):
+        with self.lock:
+            delay = self.last_request + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.last_request = time.monotonic()
+
+    def geocode(self, address):
+        self.wait()
+        location = self.client.geocode(address)
+        if location is None:
+            return None
+        return location.latitude, location.longitude
+
+    def reverse(self, lat, lng):
+        self.wait()
+        location = self.client.reverse(f"{lat},{lng}")
+        if location is None:
+            return {}
+        return location.raw.get("address", {})
+
+
+class LocalBackend:
+    """Geocode offline, from a list of known places. Meant for the tests and the benchmarks, which must not depend on the network."""
+
+    def __init__(self, places=(), center=None, delay=0):
+        """
+        Args:
+            places (list): The known places, as dictionnaries with an `address`, a `lat`, a `lng` and the components of the address (e.g. `city`). Defaults to ().
+            center (tuple): A (lat, lng) point. If given, an unknown address gets made-up (but stable) coordinates within 5 km of it, else it is not found. Defaults to None.
+            delay (float): The number of seconds each lookup takes, to stand in for the network. Defaults to 0.
+        """
+        self.places = list(places)
+        self.addresses = {
+            normalize_address(place["address"]): place for place in self.places
+        }
+        self.center = center
+        self.delay = delay
+        self.lookups_cnt = 0
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Get a local backend whose places are read from a JSON file (a list of places, see `__init__()`)."""
+        with open(path, "r", encoding="utf-8") as places_file:
+            return cls(json.load(places_file), **kwargs)
+
+    def geocode(self, address):
+        self.lookups_cnt += 1
+        time.sleep(self.delay)
+        place = self.addresses.get(normalize_address(address))
+        if place is not None:
+            return place["lat"], place["lng"]
+        if self.center is None:
+            return None
+        digest = hashlib.sha1(normalize_address(address).encode("utf-8")).digest()
+        angle = digest[0] / 256 * 2 * math.pi
+        distance = digest[1] / 256 * 5 / KM_PER_DEGREE
+        lat = self.center[0] + distance * math.sin(angle)
+        lng = self.center[1] + distance * math.cos(angle) / math.cos(
+            math.radians(self.center[0])
+        )
+        return round(lat, 6), round(lng, 6)
+
+    def reverse(self, lat, lng):
+        self.lookups_cnt += 1
+        time.sleep(self.delay)
+        if not self.places:
+            return {}
+        place = min(
+            self.places,
+            key=lambda place: (place["lat"] - lat) ** 2 + (place["lng"] - lng) ** 2,
+        )
+        return {
+            key: value
+            for key, value in place.items()
+            if key not in ("address", "lat", "lng")
+        }
+
+
+class GeocodingCache:
+    def __init__(
+        self, path=None, max_size=CACHE_SIZE, ttl=CACHE_TTL, save_every=SAVE_EVERY
+    ):
+        """
+        Args:
+            path (str): The path of the JSON file where the cache is persisted. If None, the cache lives in memory only. Defaults to None.
+            max_size (int): The maximum number of entries, the least recently used are evicted first. Defaults to CACHE_SIZE.
+            ttl (float): The number of seconds an entry is kept. Defaults to CACHE_TTL.
+            save_every (int): The number of new entries after which the cache is persisted. The others are persisted by `flush()`. Defaults to SAVE_EVERY.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.save_every = save_every
+        # {key: [value, expiry timestamp]}, from the least recently used
+        self.entries = OrderedDict()
+        self.unsaved = 0  # Number of entries put since the last save
+        self.lock = threading.Lock()
+        # Held while writing the file, so that the lookups don't wait for the disk
+        self.save_lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Get a cached value.
+
+        Args:
+            key (str): The key of the lookup.
+
+        Returns:
+            tuple: (True, value) if the key is cached and not expired, else (False, None).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[1] < time.time():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[0]
+
+    def put(self, key, value, ttl=None):
+        """Cache a value, evicting the least recently used entries if the cache is full. The cache is persisted every `self.save_every` new values.
+
+        Args:
+            key (str): The key of the lookup.
+            value: The value, which must be JSON serializable.
+            ttl (float): The number of seconds the entry is kept. Defaults to None, meaning `self.ttl`.
+        """
+        with self.lock:
+            expires = time.time() + (self.ttl if ttl is None else ttl)
+            self.entries[key] = [value, expires]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self.unsaved += 1
+            full = self.unsaved >= self.save_every
+        if full:
+            self.flush()
+
+    def load(self):
+        """Load the cache persisted at `self.path`, if any, without the expired entries."""
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as cache_file:
+                entries = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, value, expires in entries[-self.max_size :]:
+            if expires >= now:
+                self.entries[key] = [value, expires]
+
+    def flush(self):
+        """Persist the cache at `self.path` if some entries have been put since the last save, from the least recently used entry,
+        through a temporary file and an atomic rename.
+        """
+        if self.path is None:
+            return
+        with self.save_lock:
+            with self.lock:
+                if not self.unsaved:
+                    return
+                entries = [
+                    [key, value, expires]
+                    for key, (value, expires) in self.entries.items()
+                ]
+                unsaved, self.unsaved = self.unsaved, 0
+            tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as cache_file:
+                    json.dump(entries, cache_file)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Error while saving the geocoding cache to `{self.path}`: {e}")
+                with self.lock:
+                    self.unsaved += unsaved
+
+
+class Geocoder:
+    def __init__(
+        self,
+        backend=None,
+        region=DEFAULT_REGION,
+        cache_path=DEFAULT_CACHE_PATH,
+        max_size=CACHE_SIZE,
+        ttl=CACHE_TTL,
+    ):
+        """
+        Args:
+            backend: The geocoding backend, with a `geocode(address)` and a `reverse(lat, lng)` methods, e.g. `LocalBackend()`. Defaults to None, meaning `NominatimBackend()`.
+            region (str): The city and province appended to the addresses without them, e.g. 'Montréal, QC'. Defaults to DEFAULT_REGION.
+            cache_path (str): The path of the JSON file where the lookups are cached. If None, they are only cached in memory. Defaults to ./saves/geocoding.json from the package root.
+            max_size (int): The maximum number of cached lookups. Defaults to CACHE_SIZE.
+            ttl (float): The number of seconds a lookup is cached. Defaults to CACHE_TTL.
+        """
+        self.backend = backend or NominatimBackend()
+        self.region = region
+        self.cache = GeocodingCache(cache_path, max_size=max_size, ttl=ttl)
+        self.in_flight = {}  # {key: Future} of the lookups being made
+        self.lock = threading.Lock()
+
+    def flush(self):
+        """Persist the lookups cached since the last save, e.g. at the end of a run."""
+        self.cache.flush()
+
+    def lookup(self, key, fn, *args):
+        """Get the result of a lookup from the cache, or from the backend if it is not cached.
+        If the same lookup is already being made by another thread, wait for its result instead of making it again.
+
+        Args:
+            key (str): The cache key of the lookup.
+            fn (callable): The backend method making the lookup.
+            *args: The arguments of `fn`.
+
+        Returns:
+            The result of the lookup.
+        """
+        cached, value = self.cache.get(key)
+        if cached:
+            return value
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            value = fn(*args)
+            self.cache.put(key, value, ttl=None if value else NOT_FOUND_TTL)
+            future.set_result(value)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+        return value
+
+    def geocode(self, address):
+        """Get the coordinates of an address.
+
+        Args:
+            address (str): The address, e.g. '2212 Rue d'Iberville'.
+
+        Returns:
+            tuple: The (lat, lng) of the address, or None if it is not found.
+        """
+        if self.region and normalize_address(self.region) not in normalize_address(
+            address
+        ):
+            address = f"{address}, {self.region}"
+        coordinates = self.lookup(
+            f"geocode:{normalize_address(address)}", self.backend.geocode, address
+        )
+        return None if coordinates is None else tuple(coordinates)
+
+    def reverse(self, lat, lng):
+        """Get the address of a point. The coordinates are rounded to COORDINATES_DIGITS decimals, so that close points share the same lookup.
+
+        Args:
+            lat (float): The latitude of the point.
+            lng (float): The longitude of the point.
+
+        Returns:
+            dict: The components of the address (e.g. 'city', 'suburb', ...), empty if it is not found.
+        """
+        lat, lng = round(lat, COORDINATES_DIGITS), round(lng, COORDINATES_DIGITS)
+        return self.lookup(f"reverse:{lat},{lng}", self.backend.reverse, lat, lng)
@@ -0,0 +1,204 @@
+import json
+import os
+
+from flatfindr.storage import COMPACT_EVERY, JOURNAL_EXTENSION
+
+"""
+Persistence of the index files kept next to the database (see `flatfindr.dedup` and `flatfindr.phash`), the same way as `flatfindr.storage.JSONStorage`:
+a JSON snapshot of the entries (`path`), plus an append-only journal of the entries added or removed since (`path` + `.journal`), with one JSON line per change.
+Saving only appends the changes to the journal, so that its cost doesn't grow with the index.
+Every `compact_every` journaled changes, the journal is folded into a new snapshot, written to a temporary file then atomically renamed.
+Several writers may share the files, as long as they save one at a time: each save first merges the changes saved by the others since (see `pull()`).
+"""
+
+
+class JournaledDict:
+    def __init__(self, path, header, entries_key, compact_every=COMPACT_EVERY):
+        """
+        Args:
+            path (str): The path of the snapshot.
+            header (dict): The parameters the entries depend on, e.g. {"hash_size": 8}. The entries saved with other parameters are not loaded.
+            entries_key (str): The key of the entries inside the snapshot, e.g. 'hashes'.
+            compact_every (int): The number of journaled changes after which the journal is compacted into the snapshot. Defaults to COMPACT_EVERY.
+        """
+        self.path = path
+        self.journal_path = path + JOURNAL_EXTENSION
+        self.header = header
+        self.entries_key = entries_key
+        self.compact_every = compact_every
+        self.changes = {}  # {key: new value, or None if removed} since the last save
+        self.journaled_changes = 0
+        self.journal_offset = 0
+        # True until a snapshot with the same header has been loaded or written
+        self.compact_needed = True
+        self.snapshot_id = None  # (inode, mtime) of the snapshot loaded or written last
+
+    def set(self, key, value):
+        """Record that an entry has been added or changed.
+
+        Args:
+            key (str): The key of the entry, e.g. an item url.
+            value: The value of the entry, serializable to JSON and not None.
+        """
+        self.changes[key] = value
+
+    def remove(self, key):
+        """Record that an entry has been removed.
+
+        Args:
+            key (str): The key of the entry, e.g. an item url.
+        """
+        self.changes[key] = None
+
+    def load(self):
+        """Load the saved entries: the snapshot, updated with the changes of the journal.
+
+        Returns:
+            dict: The entries, or None if there are none or if they were saved with another header.
+        """
+        self.changes = {}
+        self.journaled_changes = 0
+        self.journal_offset = 0
+        self.compact_needed = True
+        self.snapshot_id = None
+        try:
+            with open(self.path, "r") as snapshot_file:
+                self.snapshot_id = self.identify(snapshot_file.fileno())
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            return None
+        if any(snapshot.get(key) != value for key, value in self.header.items()):
+            return None
+        entries = snapshot[self.entries_key]
+        for key, value in self.read_journal():
+            if value is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = value
+        self.compact_needed = False
+        return entries
+
+    def identify(self, snapshot=None):
+        """Identify the current snapshot, so that its replacement by another writer is noticed.
+
+        Args:
+            snapshot (int): The file descriptor of the snapshot. Defaults to None, meaning the file at `self.path`.
+
+        Returns:
+            tuple: Its (inode, mtime), or None if there is no snapshot.
+        """
+        try:
+            stat = os.stat(self.path if snapshot is None else snapshot)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def read_journal(self):
+        """Read the changes journaled past `self.journal_offset`, and move the offset after them.
+
+        Returns:
+            list: The (key, new value or None if removed) changes, in order.
+        """
+        changes = []
+        if not os.path.isfile(self.journal_path):
+            return changes
+        with open(self.journal_path, "rb") as journal_file:
+            journal_file.seek(self.journal_offset)
+            for line in journal_file:
+                try:
+                    key, value = json.loads(line)
+                except ValueError:
+                    # A save has been interrupted while writing this line: ignore it and what follows
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                changes.append((key, value))
+                self.journaled_changes += 1
+                self.journal_offset += len(line)
+        return changes
+
+    def pull(self, get_entries):
+        """Get the changes saved by the other writers of the files since the last load or save.
+
+        Args:
+            get_entries (callable): A function returning all the current entries, called only if the snapshot has been replaced.
+
+        Returns:
+            dict: {key: new value, or None if removed}.
+        """
+        if self.identify() != self.snapshot_id:
+            # Compacted (or created) by another writer: compare its entries with ours
+            changes = self.changes
+            entries = self.load()
+            self.changes = changes
+            if entries is None:
+                return {}
+            current = get_entries()
+            pulled = {
+                key: value
+                for key, value in entries.items()
+                if current.get(key) != value
+            }
+            pulled.update({key: None for key in current if key not in entries})
+            return pulled
+        if self.compact_needed:
+            return {}
+        return dict(self.read_journal())
+
+    def save(self, get_entries, merge=None):
+        """Persist the changes recorded since the last save, by appending them to the journal, or by compacting all the entries into a new snapshot.
+
+        Args:
+            get_entries (callable): A function returning all the current entries, called only if the journal is compacted.
+            merge (callable): A function applying a change saved by another writer, called with its key and new value (None if removed), before ours are saved. Our own changes of the same key win. Defaults to None, meaning the files have no other writer.
+        """
+        if merge is not None:
+            changes = self.changes
+            self.changes = {}
+            for key, value in self.pull(get_entries).items():
+                if key not in changes:
+                    merge(key, value)
+            # The merged changes are already saved
+            self.changes = changes
+        if not self.changes:
+            return
+        if (
+            self.compact_needed
+            or self.journaled_changes + len(self.changes) >= self.compact_every
+        ):
+            self.compact(get_entries())
+            return
+        if (
+            os.path.isfile(self.journal_path)
+            and os.path.getsize(self.journal_path) > self.journal_offset
+        ):
+            # Drop the remains of an interrupted save before appending
+            os.truncate(self.journal_path, self.journal_offset)
+        lines = "".join(
+            json.dumps([key, value]) + "\n" for key, value in self.changes.items()
+        ).encode("utf-8")
+        with open(self.journal_path, "ab") as journal_file:
+            journal_file.write(lines)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.journal_offset += len(lines)
+        self.journaled_changes += len(self.changes)
+        self.changes = {}
+
+    def compact(self, entries):
+        """Write all the entries as a new snapshot (through a temporary file and an atomic rename), then empty the journal.
+
+        Args:
+            entries (dict): All the current entries.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as snapshot_file:
+            json.dump({**self.header, self.entries_key: entries}, snapshot_file)
+        os.replace(tmp_path, self.path)
+        self.snapshot_id = self.identify()
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+        self.changes = {}
+        self.journaled_changes = 0
+        self.journal_offset = 0
+        self.compact_needed = False
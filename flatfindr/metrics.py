@@ -0,0 +1,289 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Upper bounds (in seconds) of the latency histograms, from a webdriver call to a full run
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+PREFIX = "flatfindr"
+DEFAULT_METRICS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    os.path.join("saves", "metrics"),
+)
+REPORT_FILE = "last-run.json"
+PROMETHEUS_FILE = "metrics.prom"
+STATE_FILE = "state.json"
+
+"""
+Timing metrics of the scraper runs.
+A RunReport collects the timers (driver startup, log in, scrolls, link harvest, items pages, database saves, ...) and the counters (e.g. the filter decisions) of a single run.
+Each measure is also added to a Metrics object, which aggregates the runs: latency histograms per stage, and counters totals.
+When given a directory, the Metrics object writes there, after each run, the JSON report of the run and a Prometheus text file (for the node exporter textfile collector),
+and keeps its state so that the histograms accumulate across processes.
+"""
+
+
+def format_key(name, labels):
+    """Get the key of a counter, in the Prometheus format.
+
+    Args:
+        name (str): The name of the counter, e.g. 'items'.
+        labels (dict): The labels of the counter, e.g. {'decision': 'new'}.
+
+    Returns:
+        str: The key, e.g. 'items{decision="new"}'.
+    """
+    if not labels:
+        return name
+    labels = ",".join(f'{label}="{value}"' for label, value in sorted(labels.items()))
+    return f"{name}{{{labels}}}"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        """
+        Args:
+            buckets (tuple): The upper bounds of the buckets, in seconds. Defaults to BUCKETS.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)  # Not cumulative
+        self.sum = 0.0
+        self.cnt = 0
+
+    def observe(self, value):
+        """Add a measure to the histogram.
+
+        Args:
+            value (float): The measure, in seconds.
+        """
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.cnt += 1
+
+    def to_dict(self):
+        return {"counts": self.counts, "sum": self.sum, "cnt": self.cnt}
+
+    def load(self, state):
+        """Load the state of a histogram saved with `to_dict()`. Ignored if the buckets have changed since.
+
+        Args:
+            state (dict): The saved state.
+        """
+        if len(state.get("counts", [])) == len(self.buckets):
+            self.counts = list(state["counts"])
+            self.sum = state["sum"]
+            self.cnt = state["cnt"]
+
+
+class Metrics:
+    def __init__(self, path=None, buckets=BUCKETS):
+        """
+        Args:
+            path (str): The directory where the report of the last run, the Prometheus file and the state are written after each run. If None, nothing is written. Defaults to None.
+            buckets (tuple): The upper bounds of the latency histograms, in seconds. Defaults to BUCKETS.
+        """
+        self.path = path
+        self.buckets = buckets
+        self.histograms = {}  # {stage: Histogram}
+        self.counters = {}  # {counter key: value}, see `format_key()`
+        self.runs_cnt = 0
+        self.last_report = None
+        self.lock = threading.Lock()
+        if path is not None:
+            self.load()
+
+    def observe(self, stage, seconds):
+        """Add a duration to the histogram of a stage.
+
+        Args:
+            stage (str): The stage, e.g. 'scroll'.
+            seconds (float): The duration of the stage.
+        """
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram(self.buckets)
+            self.histograms[stage].observe(seconds)
+
+    def count(self, key, value=1):
+        """Increment a counter.
+
+        Args:
+            key (str): The key of the counter, see `format_key()`.
+            value (int): The increment. Defaults to 1.
+        """
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_run(self, report):
+        """Record the end of a run, and write the metrics files if `self.path` is set.
+
+        Args:
+            report (dict): The report of the run, see `RunReport.to_dict()`.
+        """
+        with self.lock:
+            self.runs_cnt += 1
+            self.last_report = report
+            if self.path is not None:
+                self.save()
+
+    def to_prometheus(self):
+        """Get the metrics in the Prometheus text format.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds Duration of the stages of the scraper runs.",
+            f"# TYPE {PREFIX}_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bucket, cnt in zip(histogram.buckets, histogram.counts):
+                cumulative += cnt
+                lines.append(
+                    f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bucket}"}} {cumulative}'
+                )
+            lines.append(
+                f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.cnt}'
+            )
+            lines.append(
+                f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}'
+            )
+            lines.append(
+                f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram.cnt}'
+            )
+        names = sorted({key.split("{")[0] for key in self.counters})
+        for name in names:
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            for key, value in sorted(self.counters.items()):
+                if key.split("{")[0] == name:
+                    lines.append(
+                        f"{PREFIX}_{key.replace(name, name + '_total', 1)} {value}"
+                    )
+        lines.append(f"# TYPE {PREFIX}_runs_total counter")
+        lines.append(f"{PREFIX}_runs_total {self.runs_cnt}")
+        if self.last_report is not None:
+            lines.append(f"# TYPE {PREFIX}_last_run_seconds gauge")
+            lines.append(f"{PREFIX}_last_run_seconds {self.last_report['seconds']:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, name, content):
+        """Write a file of `self.path` through a temporary file and an atomic rename, so that a reader never gets a partial file."""
+        path = os.path.join(self.path, name)
+        with open(path + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+
+    def save(self):
+        """Write the report of the last run, the Prometheus file and the state. Must be called with `self.lock` held."""
+        os.makedirs(self.path, exist_ok=True)
+        if self.last_report is not None:
+            self.write(REPORT_FILE, json.dumps(self.last_report, indent=2))
+        self.write(PROMETHEUS_FILE, self.to_prometheus())
+        state = {
+            "histograms": {
+                stage: histogram.to_dict()
+                for stage, histogram in self.histograms.items()
+            },
+            "counters": self.counters,
+            "runs_cnt": self.runs_cnt,
+        }
+        self.write(STATE_FILE, json.dumps(state))
+
+    def load(self):
+        """Load the state saved by a previous process, if any."""
+        try:
+            with open(os.path.join(self.path, STATE_FILE), "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        for stage, histogram_state in state.get("histograms", {}).items():
+            self.histograms[stage] = Histogram(self.buckets)
+            self.histograms[stage].load(histogram_state)
+        self.counters = state.get("counters", {})
+        self.runs_cnt = state.get("runs_cnt", 0)
+
+
+class RunReport:
+    def __init__(self, metrics=None, website=""):
+        """
+        Args:
+            metrics (Metrics): The metrics aggregating the runs. Defaults to None, meaning a new `Metrics()` that is not written anywhere.
+            website (str): The name of the scraped website, e.g. 'facebook'. Defaults to ''.
+        """
+        self.metrics = metrics or Metrics()
+        self.website = website
+        self.started = datetime.now()
+        self.start = time.perf_counter()
+        self.stages = {}  # {stage: [durations]}
+        self.counters = {}  # {counter key: value}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage):
+        """Context manager measuring the duration of a stage. The duration is recorded even if an exception is raised.
+
+        Args:
+            stage (str): The stage, e.g. 'save_db'.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.stages.setdefault(stage, []).append(seconds)
+            self.metrics.observe(stage, seconds)
+
+    def count(self, name, value=1, **labels):
+        """Increment a counter.
+
+        Args:
+            name (str): The name of the counter, e.g. 'items'.
+            value (int): The increment. Defaults to 1.
+            **labels: The labels of the counter, e.g. decision='new'.
+        """
+        key = format_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.metrics.count(key, value)
+
+    def to_dict(self):
+        """Get the report of the run.
+
+        Returns:
+            dict: The website, the start date and wall time (in seconds) of the run, the statistics of each stage (number of calls, total, mean and max durations) and the counters.
+        """
+        with self.lock:
+            stages = {
+                stage: {
+                    "cnt": len(durations),
+                    "total": sum(durations),
+                    "mean": sum(durations) / len(durations),
+                    "max": max(durations),
+                }
+                for stage, durations in self.stages.items()
+            }
+            counters = dict(self.counters)
+        return {
+            "website": self.website,
+            "started": self.started.isoformat(timespec="seconds"),
+            "seconds": time.perf_counter() - self.start,
+            "stages": stages,
+            "counters": counters,
+        }
+
+    def finish(self):
+        """End the run: add its report to the metrics, which writes the metrics files if needed.
+
+        Returns:
+            dict: The report of the run.
+        """
+        report = self.to_dict()
+        self.metrics.add_run(report)
+        return report
@@ -0,0 +1,402 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from telegram.error import (
+    BadRequest,
+    ChatMigrated,
+    RetryAfter,
+    TelegramError,
+    Unauthorized,
+)
+
+from flatfindr.metrics import format_key
+
+# Telegram allows about 30 messages per second over all the chats
+GLOBAL_RATE = 30
+# And about 1 message per second inside a chat, with short bursts
+CHAT_RATE = 1
+CHAT_BURST = 3
+# Maximum number of messages waiting to be sent, the next ones are dropped
+MAX_QUEUED = 1000
+MAX_RETRIES = 5  # Number of times a message is sent again after a network error
+RETRY_DELAY = 1  # Seconds before the first retry, doubled at each retry
+MAX_MESSAGE_LENGTH = 4096  # Longer texts are refused by Telegram
+DIGEST_SEPARATOR = "\n" + "—" * 20 + "\n"
+
+"""
+Outbound queue of the Telegram messages of the bot.
+The alerts are queued by the scrapes and sent by a single worker thread, so that a burst of new ads doesn't stall the scrapes, nor run into the Telegram flood limits:
+- the messages are rate limited by token buckets, one shared by all the chats and one per chat, the chats being served in turn;
+- when Telegram answers "retry after n seconds" anyway, the sending is paused for n seconds, then the message is sent again;
+- on a network error, the message is sent again later, with an exponential backoff;
+- with `digest` set, the texts waiting for the same chat are coalesced into a single message (up to MAX_MESSAGE_LENGTH characters).
+The deliveries are counted inside a `flatfindr.metrics.Metrics` object: `notifications{status="sent"|"retried"|"failed"|"dropped"}`, `notifications_coalesced`,
+`notifications_rate_limited`, and the histogram of the `notification_delay` between the queuing and the sending of a message.
+"""
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, now):
+        """
+        Args:
+            rate (float): The number of tokens added per second.
+            capacity (float): The maximum number of tokens, i.e. the size of a burst.
+            now (float): The current time, in seconds.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_delay(self, now):
+        """Get the number of seconds to wait before a token is available.
+
+        Args:
+            now (float): The current time, in seconds.
+
+        Returns:
+            float: The delay, 0 if a token is available now.
+        """
+        self.refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+
+class Notification:
+    def __init__(self, method, chat_id, kwargs, digest=False, queued=None):
+        """
+        Args:
+            method (str): The method of the bot sending the message, e.g. 'send_message'.
+            chat_id (int): The chat the message is sent to.
+            kwargs (dict): The other arguments of the method, e.g. {'text': '...', 'parse_mode': 'HTML'}.
+            digest (bool): Set to True if the message can be coalesced with the next texts of the chat. Defaults to False.
+            queued (float): The time the message was queued at. Defaults to None, meaning now.
+        """
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.digest = digest
+        self.queued = time.monotonic() if queued is None else queued
+        self.retries = 0
+        self.coalesced = 1  # Number of queued messages merged into this one
+
+
+class Notifier:
+    def __init__(
+        self,
+        bot=None,
+        global_rate=GLOBAL_RATE,
+        chat_rate=CHAT_RATE,
+        chat_burst=CHAT_BURST,
+        digest=False,
+        max_queued=MAX_QUEUED,
+        max_retries=MAX_RETRIES,
+        retry_delay=RETRY_DELAY,
+        metrics=None,
+    ):
+        """
+        Args:
+            bot (telegram.Bot): The bot sending the messages. Can also be given to `start()`. Defaults to None.
+            global_rate (float): The maximum number of messages sent per second, over all the chats. Defaults to GLOBAL_RATE.
+            chat_rate (float): The maximum number of messages sent per second to the same chat. Defaults to CHAT_RATE.
+            chat_burst (int): The number of messages that can be sent at once to the same chat, before `chat_rate` applies. Defaults to CHAT_BURST.
+            digest (bool): Set to True to coalesce the texts waiting for the same chat into a single message. Defaults to False.
+            max_queued (int): The maximum number of messages waiting to be sent. Defaults to MAX_QUEUED.
+            max_retries (int): The number of times a message is sent again after a network error. Defaults to MAX_RETRIES.
+            retry_delay (float): The number of seconds before the first retry, doubled at each retry. Defaults to RETRY_DELAY.
+            metrics (flatfindr.metrics.Metrics): The metrics the deliveries are counted in. Defaults to None, meaning they are not counted.
+        """
+        self.bot = bot
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.digest = digest
+        self.max_queued = max_queued
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.metrics = metrics
+        # {chat_id: deque of Notification}, the next chat to serve first
+        self.chats = OrderedDict()
+        self.queued_cnt = 0
+        self.sending_cnt = 0
+        self.global_bucket = TokenBucket(global_rate, global_rate, time.monotonic())
+        self.chat_buckets = {}  # {chat_id: TokenBucket}
+        self.paused_until = 0  # Set when Telegram asks to retry after some time
+        self.chat_paused_until = {}  # {chat_id: time}, set after a network error
+        self.closed = False
+        self.condition = threading.Condition()
+        self.worker = None
+
+    def __len__(self):
+        with self.condition:
+            return self.queued_cnt
+
+    def start(self, bot=None):
+        """Start the worker thread sending the messages.
+
+        Args:
+            bot (telegram.Bot): The bot sending the messages, if not given to `__init__()`. Defaults to None.
+
+        Returns:
+            Notifier: The notifier itself.
+        """
+        if bot is not None:
+            self.bot = bot
+        with self.condition:
+            self.closed = False
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.work, daemon=True)
+                self.worker.start()
+        return self
+
+    def count(self, name, value=1, **labels):
+        if self.metrics is not None:
+            self.metrics.count(format_key(name, labels), value)
+
+    def queue(self, notification):
+        """Queue a message, without waiting for it to be sent.
+
+        Args:
+            notification (Notification): The message.
+
+        Returns:
+            bool: True if the message has been queued, False if the queue is full.
+        """
+        with self.condition:
+            if self.closed or self.queued_cnt >= self.max_queued:
+                self.count("notifications", status="dropped")
+                return False
+            self.chats.setdefault(notification.chat_id, deque()).append(notification)
+            self.queued_cnt += 1
+            self.condition.notify()
+        return True
+
+    def send_message(self, chat_id, text, digest=True, **kwargs):
+        """Queue a text message.
+
+        Args:
+            chat_id (int): The chat the message is sent to.
+            text (str): The text of the message.
+            digest (bool): Set to False to never coalesce this message with others, even if `self.digest` is set. Defaults to True.
+            **kwargs: The other arguments of `telegram.Bot.send_message()`, e.g. `parse_mode`.
+
+        Returns:
+            bool: True if the message has been queued.
+        """
+        return self.queue(
+            Notification(
+                "send_message",
+                chat_id,
+                dict(kwargs, text=text),
+                digest=digest and self.digest,
+            )
+        )
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        """Queue a photo, see `telegram.Bot.send_photo()`.
+
+        Returns:
+            bool: True if the photo has been queued.
+        """
+        return self.queue(
+            Notification("send_photo", chat_id, dict(kwargs, photo=photo))
+        )
+
+    def send_media_group(self, chat_id, media, **kwargs):
+        """Queue an album of photos, see `telegram.Bot.send_media_group()`.
+
+        Returns:
+            bool: True if the album has been queued.
+        """
+        return self.queue(
+            Notification("send_media_group", chat_id, dict(kwargs, media=media))
+        )
+
+    def get_delay(self, chat_id, now):
+        """Get the number of seconds to wait before a message can be sent to a chat. Must be called with `self.condition` held."""
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(
+                self.chat_rate, self.chat_burst, now
+            )
+        if self.chat_paused_until.get(chat_id, now) <= now:
+            self.chat_paused_until.pop(chat_id, None)
+            return self.chat_buckets[chat_id].get_delay(now)
+        return max(
+            self.chat_buckets[chat_id].get_delay(now),
+            self.chat_paused_until[chat_id] - now,
+        )
+
+    def pop(self, chat_id):
+        """Take the next message of a chat, coalesced with the next texts if it is a digest. Must be called with `self.condition` held.
+
+        Args:
+            chat_id (int): The chat.
+
+        Returns:
+            Notification: The message to send.
+        """
+        notifications = self.chats[chat_id]
+        notification = notifications.popleft()
+        self.queued_cnt -= 1
+        while (
+            notification.digest
+            and notifications
+            and notifications[0].digest
+            and {**notifications[0].kwargs, "text": ""}
+            == {**notification.kwargs, "text": ""}
+            and len(notification.kwargs["text"])
+            + len(DIGEST_SEPARATOR)
+            + len(notifications[0].kwargs["text"])
+            <= MAX_MESSAGE_LENGTH
+        ):
+            following = notifications.popleft()
+            self.queued_cnt -= 1
+            notification.kwargs["text"] += DIGEST_SEPARATOR + following.kwargs["text"]
+            notification.coalesced += following.coalesced
+            self.count("notifications_coalesced")
+        if not notifications:
+            del self.chats[chat_id]
+        else:
+            self.chats.move_to_end(chat_id)
+        return notification
+
+    def next_notification(self):
+        """Wait until a message can be sent, and take it. Must be called with `self.condition` held.
+
+        Returns:
+            Notification: The message to send, or None once the notifier is closed.
+        """
+        while True:
+            if self.closed:
+                return None
+            now = time.monotonic()
+            delay = None
+            if self.chats:
+                delay = max(
+                    self.paused_until - now, self.global_bucket.get_delay(now), 0
+                )
+                if not delay:
+                    for chat_id in self.chats:
+                        chat_delay = self.get_delay(chat_id, now)
+                        if not chat_delay:
+                            self.global_bucket.take(now)
+                            self.chat_buckets[chat_id].take(now)
+                            self.sending_cnt += 1
+                            return self.pop(chat_id)
+                        delay = chat_delay if not delay else min(delay, chat_delay)
+            self.condition.wait(delay)
+
+    def work(self):
+        """Loop of the worker thread: send the queued messages one by one until the notifier is closed."""
+        while True:
+            with self.condition:
+                notification = self.next_notification()
+            if notification is None:
+                return
+            try:
+                self.deliver(notification)
+            except Exception as e:
+                print(f"Error while sending to the chat {notification.chat_id}: {e}")
+                self.count("notifications", notification.coalesced, status="failed")
+            finally:
+                with self.condition:
+                    self.sending_cnt -= 1
+                    self.condition.notify_all()
+
+    def deliver(self, notification):
+        """Send a message with the bot, and handle the errors: wait and retry on flood control or network errors, drop the message otherwise.
+
+        Args:
+            notification (Notification): The message.
+        """
+        try:
+            getattr(self.bot, notification.method)(
+                chat_id=notification.chat_id, **notification.kwargs
+            )
+        except RetryAfter as e:
+            self.count("notifications_rate_limited")
+            with self.condition:
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + e.retry_after
+                )
+                self.requeue(notification)
+            return
+        except Unauthorized as e:
+            # The user blocked the bot: the next messages of the chat would fail as well
+            with self.condition:
+                dropped = self.chats.pop(notification.chat_id, ())
+                self.queued_cnt -= len(dropped)
+            print(f"Error while sending to the chat {notification.chat_id}: {e}")
+            self.count("notifications", notification.coalesced, status="failed")
+            for other in dropped:
+                self.count("notifications", other.coalesced, status="failed")
+            return
+        except (BadRequest, ChatMigrated) as e:
+            print(f"Error while sending to the chat {notification.chat_id}: {e}")
+            self.count("notifications", notification.coalesced, status="failed")
+            return
+        except TelegramError as e:  # e.g. NetworkError or TimedOut
+            if notification.retries >= self.max_retries:
+                print(f"Error while sending to the chat {notification.chat_id}: {e}")
+                self.count("notifications", notification.coalesced, status="failed")
+                return
+            self.count("notifications", status="retried")
+            with self.condition:
+                self.chat_paused_until[notification.chat_id] = (
+                    time.monotonic() + self.retry_delay * 2**notification.retries
+                )
+                notification.retries += 1
+                self.requeue(notification)
+            return
+        self.count("notifications", notification.coalesced, status="sent")
+        if self.metrics is not None:
+            self.metrics.observe(
+                "notification_delay", time.monotonic() - notification.queued
+            )
+
+    def requeue(self, notification):
+        """Put a message back at the head of its chat queue. Must be called with `self.condition` held."""
+        self.chats.setdefault(notification.chat_id, deque()).appendleft(notification)
+        self.chats.move_to_end(notification.chat_id, last=False)
+        self.queued_cnt += 1
+
+    def flush(self, timeout=None):
+        """Wait until all the queued messages have been sent (or dropped).
+
+        Args:
+            timeout (float): The maximum number of seconds to wait. Defaults to None, meaning no limit.
+
+        Returns:
+            bool: True if the queue is empty.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.queued_cnt or self.sending_cnt:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Send the queued messages, then stop the worker thread.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait for the queued messages, the remaining ones are dropped. Defaults to None, meaning no limit.
+        """
+        if self.worker is not None:
+            self.flush(timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            worker, self.worker = self.worker, None
+        if worker is not None:
+            worker.join()
@@ -0,0 +1,152 @@
+import json
+import re
+from datetime import date
+
+LISTING_KEY = "listing_price"  # A key only found in the listing object of the payload
+JSON_SCRIPT = re.compile(
+    r"<script\b[^>]*type=\"application/json\"[^>]*>(.*?)</script\s*>",
+    re.IGNORECASE | re.DOTALL,
+)
+
+"""
+Extraction of the item details from the JSON payload embedded in a Marketplace item page.
+The page holds the listing as structured data inside `<script type="application/json">` tags: reading it is faster than walking the rendered DOM,
+and doesn't depend on the language or the layout of the page. Only the payloads containing the listing are parsed.
+A field missing from the payload is simply not returned, so that the caller can fall back on the rendered texts (see `Facebook.scrape_item_details`).
+"""
+
+
+def find_listing(node):
+    """Find the listing object inside a parsed payload, i.e. the first dictionnary holding a LISTING_KEY key.
+
+    Args:
+        node (dict or list): The parsed payload.
+
+    Returns:
+        dict: The listing, or None if not found.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if LISTING_KEY in node:
+                return node
+            stack.extend(reversed(list(node.values())))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+    return None
+
+
+def get_listing(payloads):
+    """Get the listing object from the JSON payloads of an item page.
+
+    Args:
+        payloads (list): The contents of the `<script type="application/json">` tags of the page, as strings.
+
+    Returns:
+        dict: The listing, or None if not found.
+    """
+    for payload in payloads:
+        if f'"{LISTING_KEY}"' not in payload:
+            continue
+        try:
+            listing = find_listing(json.loads(payload))
+        except ValueError:
+            continue
+        if listing is not None:
+            return listing
+    return None
+
+
+def get_text(value):
+    """Get the text of a payload field, which is either a string or a {"text": ...} object."""
+    if isinstance(value, dict):
+        value = value.get("text")
+    return value if isinstance(value, str) else None
+
+
+def get_first_int(text):
+    """Get the first integer of a text, ignoring the thousands separators, e.g. 850 for '850 pieds carrés' or 1300 for '1 300 $'."""
+    match = re.search(r"\d[\d\s ,.]*", text or "")
+    if match is None:
+        return None
+    digits = re.sub(r"[\s ,]", "", match.group()).split(".")[0]
+    return int(digits) if digits else None
+
+
+def parse_listing(listing):
+    """Get the item details from the listing object of a payload.
+
+    Args:
+        listing (dict): The listing, see `get_listing()`.
+
+    Returns:
+        dict: The item details found in the payload (any of 'published', 'price', 'lat', 'lng', 'address', 'bedrooms', 'surface', 'furnished', 'description', 'images').
+            `furnished` is a boolean, and `surface` is in m2.
+    """
+    item_details = {}
+    try:
+        item_details["price"] = int(float(listing[LISTING_KEY]["amount"]))
+    except (KeyError, TypeError, ValueError):
+        pass
+    creation_time = listing.get("creation_time")
+    if isinstance(creation_time, (int, float)):
+        item_details["published"] = date.fromtimestamp(creation_time).isoformat()
+    location = listing.get("location") or {}
+    if isinstance(location.get("latitude"), (int, float)) and isinstance(
+        location.get("longitude"), (int, float)
+    ):
+        item_details["lat"] = location["latitude"]
+        item_details["lng"] = location["longitude"]
+    address = get_text((listing.get("home_address") or {}).get("street"))
+    if address:
+        item_details["address"] = address
+    bedrooms = listing.get("bedrooms")
+    if not isinstance(bedrooms, int):
+        bedrooms = get_first_int(get_text(listing.get("unit_room_info")))
+    if bedrooms is not None:
+        item_details["bedrooms"] = bedrooms
+    area = listing.get("unit_area_info") or {}
+    surface = area.get("value") if isinstance(area, dict) else None
+    if isinstance(surface, (int, float)) and surface > 0:
+        if area.get("unit") == "SQUARE_FEET":
+            surface = surface / 10.764
+        item_details["surface"] = round(surface)
+    if isinstance(listing.get("is_furnished"), bool):
+        item_details["furnished"] = listing["is_furnished"]
+    description = get_text(listing.get("redacted_description"))
+    if description is not None:
+        item_details["description"] = description
+    images = [
+        photo["image"]["uri"]
+        for photo in listing.get("listing_photos") or []
+        if isinstance(photo, dict) and get_text((photo.get("image") or {}).get("uri"))
+    ]
+    if images:
+        item_details["images"] = images
+    return item_details
+
+
+def extract_item_details(payloads):
+    """Get the item details from the JSON payloads of an item page.
+
+    Args:
+        payloads (list): The contents of the `<script type="application/json">` tags of the page, as strings.
+
+    Returns:
+        dict: The item details found in the payloads, see `parse_listing()`. Empty if there is no listing.
+    """
+    listing = get_listing(payloads)
+    return {} if listing is None else parse_listing(listing)
+
+
+def get_payloads(html):
+    """Get the JSON payloads from the source of a page, e.g. a recorded one.
+
+    Args:
+        html (str): The source of the page.
+
+    Returns:
+        list: The contents of the `<script type="application/json">` tags of the page, as strings.
+    """
+    return [match.group(1) for match in JSON_SCRIPT.finditer(html)]
@@ -0,0 +1,222 @@
+import io
+
+from PIL import Image
+
+from flatfindr.journal import JournaledDict
+
+HASH_SIZE = 8  # The hashes are HASH_SIZE * HASH_SIZE bits long
+# Maximum number of different bits between the hashes of two copies of the same photo (resized, recompressed, ...)
+DISTANCE_THRESHOLD = 5
+# Number of photos an item must share with a seen one to be a duplicate (or all its photos, if it has less)
+MIN_SHARED_IMAGES = 2
+PHASH_EXTENSION = ".phash"
+
+"""
+Near-duplicate detection of the items photos, using perceptual hashes (dHash) and a multi-index hash table.
+Reposted ads often come back with a rewritten description but the same photos: their hashes are then equal, or differ by a few bits only.
+Each hash is split into DISTANCE_THRESHOLD + 1 chunks, and indexed under each of them. Two hashes differing by at most DISTANCE_THRESHOLD bits
+share at least one chunk, so only the photos sharing a chunk with a new one are compared, instead of all the indexed photos.
+The index is persisted next to the database (`db_path` + `.phash`), with a journal of its changes, see `flatfindr.journal.JournaledDict`.
+"""
+
+
+def dhash(data, hash_size=HASH_SIZE):
+    """Get the difference hash of an image: the image is shrunk to (hash_size + 1) * hash_size gray pixels,
+    and each bit tells whether a pixel is brighter than its right neighbour.
+
+    Args:
+        data (bytes): The content of the image, in any format known by Pillow.
+        hash_size (int): The number of rows (and of bits per row) of the hash. Defaults to HASH_SIZE.
+
+    Returns:
+        int: The hash, as an integer of hash_size * hash_size bits.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        pixels = list(
+            image.convert("L")
+            .resize((hash_size + 1, hash_size), Image.LANCZOS)
+            .getdata()
+        )
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = value * 2 + (left > right)
+    return value
+
+
+def get_distance(first, second):
+    """Get the number of different bits between two hashes (Hamming distance)."""
+    return bin(first ^ second).count("1")
+
+
+def is_plain(value, hash_size=HASH_SIZE, threshold=DISTANCE_THRESHOLD):
+    """Return True if a hash is (almost) all zeros or all ones, e.g. the hash of a blank picture or of a gradient, which doesn't tell the photos apart."""
+    ones = bin(value).count("1")
+    return ones <= threshold or ones >= hash_size * hash_size - threshold
+
+
+class ImageIndex:
+    def __init__(
+        self,
+        path=None,
+        threshold=DISTANCE_THRESHOLD,
+        min_shared=MIN_SHARED_IMAGES,
+        hash_size=HASH_SIZE,
+    ):
+        """
+        Args:
+            path (str): The path where the index is persisted. If None, the index lives in memory only. Defaults to None.
+            threshold (int): The maximum number of different bits between the hashes of two copies of the same photo. Defaults to DISTANCE_THRESHOLD.
+            min_shared (int): The number of photos an item must share with a seen one to be a duplicate. Defaults to MIN_SHARED_IMAGES.
+            hash_size (int): The hash size the hashes were computed with, see `dhash()`. Defaults to HASH_SIZE.
+        """
+        self.path = path
+        self.threshold = threshold
+        self.min_shared = min_shared
+        self.hash_size = hash_size
+        bits = hash_size * hash_size
+        chunks = threshold + 1
+        # (shift, mask) of each chunk, the first ones one bit longer if the bits can't be split evenly
+        self.chunks = []
+        shift = 0
+        for i in range(chunks):
+            length = bits // chunks + (i < bits % chunks)
+            self.chunks.append((shift, (1 << length) - 1))
+            shift += length
+        self.hashes = {}  # {key: list of hashes}
+        self.buckets = {}  # {(chunk, value of the chunk): set of (key, hash)}
+        self.journal = (
+            JournaledDict(path, {"hash_size": hash_size}, "hashes") if path else None
+        )
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, key):
+        return key in self.hashes
+
+    @property
+    def dirty(self):
+        """True if the index changed since the last save."""
+        return self.journal is not None and bool(self.journal.changes)
+
+    def get_buckets(self, value):
+        """Get the bucket keys of a hash, one per chunk.
+
+        Args:
+            value (int): The hash of a photo.
+
+        Returns:
+            list: The bucket keys.
+        """
+        return [
+            (i, (value >> shift) & mask) for i, (shift, mask) in enumerate(self.chunks)
+        ]
+
+    def add(self, key, hashes):
+        """Add the photos of an item to the index.
+
+        Args:
+            key (str): The key of the item, e.g. its url.
+            hashes (list): The hashes of its photos, see `dhash()`.
+        """
+        if not hashes or key in self.hashes:
+            return
+        self.insert(key, hashes)
+        if self.journal is not None:
+            self.journal.set(key, [format(value, "x") for value in hashes])
+
+    def insert(self, key, hashes):
+        """Index the photos of an item in `self.hashes` and the buckets, without journaling them.
+
+        Args:
+            key (str): The key of the item, e.g. its url.
+            hashes (list): The hashes of its photos, see `dhash()`.
+        """
+        self.hashes[key] = list(hashes)
+        for value in hashes:
+            for bucket in self.get_buckets(value):
+                self.buckets.setdefault(bucket, set()).add((key, value))
+
+    def merge(self, key, values):
+        """Apply a change of the index saved by another scraper of the same database.
+
+        Args:
+            key (str): The key of the item, e.g. its url.
+            values (list): Its new hashes as hexadecimal strings, or None if it has been removed.
+        """
+        self.remove(key)
+        if values:
+            self.insert(key, [int(value, 16) for value in values])
+
+    def remove(self, key):
+        """Remove the photos of an item from the index, if it is indexed.
+
+        Args:
+            key (str): The key of the item, e.g. its url.
+        """
+        hashes = self.hashes.pop(key, None)
+        if hashes is None:
+            return
+        for value in hashes:
+            for bucket in self.get_buckets(value):
+                entries = self.buckets[bucket]
+                entries.discard((key, value))
+                if not entries:
+                    del self.buckets[bucket]
+        if self.journal is not None:
+            self.journal.remove(key)
+
+    def query(self, hashes):
+        """Get the indexed items sharing photos with the input ones.
+
+        Args:
+            hashes (list): The hashes of the photos of an item, see `dhash()`.
+
+        Returns:
+            list: A list of (key, number of shared photos) tuples, sorted from the most shared.
+        """
+        shared = {}
+        for value in set(hashes):
+            candidates = set()
+            for bucket in self.get_buckets(value):
+                candidates.update(self.buckets.get(bucket, ()))
+            keys = {
+                key
+                for key, other in candidates
+                if get_distance(value, other) <= self.threshold
+            }
+            for key in keys:
+                shared[key] = shared.get(key, 0) + 1
+        return sorted(shared.items(), key=lambda match: -match[1])
+
+    def is_duplicate(self, hashes):
+        """Return True if an indexed item shares at least `self.min_shared` photos with the input ones (or all of them, if they are fewer).
+
+        Args:
+            hashes (list): The hashes of the photos of an item, see `dhash()`.
+        """
+        matches = self.query(hashes)
+        return bool(matches) and matches[0][1] >= min(self.min_shared, len(set(hashes)))
+
+    def load(self):
+        """Load the hashes persisted at `self.path`, if any, and rebuild the buckets."""
+        if self.journal is None:
+            return
+        # Hashes of another size are not comparable
+        hashes = self.journal.load() or {}
+        for key, values in hashes.items():
+            self.insert(key, [int(value, 16) for value in values])
+
+    def save(self):
+        """Persist the changes of the hashes since the last save, after merging the ones saved by the other scrapers of the database."""
+        if self.journal is not None:
+            self.journal.save(
+                lambda: {
+                    key: [format(value, "x") for value in hashes]
+                    for key, hashes in self.hashes.items()
+                },
+                self.merge,
+            )
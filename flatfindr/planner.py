@@ -0,0 +1,162 @@
+from math import asin, cos, radians, sin, sqrt
+
+EARTH_RADIUS = 6371  # km
+MAX_MERGED_RADIUS = 10  # km, searches are not merged into a wider circle than this (unless a search is already wider)
+DEFAULT_SEARCH = {
+    "min_price": 1200,
+    "max_price": 1750,
+    "min_bedrooms": 2,
+    "lat": 45.5254,
+    "lng": -73.5724,
+    "radius": 2,
+}
+
+"""
+Query planner for the searches of several users.
+Users looking for a flat in the same area often have overlapping criteria. Instead of running one Marketplace search per user,
+the searches are merged into a minimal set of superset queries (widest price range, lowest number of bedrooms, covering circle).
+Each merged query is scraped once, then each user gets the new ads matching their own criteria, see `matches()`.
+"""
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Get the great-circle distance between two points.
+
+    Args:
+        lat1 (float): The latitude of the first point.
+        lng1 (float): The longitude of the first point.
+        lat2 (float): The latitude of the second point.
+        lng2 (float): The longitude of the second point.
+
+    Returns:
+        float: The distance, in km.
+    """
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+    a = (
+        sin((lat2 - lat1) / 2) ** 2
+        + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * asin(sqrt(a))
+
+
+def covering_circle(circles):
+    """Get a circle that covers several circles: centered on the mean of their centers, and wide enough to contain all of them.
+
+    Args:
+        circles (list): A list of (lat, lng, radius) tuples, with radius in km.
+
+    Returns:
+        tuple: The (lat, lng, radius) of the covering circle.
+    """
+    lat = sum(circle[0] for circle in circles) / len(circles)
+    lng = sum(circle[1] for circle in circles) / len(circles)
+    radius = max(haversine(lat, lng, c_lat, c_lng) + r for c_lat, c_lng, r in circles)
+    return lat, lng, radius
+
+
+def get_search(criteria):
+    """Get the full search criteria of a user, with the default values for the missing ones.
+
+    Args:
+        criteria (dict): The criteria of the user, e.g. {'min_price': 1000, 'lat': 45.52, ...}.
+
+    Returns:
+        dict: The search criteria, with all the keys of DEFAULT_SEARCH.
+    """
+    return {key: criteria.get(key, default) for key, default in DEFAULT_SEARCH.items()}
+
+
+def merge_searches(searches):
+    """Merge several searches into a single query covering all of them.
+
+    Args:
+        searches (list): A list of search criteria dictionnaries.
+
+    Returns:
+        dict: The merged query.
+    """
+    lat, lng, radius = covering_circle(
+        [(search["lat"], search["lng"], search["radius"]) for search in searches]
+    )
+    # The radius is rounded up so that all the circles stay covered
+    return {
+        "min_price": min(search["min_price"] for search in searches),
+        "max_price": max(search["max_price"] for search in searches),
+        "min_bedrooms": min(search["min_bedrooms"] for search in searches),
+        "lat": round(lat, 4),
+        "lng": round(lng, 4),
+        "radius": round(radius + 0.05, 1),
+    }
+
+
+def can_merge(query, search):
+    """Return True if a search is worth merging into a query: price ranges overlap and circles overlap.
+    The width of the merged query is checked by `plan_searches()`.
+
+    Args:
+        query (dict): The criteria of the merged query.
+        search (dict): The criteria of the search to merge.
+    """
+    if (
+        search["min_price"] > query["max_price"]
+        or query["min_price"] > search["max_price"]
+    ):
+        return False
+    distance = haversine(query["lat"], query["lng"], search["lat"], search["lng"])
+    return distance <= query["radius"] + search["radius"]
+
+
+def plan_searches(searches, max_radius=MAX_MERGED_RADIUS):
+    """Merge the searches of several users into a minimal set of superset queries.
+    The searches are greedily merged, from the widest circle to the smallest one, as long as the merged circle is not wider than `max_radius` (unless a search is already wider).
+
+    Args:
+        searches (dict): The search criteria of each user, as {key (e.g. chat id): criteria}.
+        max_radius (float): The maximum radius of a merged query, in km. Defaults to MAX_MERGED_RADIUS.
+
+    Returns:
+        list: A list of (query, keys) tuples, where `query` is the merged search criteria and `keys` the list of the users it covers.
+    """
+    plans = []
+    for key, criteria in sorted(
+        searches.items(), key=lambda search: -get_search(search[1])["radius"]
+    ):
+        search = get_search(criteria)
+        for plan in plans:
+            if not can_merge(plan["query"], search):
+                continue
+            merged_searches = plan["searches"] + [search]
+            query = merge_searches(merged_searches)
+            # Checked on the query actually scraped, once rounded up, rather than on the previous query and the new search
+            if query["radius"] > max(
+                max_radius, *(other["radius"] for other in merged_searches)
+            ):
+                continue
+            plan["searches"] = merged_searches
+            plan["keys"].append(key)
+            plan["query"] = query
+            break
+        else:
+            plans.append({"query": dict(search), "searches": [search], "keys": [key]})
+    return [(plan["query"], plan["keys"]) for plan in plans]
+
+
+def matches(item_details, criteria):
+    """Return True if an item matches the search criteria of a user.
+    Missing details (e.g. a price that could not be scraped, or no coordinates) are not held against the item.
+
+    Args:
+        item_details (dict): A dictionnary with all the item details.
+        criteria (dict): The search criteria of the user.
+    """
+    search = get_search(criteria)
+    price = item_details.get("price")
+    if price and not search["min_price"] <= price <= search["max_price"]:
+        return False
+    bedrooms = item_details.get("bedrooms")
+    if bedrooms and bedrooms < search["min_bedrooms"]:
+        return False
+    lat, lng = item_details.get("lat"), item_details.get("lng")
+    if lat not in (None, "") and lng not in (None, ""):
+        return haversine(search["lat"], search["lng"], lat, lng) <= search["radius"]
+    return True
@@ -0,0 +1,53 @@
+import random
+import threading
+import time
+
+# Range (in seconds) of the random delay to respect between two actions of the same kind
+DELAYS = {
+    "typing": (0.2, 0.5),  # between two fields of the log in form
+    "page": (2, 3),  # between two page loads (search results or item page)
+    "scroll": (0.5, 1),  # between two scrolls of the search results
+    "gallery": (1, 1.2),  # between two pictures of an item gallery
+}
+
+"""
+Politeness policy of the scrapers: the random delays between actions that keep a run from looking like a bot (and from getting banned).
+Waiting for a page to be ready is not politeness: this is done with explicit waits on the page content (see `Scraper.wait_for`).
+A delay is measured from the previous action of the same kind, so the time spent loading and scraping a page counts towards it.
+A Politeness object is thread-safe: when shared by several workers (see `Scraper.update_db`), its delays act as a global rate limit for the website.
+"""
+
+
+class Politeness:
+    def __init__(self, delays=None, scale=1.0):
+        """
+        Args:
+            delays (dict): The delays to override, as {kind: (min_seconds, max_seconds)}, e.g. {"page": (5, 8)}. Defaults to None.
+            scale (float): A factor applied to all the delays, e.g. 2 on a slow machine or 0 to disable them in tests. Defaults to 1.0.
+        """
+        self.delays = dict(DELAYS)
+        self.delays.update(delays or {})
+        self.scale = scale
+        self.last_actions = {}
+        self.lock = threading.Lock()
+
+    def pause(self, kind):
+        """Sleep until a random delay (from `self.delays[kind]`) has passed since the previous pause of the same kind.
+
+        Args:
+            kind (str): The kind of action about to be done, e.g. 'page'. Unknown kinds don't wait.
+
+        Returns:
+            float: The number of seconds actually slept.
+        """
+        low, high = self.delays.get(kind, (0, 0))
+        delay = random.uniform(low, high) * self.scale
+        with self.lock:
+            # Book the next slot for this kind of action, so that concurrent workers are spaced out as well
+            now = time.monotonic()
+            scheduled = max(now, self.last_actions.get(kind, float("-inf")) + delay)
+            self.last_actions[kind] = scheduled
+        slept = scheduled - now
+        if slept:
+            time.sleep(slept)
+        return slept
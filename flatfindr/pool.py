@@ -0,0 +1,176 @@
+import threading
+import time
+from contextlib import contextmanager
+
+MAX_SIZE = 3  # Maximum number of browsers alive at the same time
+IDLE_TIMEOUT = 45 * 60  # Seconds after which an unused browser is quit
+
+"""
+A pool of warm webdrivers, shared by all the searches of the process.
+Launching a browser and logging in is the most expensive part of a run: instead of quitting its webdriver, a Scraper can lease one from the pool and give it back once done.
+"""
+
+
+class Lease:
+    def __init__(self, driver):
+        """
+        Args:
+            driver (selenium.webdriver.Chrome): The leased webdriver.
+        """
+        self.driver = driver
+        self.logged_in = (
+            False  # Set to True by the Scraper once it has logged in with this driver
+        )
+        self.last_used = time.monotonic()
+
+
+class DriverPool:
+    def __init__(self, factory, max_size=MAX_SIZE, idle_timeout=IDLE_TIMEOUT):
+        """
+        Args:
+            factory (callable): A function with no argument that launches a new webdriver, e.g. `flatfindr.scraper.create_driver`.
+            max_size (int): The maximum number of webdrivers (leased or idle) alive at the same time. Defaults to MAX_SIZE.
+            idle_timeout (float): The number of seconds after which an idle webdriver is quit. Defaults to IDLE_TIMEOUT.
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.idle = []  # Idle leases, the most recently used last
+        self.leased_cnt = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        with self.condition:
+            return self.leased_cnt + len(self.idle)
+
+    def is_healthy(self, driver):
+        """Return True if the webdriver session is still alive and responsive.
+
+        Args:
+            driver (selenium.webdriver.Chrome): The webdriver to check.
+        """
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def quit(self, lease):
+        """Quit the webdriver of a lease, ignoring errors from an already dead browser.
+
+        Args:
+            lease (Lease): The lease holding the webdriver.
+        """
+        try:
+            lease.driver.quit()
+        except Exception:
+            pass
+
+    def lease(self, timeout=None):
+        """Lease a webdriver: the most recently used healthy idle one if any, else a new one if the pool is not full, else wait for one to be released.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait for a webdriver. If None, wait forever. Defaults to None.
+
+        Returns:
+            Lease: The lease holding the webdriver. It must be given back with `release()`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        expired = []
+        with self.condition:
+            while True:
+                expired += self.pop_expired()
+                lease = None
+                while self.idle:
+                    candidate = self.idle.pop()
+                    if self.is_healthy(candidate.driver):
+                        lease = candidate
+                        break
+                    expired.append(candidate)
+                if (
+                    lease is not None
+                    or self.leased_cnt + len(self.idle) < self.max_size
+                ):
+                    self.leased_cnt += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No webdriver available in the pool")
+                self.condition.wait(remaining)
+        for dead_lease in expired:
+            self.quit(dead_lease)
+        if lease is not None:
+            return lease
+        try:
+            driver = self.factory()
+            if driver is None:
+                raise RuntimeError("The webdriver could not be launched")
+            return Lease(driver)
+        except:
+            with self.condition:
+                self.leased_cnt -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, lease, discard=False):
+        """Give a leased webdriver back to the pool.
+
+        Args:
+            lease (Lease): The lease to give back.
+            discard (bool): Set to True to quit the webdriver instead of keeping it warm, e.g. after an error. Defaults to False.
+        """
+        lease.last_used = time.monotonic()
+        with self.condition:
+            self.leased_cnt -= 1
+            discard = discard or self.closed
+            if not discard:
+                self.idle.append(lease)
+            self.condition.notify()
+        if discard:
+            self.quit(lease)
+
+    @contextmanager
+    def leased(self, timeout=None):
+        """Context manager leasing a webdriver and releasing it on exit. The webdriver is discarded if an exception is raised.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait for a webdriver. If None, wait forever. Defaults to None.
+        """
+        lease = self.lease(timeout=timeout)
+        try:
+            yield lease
+        except:
+            self.release(lease, discard=True)
+            raise
+        self.release(lease)
+
+    def pop_expired(self):
+        """Remove the leases that have been idle for more than `self.idle_timeout` seconds. Must be called with `self.condition` held.
+
+        Returns:
+            list: The expired leases, whose webdrivers still need to be quit.
+        """
+        now = time.monotonic()
+        expired = [
+            lease for lease in self.idle if now - lease.last_used > self.idle_timeout
+        ]
+        self.idle = [lease for lease in self.idle if lease not in expired]
+        return expired
+
+    def evict_idle(self):
+        """Quit the webdrivers that have been idle for more than `self.idle_timeout` seconds."""
+        with self.condition:
+            expired = self.pop_expired()
+            if expired:
+                self.condition.notify_all()
+        for lease in expired:
+            self.quit(lease)
+
+    def close(self):
+        """Quit all the idle webdrivers. The leased ones are quit when released."""
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.closed = True
+        for lease in idle:
+            self.quit(lease)
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+INDEX_FILE = "index.json"
+# Forbid every request that is not to the replay server itself, so that a replayed run never touches the network
+CONTENT_SECURITY_POLICY = "default-src 'self' 'unsafe-inline' data:"
+# The JSON payloads are kept, as they are data and not code (see `flatfindr.payload`)
+SCRIPT_TAG = re.compile(
+    r"<script\b(?![^>]*type=\"application/json\").*?</script\s*>",
+    re.IGNORECASE | re.DOTALL,
+)
+
+"""
+Offline record and replay of the pages of a website.
+A Recorder snapshots the rendered pages (search results and items) of a live run to a directory. The scripts of the pages (but not their JSON payloads) are removed,
+and the absolute links to the website are made relative, so that a snapshot is a static page.
+A ReplayServer then serves these snapshots on localhost: a Scraper whose `main_url` is set to `server.url` runs against them with no network access,
+which gives reproducible runs for tests and benchmarks (see `flatfindr.benchmark`).
+"""
+
+
+def get_key(url):
+    """Get the key of a page inside a recording: its path and query string.
+
+    Args:
+        url (str): The url of the page, e.g. 'https://www.facebook.com/marketplace/item/123/?ref=search'.
+
+    Returns:
+        str: The key, e.g. '/marketplace/item/123/?ref=search'.
+    """
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    return f"{path}?{parts.query}" if parts.query else path
+
+
+def clean_page(html, main_url):
+    """Turn a rendered page into a static one: remove its scripts and make the links to the website relative.
+
+    Args:
+        html (str): The source of the rendered page.
+        main_url (str): The url of the website, e.g. 'https://www.facebook.com'.
+
+    Returns:
+        str: The static page.
+    """
+    html = SCRIPT_TAG.sub("", html)
+    if main_url:
+        html = html.replace(main_url.rstrip("/") + "/", "/")
+    return html
+
+
+def load_index(directory):
+    """Load the index of a recording.
+
+    Args:
+        directory (str): The directory of the recording.
+
+    Returns:
+        dict: The index, as {"criteria": search criteria of the recorded run, "pages": {key: file name}}.
+    """
+    try:
+        with open(os.path.join(directory, INDEX_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"criteria": {}, "pages": {}}
+
+
+class Recorder:
+    def __init__(self, directory, main_url):
+        """
+        Args:
+            directory (str): The directory of the recording. An existing recording is extended.
+            main_url (str): The url of the recorded website, e.g. 'https://www.facebook.com'.
+        """
+        self.directory = directory
+        self.main_url = main_url
+        os.makedirs(directory, exist_ok=True)
+        self.index = load_index(directory)
+
+    def snapshot(self, driver):
+        """Save the page currently displayed by a webdriver.
+
+        Args:
+            driver (selenium.webdriver.Chrome): The webdriver.
+
+        Returns:
+            str: The key of the page inside the recording.
+        """
+        key = get_key(driver.current_url)
+        name = f"page-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.html"
+        with open(os.path.join(self.directory, name), "w", encoding="utf-8") as f:
+            f.write(clean_page(driver.page_source, self.main_url))
+        self.index["pages"][key] = name
+        self.save()
+        return key
+
+    def save(self):
+        """Save the index of the recording."""
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=2, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+
+def record(scraper, directory, max_items=30, **criteria):
+    """Record a live search: the search results page (once fully scrolled) and the page of each item found.
+
+    Args:
+        scraper (flatfindr.scraper.Scraper): The scraper, e.g. `Facebook()`. It is logged in if needed.
+        directory (str): The directory of the recording.
+        max_items (int): The maximum number of items pages to record. Defaults to 30.
+        **criteria: The search criteria given to `scraper.get_items_links()`, saved inside the recording so that they can be replayed.
+
+    Returns:
+        int: The number of pages recorded.
+    """
+    recorder = Recorder(directory, scraper.main_url)
+    recorder.index["criteria"] = criteria
+    if not scraper.restore_session():
+        scraper.log_in()
+    scraper.get_items_links(**criteria)
+    recorder.snapshot(scraper.driver)
+    cnt = 1
+    for item_url in scraper.items_links[:max_items]:
+        try:
+            # Same page loading and waits as a real run, so that the recorded page is fully rendered
+            scraper.scrape_item_details(item_url)
+        except Exception as e:
+            print(f"Error while loading {item_url}: {e}")
+            continue
+        recorder.snapshot(scraper.driver)
+        cnt += 1
+    scraper.items_links = []
+    return cnt
+
+
+class ReplayServer:
+    def __init__(self, directory, host="127.0.0.1", port=0):
+        """
+        Args:
+            directory (str): The directory of the recording.
+            host (str): The address the server listens to. Defaults to '127.0.0.1'.
+            port (int): The port the server listens to. Defaults to 0, meaning a free port.
+        """
+        self.directory = directory
+        self.index = load_index(directory)
+        # Fallback on the path only, e.g. for an item link whose query string differs from the recorded one
+        self.paths = {}
+        for key, name in self.index["pages"].items():
+            self.paths.setdefault(key.split("?")[0], name)
+        self.requests_cnt = 0
+        self.server = ThreadingHTTPServer((host, port), self.get_handler())
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.thread = None
+
+    def get_page(self, key):
+        """Get a recorded page.
+
+        Args:
+            key (str): The key of the page, see `get_key()`.
+
+        Returns:
+            bytes: The page, or None if it has not been recorded.
+        """
+        name = self.index["pages"].get(key) or self.paths.get(key.split("?")[0])
+        if name is None:
+            return None
+        with open(os.path.join(self.directory, name), "rb") as f:
+            return f.read()
+
+    def get_handler(self):
+        """Get the request handler class of the server, bound to this recording."""
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                replay.requests_cnt += 1
+                page = replay.get_page(get_key(self.path))
+                if page is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(page)))
+                self.send_header("Content-Security-Policy", CONTENT_SECURITY_POLICY)
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """Serve the recording from a background thread."""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    # Usage: python -m flatfindr.replay ./saves/recording
+    # Record a live Facebook search with the default criteria, to be replayed by `python -m flatfindr.benchmark ./saves/recording`
+    import tempfile
+
+    from flatfindr.facebook import Facebook
+    from flatfindr.planner import DEFAULT_SEARCH
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # An empty database, so that the ads already seen are recorded as well
+        fb = Facebook(headless=True, db_path=os.path.join(tmp, "db.json"))
+        cnt = record(fb, sys.argv[1], scroll=2, **DEFAULT_SEARCH)
+        fb.quit_driver()
+    print(f"{cnt} pages recorded inside `{sys.argv[1]}`")
@@ -0,0 +1,179 @@
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import date, timedelta
+
+RETENTION_DAYS = 16  # Twice the ONE_WEEK of flatfindr.scraper: older items are no longer sent as alerts
+TOMBSTONE_DAYS = 60  # Reposts usually come back within a few weeks
+PRUNE_BATCH = 100  # Maximum number of items removed at each step
+
+"""
+Retention policy of the database: the items seen more than `days` ago are removed (and optionally archived), so that the database, its load time and its scans stop growing.
+An item only leaves a tombstone behind (a hash of its url and the fingerprint of its description), kept for `tombstone_days` so that its reposts are still recognized.
+The items are appended in the order they are seen, so the expired ones are at the head of the database: the pruning is done a batch at a time while the scraper updates the database,
+instead of a full pass over it.
+"""
+
+
+def get_url_hash(url):
+    """Get the short hash of an item url kept inside its tombstone.
+
+    Args:
+        url (str): The url of the item.
+
+    Returns:
+        str: A 16 characters hexadecimal digest.
+    """
+    return hashlib.blake2b(url.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class Tombstones:
+    def __init__(self, tombstones=()):
+        """
+        Args:
+            tombstones (list): The saved tombstones, as [url hash, description fingerprint, expiry date] lists, see `flatfindr.storage.Storage.load_tombstones()`. Defaults to ().
+        """
+        self.urls = (
+            OrderedDict()
+        )  # {url hash: (fingerprint, expiry date)}, the first to expire first
+        self.fingerprints = {}  # {fingerprint: number of tombstones}
+        self.dirty = False
+        for url_hash, fingerprint, expires in tombstones:
+            self.insert(url_hash, fingerprint, expires)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def insert(self, url_hash, fingerprint, expires):
+        if url_hash in self.urls:
+            self.remove(url_hash)
+        self.urls[url_hash] = (fingerprint, expires)
+        if fingerprint:
+            self.fingerprints[fingerprint] = self.fingerprints.get(fingerprint, 0) + 1
+        self.dirty = True
+
+    def remove(self, url_hash):
+        fingerprint, _ = self.urls.pop(url_hash)
+        if fingerprint:
+            self.fingerprints[fingerprint] -= 1
+            if not self.fingerprints[fingerprint]:
+                del self.fingerprints[fingerprint]
+        self.dirty = True
+
+    def add(self, url, fingerprint, expires):
+        """Add the tombstone of a removed item.
+
+        Args:
+            url (str): The url of the item.
+            fingerprint (str): The fingerprint of its description, see `flatfindr.table.description_fingerprint()`. Empty if there is no description.
+            expires (str): The date (in isoformat) after which the tombstone is removed.
+        """
+        self.insert(get_url_hash(url), fingerprint, expires)
+
+    def has_url(self, url):
+        return get_url_hash(url) in self.urls
+
+    def has_fingerprint(self, fingerprint):
+        return fingerprint in self.fingerprints
+
+    def expire(self, today=None):
+        """Remove the expired tombstones.
+
+        Args:
+            today (datetime.date): The current date. Defaults to None, meaning `date.today()`.
+
+        Returns:
+            int: The number of removed tombstones.
+        """
+        today = (today or date.today()).isoformat()
+        cnt = 0
+        while self.urls:
+            url_hash, (_, expires) = next(iter(self.urls.items()))
+            if expires >= today:
+                break
+            self.remove(url_hash)
+            cnt += 1
+        return cnt
+
+    def to_list(self):
+        return [
+            [url_hash, fingerprint, expires]
+            for url_hash, (fingerprint, expires) in self.urls.items()
+        ]
+
+
+class Retention:
+    def __init__(
+        self,
+        days=RETENTION_DAYS,
+        tombstone_days=TOMBSTONE_DAYS,
+        batch=PRUNE_BATCH,
+        archive_path=None,
+    ):
+        """
+        Args:
+            days (int): The number of days an item is kept after it has been seen. If None, the items are never removed. Defaults to RETENTION_DAYS.
+            tombstone_days (int): The number of days a tombstone is kept after its item has been removed. Defaults to TOMBSTONE_DAYS.
+            batch (int): The maximum number of items removed at each step. Defaults to PRUNE_BATCH.
+            archive_path (str): The path of a file where the removed items are appended, one JSON line per item. If None, they are not archived. Defaults to None.
+        """
+        self.days = days
+        self.tombstone_days = tombstone_days
+        self.batch = batch
+        self.archive_path = archive_path
+
+    def count_expired(self, table, today=None):
+        """Count the expired items at the head of a table, up to `self.batch`.
+        An item without a `seen` date never expires.
+
+        Args:
+            table (flatfindr.table.Table): The `data` of the database.
+            today (datetime.date): The current date. Defaults to None, meaning `date.today()`.
+
+        Returns:
+            int: The number of expired items.
+        """
+        if self.days is None or "seen" not in table.columns:
+            return 0
+        cutoff = ((today or date.today()) - timedelta(days=self.days)).isoformat()
+        cnt = 0
+        while cnt < min(self.batch, len(table)):
+            seen = table.get(cnt, "seen")
+            if seen == "" or seen >= cutoff:
+                break
+            cnt += 1
+        return cnt
+
+    def prune(self, db, tombstones, today=None):
+        """Remove a batch of expired items from the head of the database, leaving their tombstones behind.
+        The storage of the database must be told with `flatfindr.storage.Storage.drop()`.
+
+        Args:
+            db (dict): The database, with a `columns` and a `data` (flatfindr.table.Table) keys.
+            tombstones (Tombstones): The tombstones of the removed items.
+            today (datetime.date): The current date. Defaults to None, meaning `date.today()`.
+
+        Returns:
+            list: The (url, description fingerprint, seen date) of the removed items.
+        """
+        table = db["data"]
+        cnt = self.count_expired(table, today)
+        if not cnt:
+            return []
+        if self.archive_path is not None:
+            with open(self.archive_path, "a") as archive_file:
+                for data in table[:cnt]:
+                    archive_file.write(
+                        json.dumps(dict(zip(db["columns"], data))) + "\n"
+                    )
+        expires = (
+            (today or date.today()) + timedelta(days=self.tombstone_days)
+        ).isoformat()
+        pruned = []
+        for i in range(cnt):
+            url = table.get(i, "url")
+            fingerprint = table.fingerprint(i, "description")
+            tombstones.add(url, fingerprint, expires)
+            pruned.append((url, fingerprint, table.get(i, "seen")))
+        table.drop(cnt)
+        return pruned
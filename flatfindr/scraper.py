@@ -1,22 +1,108 @@
+import copy
+import itertools
 import json
 import os
-import pickle
 import platform
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from datetime import date, timedelta, datetime
 
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.support.ui import WebDriverWait
 
+from flatfindr.bloom import BLOOM_EXTENSION, open_seen_filter
+from flatfindr.dedup import DUPLICATE_THRESHOLD, LSH_EXTENSION, NearDuplicateIndex
+from flatfindr.filters import DEFAULT_RULES
+from flatfindr.geo import PointIndex
+from flatfindr.geocoding import Geocoder
 from flatfindr.logins import LOGINS, URL
+from flatfindr.metrics import DEFAULT_METRICS_PATH, Metrics, RunReport
+from flatfindr.phash import PHASH_EXTENSION, ImageIndex, dhash, is_plain
+from flatfindr.politeness import Politeness
+from flatfindr.retention import Retention, Tombstones, get_url_hash
+from flatfindr.storage import DEFAULT_COLUMNS, get_storage
+from flatfindr.table import description_fingerprint
+from flatfindr.thumbnails import MAX_IMAGES
 
 ONE_WEEK = 8
+WAIT_TIMEOUT = 10  # Maximum number of seconds to wait for some content to be ready
+# Not shown in the string and html representations of an item
+HIDDEN_FEATURES = ("images", "state", "lat", "lng", "seen", "image_hashes")
+# Maximum number of seconds to wait for all the photos of an item before telling whether it is a duplicate
+IMAGES_TIMEOUT = 5
 KEYWORDS = {"gmaps": "+Montr%C3%A9al,+QC"}
 DEFAULT_DB_PATH = os.path.join(
     os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
     os.path.join("saves", "db.json"),
 )
 
+
+def create_driver(headless=True):
+    """Launch a new webdriver.
+
+    Args:
+        headless (bool): Set to False if you want the browser to run with a GUI (meaning a window will pop-up). Defaults to True.
+
+    Returns:
+        selenium.webdriver.Chrome: The webdriver, or None if it could not be launched.
+    """
+    # Handle the 'Allow notifications box':
+    options = Options()
+    options.add_argument("--disable-infobars")
+    options.add_argument("start-maximized")
+    options.add_argument("--disable-extensions")
+    options.add_experimental_option(
+        "prefs", {"profile.default_content_setting_values.notifications": 2}
+    )
+    if headless:
+        options.add_argument("--headless")
+    system_name = platform.system()  # Linux, Mac, Windows
+    system_arch = platform.machine()  # arm, amd64, ...
+    if system_name == "Linux" and system_arch == "amd64":  # if Docker
+        options.add_argument("window-size=1024,768")
+        options.add_argument("--no-sandbox")
+
+    try:
+        if system_name == "Linux" and system_arch == "armv7l":  # if Raspberry Pi
+            # browser is Chromium
+            options.BinaryLocation = "/usr/bin/chromium-browser"
+            # custom chromedriver for Raspberry
+            driver_path = "/usr/bin/chromedriver"
+        else:
+            driver_path = os.path.join(
+                os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                os.path.join("driver", "chromedriver"),
+            )
+        driver = webdriver.Chrome(service=Service(driver_path), options=options)
+        driver.implicitly_wait(10)
+        return driver
+    except:
+        print(
+            "Error: Check that your chromedriver fits with your browser version and your system architecture"
+        )
+        return None
+
+
+# Return the deduplicated href (minus query string) of every <a> element containing arguments[0]
+HARVEST_LINKS_SCRIPT = """
+const pattern = arguments[0];
+const links = new Set();
+for (const anchor of document.querySelectorAll("a[href]")) {
+    if (anchor.href.includes(pattern)) {
+        links.add(anchor.href.split("?")[0]);
+    }
+}
+return Array.from(links);
+"""
+COUNT_LINKS_SCRIPT = """
+return document.querySelectorAll("a[href*='" + arguments[0] + "']").length;
+"""
+
 """
 Main class for the flatfindr library.
 Implements a Scraper that can load a webdriver, load/save/update the database and run a full search.
@@ -27,12 +113,35 @@ See the Subscraper Class for an exemple.
 
 
 class Scraper:
-    def __init__(self, website="", headless=True, db_path=DEFAULT_DB_PATH):
+    def __init__(
+        self,
+        website="",
+        headless=True,
+        db_path=DEFAULT_DB_PATH,
+        duplicate_threshold=DUPLICATE_THRESHOLD,
+        lease=None,
+        politeness=None,
+        cancelled=None,
+        metrics=None,
+        retention=None,
+        geocoder=None,
+        thumbnails=None,
+        db_lock=None,
+    ):
         """
         Args:
             website (str): The name of the website you want to scrap. Should match with the keys of the `LOGINS` dictionnary from `logins.py`, e.g.: 'facebook'
             headless (bool): Set to False if you want the browser to run with a GUI (meaning a window will pop-up). Defaults to True.
-            db_path (str): The path to the JSON database. Defaults to ./saves/db.json from the package root.
+            db_path (str): The path to the database. Use a `.db` or `.sqlite` extension for a SQLite database, else a JSON one is used. Defaults to ./saves/db.json from the package root.
+            duplicate_threshold (float): The similarity (between 0 and 1) above which an item description is considered as a repost of an already seen one. Defaults to DUPLICATE_THRESHOLD.
+            lease (flatfindr.pool.Lease): A webdriver leased from a `flatfindr.pool.DriverPool`. If given, it is used instead of launching a new browser, and it is not quit at the end of `run()`. Defaults to None.
+            politeness (flatfindr.politeness.Politeness): The delays to respect between actions. Defaults to None, meaning the default `Politeness()`.
+            cancelled (threading.Event): An event set from another thread to stop the run early, e.g. `flatfindr.executor.Task.cancelled`. The items already scraped are still saved. Defaults to None.
+            metrics (flatfindr.metrics.Metrics): The metrics the timers and counters of the runs are added to. Defaults to None, meaning the metrics written inside ./saves/metrics from the package root.
+            retention (flatfindr.retention.Retention): The policy removing the old items from the database. Defaults to None, meaning the default `Retention()`.
+            geocoder (flatfindr.geocoding.Geocoder): The geocoder of the addresses of the new items without coordinates. Defaults to None, meaning the default `Geocoder()`.
+            thumbnails (flatfindr.thumbnails.ThumbnailCache): The cache where the thumbnails of the items images are downloaded, in the background. They are also used to recognize the reposts of seen items from their photos. Defaults to None, meaning no thumbnails.
+            db_lock (threading.RLock): The lock held while the database is loaded or saved. Share it between the scrapers of a process working on the same SQLite database at the same time, so that their saves don't interleave: each save merges the changes of the index files saved by the others. Defaults to None, meaning a lock of its own.
         """
         self.website = website
         try:
@@ -46,9 +155,30 @@ class Scraper:
             self.email = "id"
             self.password = "pwd"
         self.db_path = db_path
-        self.load_driver(headless=headless)
+        self.duplicate_threshold = duplicate_threshold
+        self.lease = lease
+        self.headless = headless
+        self.politeness = politeness or Politeness()
+        self.cancelled = cancelled
+        self.retention = retention or Retention()
+        self.geocoder = geocoder or Geocoder()
+        self.thumbnails = thumbnails
+        self.db_lock = db_lock or threading.RLock()
+        self.report = RunReport(
+            metrics=metrics or Metrics(DEFAULT_METRICS_PATH), website=website
+        )
+        if lease is None:
+            self.load_driver(headless=headless)
+        else:
+            self.driver = lease.driver
         self.main_url = URL.get(website, "")
+        self.cookies_path = os.path.join(
+            os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+            "saves",
+            f"cookies-{website}.json",
+        )
         self.items_links = []
+        self.new_items = []
         self.load_db()
 
     def load_driver(self, headless=True):
@@ -57,75 +187,104 @@ class Scraper:
         Args:
             headless (bool): Set to False if you want the browser to run with a GUI (meaning a window will pop-up). Defaults to True.
         """
-        # Handle the 'Allow notifications box':
-        options = Options()
-        options.add_argument("--disable-infobars")
-        options.add_argument("start-maximized")
-        options.add_argument("--disable-extensions")
-        options.add_experimental_option(
-            "prefs", {"profile.default_content_setting_values.notifications": 2}
-        )
-        if headless:
-            options.add_argument("--headless")
-        system_name = platform.system()  # Linux, Mac, Windows
-        system_arch = platform.machine()  # arm, amd64, ...
-        if system_name == "Linux" and system_arch == "amd64":  # if Docker
-            options.add_argument("window-size=1024,768")
-            options.add_argument("--no-sandbox")
+        with self.report.timer("driver_startup"):
+            self.driver = create_driver(headless=headless)
+
+    def wait_for(self, condition, timeout=WAIT_TIMEOUT):
+        """Wait until a condition on the page is met, e.g. some content is rendered.
+
+        Args:
+            condition (callable): A function taking the webdriver as argument and returning a truthy value once the condition is met.
+            timeout (float): The maximum number of seconds to wait. Defaults to WAIT_TIMEOUT.
 
+        Returns:
+            bool: True if the condition has been met, False if the timeout expired.
+        """
         try:
-            if system_name == "Linux" and system_arch == "armv7l":  # if Raspberry Pi
-                # browser is Chromium
-                options.BinaryLocation = "/usr/bin/chromium-browser"
-                # custom chromedriver for Raspberry
-                driver_path = "/usr/bin/chromedriver"
-            else:
-                driver_path = os.path.join(
-                    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
-                    os.path.join("driver", "chromedriver"),
-                )
-            self.driver = webdriver.Chrome(
-                service=Service(driver_path), options=options
-            )
-            self.driver.implicitly_wait(10)
+            WebDriverWait(self.driver, timeout, poll_frequency=0.2).until(condition)
+            return True
+        except TimeoutException:
+            return False
+
+    def count_links(self, pattern):
+        """Count the links of the current page that contain a given pattern, in a single webdriver call.
+
+        Args:
+            pattern (str): The pattern the links must contain, e.g. '/marketplace/item/'.
+
+        Returns:
+            int: The number of links.
+        """
+        try:
+            return self.driver.execute_script(COUNT_LINKS_SCRIPT, pattern)
         except:
-            print(
-                "Error: Check that your chromedriver fits with your browser version and your system architecture"
-            )
+            return 0
 
     def quit_driver(self):
         """Quit the webdriver."""
         self.driver.quit()
 
     def save_cookies(self):
-        """Save cookies from current session.
-        The cookies are saved in ./saves/cookies-<WEBSITE_NAME>.pkl from package root.
+        """Save cookies from current session, as JSON, so that the session can be restored by the next runs.
+        The cookies are saved in ./saves/cookies-<WEBSITE_NAME>.json from package root, readable by the owner only.
         """
-        cookies_path = os.path.join(
-            os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
-            "saves",
-            f"cookies-{self.website}.pkl",
-        )
-        with open(cookies_path, "wb") as cookies_file:
-            pickle.dump(self.driver.get_cookies(), cookies_file)
+        # Unique, as the workers of a parallel run save their sessions at the same time
+        tmp_path = f"{self.cookies_path}.{threading.get_ident()}.tmp"
+        with open(
+            os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w"
+        ) as cookies_file:
+            json.dump(self.driver.get_cookies(), cookies_file)
+        os.replace(tmp_path, self.cookies_path)
 
     def load_cookies(self):
-        """Load the cookies previously saved so that the webdriver don't need to log in every time it opens a webdriver for `self.website`."""
+        """Load the cookies previously saved so that the webdriver don't need to log in every time it opens a webdriver for `self.website`.
+
+        Returns:
+            bool: True if some unexpired cookies have been loaded.
+        """
+        if not os.path.isfile(self.cookies_path):
+            return False
+        try:
+            with open(self.cookies_path, "r") as cookies_file:
+                cookies = json.load(cookies_file)
+        except ValueError:
+            return False
+        now = time.time()
+        cookies = [cookie for cookie in cookies if cookie.get("expiry", now + 1) > now]
+        if not cookies:
+            return False
+        # Cookies can only be added for the domain of the current page
+        self.politeness.pause("page")
         self.driver.get(self.main_url)
-        cookies_path = os.path.join(
-            os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
-            "saves",
-            f"cookies-{self.website}.pkl",
-        )
-        with open(cookies_path, "rb") as cookies_file:
-            cookies = pickle.load(cookies_file)
         for cookie in cookies:
-            self.driver.add_cookie(cookie)
+            try:
+                self.driver.add_cookie(cookie)
+            except:
+                pass
+        return True
+
+    def is_logged_in(self):
+        """Return True if the webdriver is logged in the website, using a check as cheap as possible.
+        The full version of this method needs to be implemented inside each subclass, as the way to check it is different from one website to another.
+        """
+        return False
+
+    def restore_session(self):
+        """Restore the session saved by a previous run, instead of logging in again.
+
+        Returns:
+            bool: True if the restored session is still valid (i.e. logged in), False if a full log in is needed.
+        """
+        if not self.load_cookies():
+            return False
+        self.driver.refresh()
+        return self.is_logged_in()
 
     def log_in(self):
         """Get the webdriver to the main page so that it can log in.
         The full version of this method needs to be implemented inside each subclass, as the way to log in is different from one website to another.
         """
+        self.politeness.pause("page")
         self.driver.get(self.main_url)
 
     def get_items_links(self, **kwargs):
@@ -140,23 +299,106 @@ class Scraper:
         """
         return self.items_links
 
-    def get_item_details(self, item_url, **kwargs):
+    def harvest_links(self, pattern):
+        """Get the links (i.e. url) of the current page that contain a given pattern, in a single webdriver call.
+
+        Args:
+            pattern (str): The pattern the links must contain, e.g. '/marketplace/item/'.
+
+        Returns:
+            list: The deduplicated links, without their query string, in document order.
+        """
+        try:
+            with self.report.timer("harvest_links"):
+                return self.driver.execute_script(HARVEST_LINKS_SCRIPT, pattern)
+        except:
+            print("Error while harvesting the links of the page")
+            return []
+
+    def add_items_links(self, items_links):
+        """Add to `self.items_links` the links that have never been scraped before and are not already in it.
+
+        Args:
+            items_links (list): The links (i.e. url) of some items.
+
+        Returns:
+            int: The number of links added.
+        """
+        links_to_scrap = set(self.items_links)
+        cnt = 0
+        for item_url in items_links:
+            if not self.is_seen(item_url) and item_url not in links_to_scrap:
+                links_to_scrap.add(item_url)
+                self.items_links.append(item_url)
+                cnt += 1
+        return cnt
+
+    def get_item_details(self, item_url, rules=DEFAULT_RULES):
+        """Go to the item url with the webdriver, scrap as much details as possible about the item and tell whether it is interesting.
+
+        Args:
+            item_url (str): The url (or link) of the item.
+            rules (flatfindr.filters.RuleSet): The filter rules applied to the item description. Defaults to DEFAULT_RULES (no swaps, no ground floors).
+
+        Returns:
+            dict: A dictionnary with all the item details.
+        """
+        return self.classify_item(self.scrape_item_details(item_url), rules=rules)
+
+    def scrape_item_details(self, item_url):
         """Go to the item url with the webdriver and scrap as much details as possible about the item.
         The full version of this method needs to be implemented inside each subclass, as the way to get these details is different from one website to another.
 
         Args:
             item_url (str): The url (or link) of the item.
-            **kwargs: Additional search criteria, e.g. `remove_first_floor`.
-                      See the implementation of the method inside each SubScraper class for additional details.
 
         Returns:
             dict: A dictionnary with all the item details.
         """
         item_details = {}
         item_details["url"] = item_url
+        self.politeness.pause("page")
         self.driver.get(item_url)
         return item_details
 
+    def classify_item(self, item_details, rules=DEFAULT_RULES):
+        """Set the state of an item: 'new' if it is interesting, 'NI' if it is old, a repost of a seen item (from its description or its photos), or excluded by the filter rules.
+        The description and images of a not interesting item are dropped. The decision is counted inside `self.report`.
+
+        Args:
+            item_details (dict): A dictionnary with all the item details, updated in place.
+            rules (flatfindr.filters.RuleSet): The filter rules applied to the item description. Defaults to DEFAULT_RULES (no swaps, no ground floors).
+
+        Returns:
+            dict: The same dictionnary, with its state.
+        """
+        with self.report.timer("classify_item"):
+            if self.is_old(item_details):
+                decision = "old"
+            elif self.is_near_duplicate(item_details):
+                decision = "duplicate"
+            else:
+                result = self.is_filtered(item_details, rules)
+                for rule in result.fired:
+                    self.report.count("filter_rules", rule=rule)
+                if result:
+                    decision = "filtered"
+                elif self.is_image_duplicate(item_details):
+                    decision = "duplicate"
+                else:
+                    decision = "new"
+        self.report.count("items", decision=decision)
+        item_details["seen"] = date.today().isoformat()
+        if decision != "new":
+            # We are not interested by this ads
+            item_details["state"] = "NI"
+            item_details["description"] = ""
+            item_details["images"] = []
+        else:
+            item_details["state"] = "new"
+            item_details.setdefault("images", [])
+        return item_details
+
     def item_details_to_string(self, item_details):
         """Get a string representation of an item details (address, price, description, ...).
 
@@ -168,7 +410,7 @@ class Scraper:
         """
         sentence = ""
         for key, value in item_details.items():
-            if key not in ("images", "state") and value != "":
+            if key not in HIDDEN_FEATURES and value != "":
                 sentence += f"{key}: {value} \n"
         sentence += "\n  " + "=" * 40 + "\n  " + "=" * 40 + "\n"
         return sentence
@@ -185,7 +427,7 @@ class Scraper:
         """
         sentence = ""
         for key, value in item_details.items():
-            if key not in ("images", "state") and value != "":
+            if key not in HIDDEN_FEATURES and value != "":
                 if key == "url":
                     sentence += f"{key}: <a target='_blank' href='{value}'>{value[-15:-1]}</a> \n"
                 elif key == "address":
@@ -202,77 +444,267 @@ class Scraper:
         return sentence
 
     def is_old(self, item_details):
-        """Return True if the item has been published more than a week ago.
+        """Return True if the item has been published a week ago or more.
+        An item without a publication date is never old.
 
         Args:
             item_details (dict): A dictionnary with all the item details.
         """
-        return (
-            item_details.get("published")
-            == (date.today() - timedelta(days=ONE_WEEK)).isoformat()
-        )
+        published = item_details.get("published")
+        cutoff = (date.today() - timedelta(days=ONE_WEEK)).isoformat()
+        return bool(published) and published <= cutoff
 
     def is_duplicate(self, item_details):
-        """Return True if the item has previously been seen (i.e. this item already exists inside the database but with a different url).
+        """Return True if the item has previously been seen (i.e. this item already exists inside the database but with a different url, or it has been removed from it but left a tombstone).
         It can happens when people repost their ads every week or so, in order for their ads to be on top page.
 
         Args:
             item_details (dict): A dictionnary with all the item details.
         """
-        all_description = [data[-1] for data in self.db["data"] if data[-1] != ""]
-        return item_details.get("description") in all_description
+        fingerprint = description_fingerprint(item_details.get("description"))
+        return fingerprint != "" and (
+            fingerprint in self.seen_descriptions
+            or self.tombstones.has_fingerprint(fingerprint)
+        )
 
-    def is_swap(self, item_details):
-        """Return True if the item is about swapping flats instead of renting one.
+    def is_near_duplicate(self, item_details):
+        """Return True if the item description is the same as, or very similar to, a previously seen one (e.g. a repost with a word or the price changed).
+        See `flatfindr.dedup.NearDuplicateIndex`.
 
         Args:
             item_details (dict): A dictionnary with all the item details.
         """
-        return any(
-            swap in item_details.get("description", "").lower()
-            for swap in ("swap", "transfer", "échange", "exchange")
-        )
+        if self.is_duplicate(item_details):
+            return True
+        description = item_details.get("description") or ""
+        return self.near_duplicates.is_near_duplicate(description)
 
-    def is_first_floor(self, item_details):
-        """Return True if the item is on the ground floor (also called first floor in America).
+    def get_image_hashes(self, item_details):
+        """Get the perceptual hashes of the first photos of an item, from their thumbnails, see `flatfindr.phash.dhash()`.
+        The photos still being downloaded are waited for, at most IMAGES_TIMEOUT seconds in all.
 
         Args:
             item_details (dict): A dictionnary with all the item details.
+
+        Returns:
+            list: The hashes, without those of the plain pictures. Empty if there is no thumbnails cache.
         """
-        return any(
-            ff in item_details.get("description", "").lower()
-            for ff in (
-                "ground floor",
-                "first floor",
-                "rdc",
-                "rez-de-chaussée",
-                "rez de chaussée",
-            )
+        if self.thumbnails is None or not item_details.get("images"):
+            return []
+        hashes = []
+        with self.report.timer("image_hashes"):
+            for path in self.thumbnails.wait(
+                item_details["images"][:MAX_IMAGES], timeout=IMAGES_TIMEOUT
+            ):
+                try:
+                    with open(path, "rb") as thumbnail_file:
+                        value = dhash(thumbnail_file.read())
+                except Exception as e:
+                    print(f"Error while hashing the thumbnail `{path}`: {e}")
+                    continue
+                if not is_plain(value):
+                    hashes.append(value)
+        return hashes
+
+    def is_image_duplicate(self, item_details):
+        """Return True if the item shares its photos with a previously seen one, e.g. a repost with a rewritten description.
+        The hashes of the photos are kept inside `item_details['image_hashes']`, see `get_image_hashes()` and `flatfindr.phash.ImageIndex`.
+
+        Args:
+            item_details (dict): A dictionnary with all the item details, updated in place.
+        """
+        item_details["image_hashes"] = self.get_image_hashes(item_details)
+        return self.image_duplicates.is_duplicate(item_details["image_hashes"])
+
+    def is_seen(self, item_url):
+        """Return True if the item url has already been scraped, i.e. it already exists inside the database or it has left a tombstone.
+        The Bloom filter of the seen urls is consulted first: most of the never seen urls are told apart without the exact checks.
+
+        Args:
+            item_url (str): The url (or link) of the item.
+        """
+        if item_url not in self.seen_filter:
+            return False
+        if item_url in self.seen_urls or self.tombstones.has_url(item_url):
+            return True
+        self.report.count("seen_filter_false_positives")
+        return False
+
+    def build_index(self):
+        """Build the in-memory index of the database: the set of seen urls, the set of description fingerprints, the near-duplicate index of descriptions,
+        the index of the photos hashes and the spatial index of the new items locations.
+        Also open the Bloom filter of the seen urls (`self.db_path` + `.bloom`), rebuilt from the database and the tombstones if needed, see `flatfindr.bloom.open_seen_filter()`.
+        """
+        table = self.db["data"]
+        self.seen_filter = open_seen_filter(
+            self.db_path + BLOOM_EXTENSION,
+            lambda: itertools.chain(
+                map(get_url_hash, table.column("url")), list(self.tombstones.urls)
+            ),
+            len(table) + len(self.tombstones),
+            recent_urls=[
+                table.get(i, "url") for i in range(max(len(table) - 10, 0), len(table))
+            ],
+        )
+        self.seen_urls = set()
+        self.seen_descriptions = set()
+        self.near_duplicates = NearDuplicateIndex(
+            path=self.db_path + LSH_EXTENSION, threshold=self.duplicate_threshold
         )
+        self.near_duplicates.load()
+        self.image_duplicates = ImageIndex(path=self.db_path + PHASH_EXTENSION)
+        self.image_duplicates.load()
+        self.locations = PointIndex()
+        for url, state, lat, lng in zip(
+            table.column("url"),
+            table.column("state"),
+            table.column("lat"),
+            table.column("lng"),
+        ):
+            if state == "new" and lat != "" and lng != "":
+                self.locations.add(url, lat, lng)
+        # The descriptions are only loaded from the disk for the signatures to rebuild
+        for i, (url, fingerprint) in enumerate(
+            zip(table.column("url"), table.fingerprints("description"))
+        ):
+            self.seen_urls.add(url)
+            if fingerprint:
+                self.seen_descriptions.add(fingerprint)
+                if url not in self.near_duplicates:
+                    # The signature is missing from the persisted index: rebuild it
+                    self.near_duplicates.add(url, table.get(i, "description"))
+
+    def index_item(self, item_details):
+        """Add an item to the in-memory index of the database.
 
-    def update_db(self, max_items=30, to_html=False, **kwargs):
+        Args:
+            item_details (dict): A dictionnary with all the item details.
+        """
+        self.seen_urls.add(item_details.get("url", ""))
+        self.seen_filter.add(item_details.get("url", ""))
+        fingerprint = description_fingerprint(item_details.get("description"))
+        if fingerprint:
+            self.seen_descriptions.add(fingerprint)
+            self.near_duplicates.add(item_details["url"], item_details["description"])
+        if item_details.get("state") == "new" and item_details.get("image_hashes"):
+            self.image_duplicates.add(item_details["url"], item_details["image_hashes"])
+        if (
+            item_details.get("state") == "new"
+            and item_details.get("lat", "") != ""
+            and item_details.get("lng", "") != ""
+        ):
+            self.locations.add(
+                item_details["url"], item_details["lat"], item_details["lng"]
+            )
+
+    def items_around(self, lat, lng, radius):
+        """Get the new items of the database located inside a circle, e.g. the search area of a user.
+
+        Args:
+            lat (float): The latitude of the center of the circle.
+            lng (float): The longitude of the center of the circle.
+            radius (float): The radius of the circle, in km.
+
+        Returns:
+            list: A list of (url, distance in km) tuples, from the closest.
+        """
+        return self.locations.within(lat, lng, radius)
+
+    def geocode_item(self, item_details):
+        """Set the coordinates of an item from its address, if they could not be scraped.
+
+        Args:
+            item_details (dict): A dictionnary with all the item details, updated in place.
+        """
+        if not item_details.get("address") or (
+            item_details.get("lat", "") != "" and item_details.get("lng", "") != ""
+        ):
+            return
+        try:
+            with self.report.timer("geocode"):
+                coordinates = self.geocoder.geocode(item_details["address"])
+        except Exception as e:
+            print(f"Error while geocoding `{item_details['address']}`: {e}")
+            return
+        if coordinates is not None:
+            item_details["lat"], item_details["lng"] = coordinates
+
+    def prune(self):
+        """Remove a batch of old items from the database and from its index, leaving their tombstones behind, see `flatfindr.retention.Retention`.
+        Also remove the expired tombstones. Called at each step of `update_db()`, so that the database is pruned a little at a time.
+
+        Returns:
+            int: The number of removed items.
+        """
+        with self.report.timer("prune"):
+            self.tombstones.expire()
+            pruned = self.retention.prune(self.db, self.tombstones)
+            for url, fingerprint, _ in pruned:
+                self.seen_urls.discard(url)
+                self.seen_descriptions.discard(fingerprint)
+                self.near_duplicates.remove(url)
+                self.image_duplicates.remove(url)
+                self.locations.remove(url)
+            self.storage.drop([(url, seen) for url, _, seen in pruned])
+        if pruned:
+            self.report.count("pruned", len(pruned))
+        return len(pruned)
+
+    def is_filtered(self, item_details, rules=DEFAULT_RULES):
+        """Return the result of a filter rule set on the item description, e.g. whether it is about swapping flats or on the ground floor.
+        The result is truthy if the item should be excluded. See `flatfindr.filters.RuleSet`.
+
+        Args:
+            item_details (dict): A dictionnary with all the item details.
+            rules (flatfindr.filters.RuleSet): The rules to apply. Defaults to DEFAULT_RULES.
+
+        Returns:
+            flatfindr.filters.FilterResult: The names of the rules that fired, and whether the item should be excluded.
+        """
+        return rules.evaluate(item_details.get("description", ""))
+
+    def update_db(self, max_items=30, to_html=False, workers=1, **kwargs):
         """Go to every items links from `self.items_links` and scrap every details from theses pages.
         Then, save all these details inside the database and return string or html representations of these.
+        The details of the new (i.e. interesting) items are also kept in `self.new_items`.
+        With several workers, the pages are scraped in parallel but the items are still classified and saved one by one, in the links order,
+        so that the result is the same as with a single worker.
+        The old items are removed from the database along the way, see `prune()`.
 
         Args:
             max_items (int): The maximum number of items you want to scrap for each run. It is good use to not set it too high, to avoid getting banned from the website. Defaults to 30.
             to_html (bool): If set to True, return a list of html representations of the items details. Defaults to False.
-            **kwargs: Additional search criteria for the get_item_details() method, e.g. `remove_first_floor`.
-                      See the implementation of the method inside each SubScraper class for additional details.
+            workers (int): The number of webdrivers scraping the items pages at the same time. Defaults to 1.
+            **kwargs: Additional search criteria for the classify_item() method, e.g. `rules`.
 
         Returns:
             list: A list of all the string or html representations of the items details. It is usefull for printing all the details from the new flats you found.
         """
         items_details = []
+        self.new_items = []
         cnt = 0
-        for item_url in self.items_links[:max_items]:
-            item_details = self.get_item_details(item_url, **kwargs)
+        items_links = self.items_links[:max_items]
+        if workers > 1 and len(items_links) > 1:
+            scraped_items = self.scrape_in_parallel(items_links, workers)
+        else:
+            scraped_items = map(self.scrape_item, items_links)
+        self.prune()
+        for item_details in scraped_items:
+            if self.cancelled is not None and self.cancelled.is_set():
+                print("The run has been cancelled")
+                break
+            self.prune()
+            item_details = self.classify_item(item_details, **kwargs)
+            if item_details.get("state") == "new":
+                self.geocode_item(item_details)
             self.db["data"].append(
                 [item_details.get(feature, "") for feature in self.db["columns"]]
             )
+            self.index_item(item_details)
             if item_details.get("state") == "new":
                 # If the ad is interesting
                 cnt += 1
+                self.new_items.append(item_details)
                 if to_html:
                     items_details.append(self.item_details_to_html(item_details))
                 else:
@@ -286,60 +718,197 @@ class Scraper:
         self.items_links = []
         return items_details
 
+    def scrape_item(self, item_url):
+        """Scrap the details of an item with `scrape_item_details()`, timed as the `get_item_details` stage of the run report.
+        The download of the thumbnails of its images is queued to `self.thumbnails`, if any, see `flatfindr.thumbnails.ThumbnailCache`.
+
+        Args:
+            item_url (str): The url (or link) of the item.
+
+        Returns:
+            dict: A dictionnary with all the item details.
+        """
+        with self.report.timer("get_item_details"):
+            item_details = self.scrape_item_details(item_url)
+        if self.thumbnails is not None and not self.is_old(item_details):
+            # Downloaded by the workers of the cache while the next items are scraped, see `get_image_hashes()`
+            self.thumbnails.submit(item_details.get("images", [])[:MAX_IMAGES])
+        return item_details
+
+    def spawn_worker(self):
+        """Get a copy of this scraper with its own new webdriver, logged in, to scrap items pages in parallel.
+        The copy shares the database, the index and the politeness policy (so the delays between pages are respected globally).
+
+        Returns:
+            Scraper: The worker, whose webdriver must be quit once done.
+        """
+        worker = copy.copy(self)
+        worker.lease = None
+        worker.load_driver(headless=self.headless)
+        if worker.driver is None:
+            raise RuntimeError("The webdriver of a worker could not be launched")
+        if not worker.restore_session():
+            worker.log_in()
+        return worker
+
+    def scrape_in_parallel(self, items_links, workers):
+        """Scrap the items pages with several webdrivers, pulling the links from a shared queue.
+        The first worker is this scraper (and its webdriver), the other ones are spawned, see `spawn_worker()`.
+
+        Args:
+            items_links (list): The links (i.e. url) of the items to scrap.
+            workers (int): The number of webdrivers.
+
+        Yields:
+            dict: The details of each item, as returned by `scrape_item_details()`, in the same order as `items_links`.
+        """
+        results = [Future() for _ in items_links]
+        links_queue = queue.Queue()
+        for i, item_url in enumerate(items_links):
+            links_queue.put((i, item_url))
+        stop = threading.Event()
+
+        def work(scraper):
+            while not stop.is_set():
+                try:
+                    i, item_url = links_queue.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[i].set_result(scraper.scrape_item(item_url))
+                except Exception as e:
+                    results[i].set_exception(e)
+
+        def spawn_and_work():
+            try:
+                worker = self.spawn_worker()
+            except Exception as e:
+                print(f"Error while launching a worker: {e}")
+                return
+            try:
+                work(worker)
+            finally:
+                worker.quit_driver()
+
+        threads = [threading.Thread(target=work, args=(self,), daemon=True)]
+        threads += [
+            threading.Thread(target=spawn_and_work, daemon=True)
+            for _ in range(min(workers, len(items_links)) - 1)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for result in results:
+                yield result.result()
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
     def load_db(self):
-        """Load the JSON database and assign it to `self.db` as a dictionnary."""
-        if os.path.isfile(self.db_path):  # if the db's json exists, load it
-            with open(self.db_path, "r") as db_file:
-                self.db = json.load(db_file)
-        else:  # if it doesn't exist, create a raw one and save it
-            self.db = {
-                "columns": [
-                    "url",
-                    "state",
-                    "published",
-                    "price",
-                    "bedrooms",
-                    "surface",
-                    "address",
-                    "furnished",
-                    "images",
-                    "description",
-                ],
-                "data": [],
-            }
-            self.save_db()
+        """Load the database and assign it to `self.db` as a dictionnary.
+        The storage backend (JSON or SQLite) is selected from the extension of `self.db_path`, see `flatfindr.storage.get_storage()`.
+        Also build the index of seen urls and descriptions, see `build_index()`, and load the tombstones of the removed items.
+        `self.db_lock` is held meanwhile.
+        """
+        with self.db_lock:
+            self.storage = get_storage(self.db_path)
+            self.db = self.storage.load()
+            self.tombstones = Tombstones(self.storage.load_tombstones())
+            if self.db is None:  # if the db doesn't exist, create a raw one and save it
+                table = self.storage.new_table(DEFAULT_COLUMNS)
+                self.db = {"columns": table.columns, "data": table}
+                self.build_index()
+                self.save_db()
+            else:
+                # Add the columns created since the db was, e.g. `lat` and `lng`
+                for column in DEFAULT_COLUMNS:
+                    if column not in self.db["columns"]:
+                        # The items saved before `seen` existed are considered as seen today
+                        value = date.today().isoformat() if column == "seen" else ""
+                        self.db["data"].add_column(column, value)
+                self.build_index()
 
     def save_db(self):
-        """Save the database dictionnary as a JSON file."""
+        """Save the database dictionnary with the storage backend, along with its index files and the new geocoding lookups.
+        `self.db_lock` is held meanwhile.
+
+        Returns:
+            bool: True if everything has been saved, False if an error occurred (it is printed and counted as `save_errors`).
+        """
         try:
-            with open(self.db_path, "w") as db_file:
-                json.dump(self.db, db_file)
-        except:
+            with self.db_lock, self.report.timer("save_db"):
+                self.storage.save(self.db)
+                self.near_duplicates.save()
+                self.image_duplicates.save()
+                self.seen_filter.flush()
+                if self.tombstones.dirty:
+                    self.storage.save_tombstones(self.tombstones.to_list())
+                    self.tombstones.dirty = False
+                self.geocoder.flush()
+        except Exception as e:
             print(
-                f"Error while trying to save the database to `{self.db_path}`. Please use a valid path, e.g. `./data/db.json`"
+                f"Error while trying to save the database to `{self.db_path}`: {e!r}. Please use a valid path, e.g. `./data/db.json`"
             )
+            self.report.count("save_errors")
+            return False
+        return True
+
+    def close_db(self):
+        """Close the database connection and the Bloom filter of the seen urls, once the database has been saved.
+        The next run loads the database again.
+        """
+        self.storage.close()
+        self.seen_filter.close()
+        self.storage = None
 
-    def run(self, to_html=False, max_items=30, **kwargs):
+    def run(
+        self, to_html=False, max_items=30, rules=DEFAULT_RULES, workers=1, **kwargs
+    ):
         """Main method to run a full search : log in, get links, scrap all the links, update the database with the new ads, quit the webdriver.
+        The session saved by a previous run is restored if still valid, so that the full log in is only done when it has expired.
+        If the webdriver has been leased from a pool, the log in is skipped when already done with this webdriver and still valid (see `is_logged_in()`), and the webdriver is not quit.
+        The timers and counters of the run are added to the metrics, see `flatfindr.metrics`.
+        The database is closed at the end of the run, see `close_db()`.
 
         Args:
             to_html (bool): If set to True, return a list of html representations of the items details. Defaults to False.
             max_items (int): The maximum number of items you want to scrap for each run. It is good use to not set it too high, to avoid getting banned. Defaults to 30.
+            rules (flatfindr.filters.RuleSet): The filter rules applied to the items descriptions. Defaults to DEFAULT_RULES (no swaps, no ground floors).
+            workers (int): The number of webdrivers scraping the items pages at the same time. Defaults to 1.
             **kwargs: You search criteria, depending on the website you're scrapping (eg. minimum price, number of bedrooms, ...)
 
         Returns:
             list: A list of all the string or html representations of the items details. It is usefull for printing all the details from the new flats you found.
         """
-        # cookies_path = os.path.join(
-        #     os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
-        #     "saves/cookies.pkl",
-        # )
-        # if not os.path.isfile(cookies_path):
-        #     self.log_in()
-        # else:
-        #     self.load_cookies()
-        self.log_in()
-        self.get_items_links(**kwargs)
-        items_details = self.update_db(max_items=max_items, to_html=to_html)
-        self.quit_driver()
+        if self.storage is None:
+            # Closed by the previous run
+            self.load_db()
+        if self.lease is not None and self.lease.logged_in and not self.is_logged_in():
+            # The session of the leased webdriver expired since its last run
+            self.lease.logged_in = False
+        if self.lease is None or not self.lease.logged_in:
+            with self.report.timer("restore_session"):
+                logged_in = self.restore_session()
+            if not logged_in:
+                with self.report.timer("log_in"):
+                    self.log_in()
+                logged_in = self.is_logged_in()
+            if self.lease is not None:
+                # Otherwise the next run of the webdriver tries again
+                self.lease.logged_in = logged_in
+        with self.report.timer("get_items_links"):
+            self.get_items_links(**kwargs)
+        self.report.count("links", len(self.items_links))
+        with self.report.timer("update_db"):
+            items_details = self.update_db(
+                max_items=max_items, to_html=to_html, workers=workers, rules=rules
+            )
+        if self.lease is None:
+            # A leased webdriver stays warm: it is given back to its pool by the caller
+            self.quit_driver()
+        self.close_db()
+        # Add the report of this run to the metrics, and start the report of the next one
+        self.report.finish()
+        self.report = RunReport(metrics=self.report.metrics, website=self.website)
         return items_details
@@ -0,0 +1,527 @@
+import itertools
+import json
+import os
+import sqlite3
+import sys
+from array import array
+from datetime import date
+
+from flatfindr.table import Table
+
+DEFAULT_COLUMNS = [
+    "url",
+    "state",
+    "published",
+    "price",
+    "bedrooms",
+    "surface",
+    "address",
+    "furnished",
+    "images",
+    "description",
+    "lat",
+    "lng",
+    "seen",
+]
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+INDEXED_COLUMNS = ("url", "published", "state")
+JSON_COLUMNS = ("images",)  # Columns holding lists, stored as JSON text inside SQLite
+JOURNAL_EXTENSION = ".journal"
+TOMBSTONES_EXTENSION = ".tombstones"
+COMPACT_EVERY = 500  # Number of journaled items after which the JSON journal is compacted into the snapshot
+
+"""
+Storage backends for the flatfindr database.
+A storage loads and saves the database as a dictionnary with two keys: `columns` (the names of the features) and `data` (one list of values per item).
+Once loaded, `data` is a `flatfindr.table.Table`: a compact columnar representation which still behaves like a list of rows, and whose descriptions are loaded from disk by the storage when needed.
+The oldest items can be removed from the head of `data` (see `flatfindr.retention`): the storage is told with `drop()` and removes them from the disk at the next save,
+by url and seen date for the SQLite storage, which can be shared by several writers.
+It also keeps the tombstones of the removed items.
+The backend is selected from the extension of `db_path`, see `get_storage()`.
+"""
+
+
+def get_storage(db_path):
+    """Get the storage backend matching the database path.
+
+    Args:
+        db_path (str): The path to the database. Use a `.db`, `.sqlite` or `.sqlite3` extension for a SQLite database, anything else for a JSON one.
+
+    Returns:
+        Storage: The storage backend for this path.
+    """
+    if os.path.splitext(db_path)[1].lower() in SQLITE_EXTENSIONS:
+        return SQLiteStorage(db_path)
+    return JSONStorage(db_path)
+
+
+class Storage:
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path (str): The path to the database.
+        """
+        self.db_path = db_path
+        self.saved_rows = 0  # Number of items already written by the storage
+        # Number of saved items removed from `data` since the last save
+        self.dropped_rows = 0
+        # Their (url, seen date), so that a storage shared by several writers removes these very items
+        self.dropped_items = []
+
+    def load(self):
+        """Load the database.
+
+        Returns:
+            dict: The database, with a `columns` and a `data` keys. None if the database doesn't exist yet.
+        """
+        raise NotImplementedError
+
+    def new_table(self, columns=DEFAULT_COLUMNS):
+        """Get an empty table for the `data` of a database stored by this storage.
+
+        Args:
+            columns (list): The names of the columns. Defaults to DEFAULT_COLUMNS.
+
+        Returns:
+            flatfindr.table.Table: The table.
+        """
+        return Table(columns, loader=self.load_description)
+
+    def load_description(self, location):
+        """Load the description of an item from the disk.
+
+        Args:
+            location (int): Where the item is stored, as given to `Table.append()` when loading.
+
+        Returns:
+            str: The description.
+        """
+        raise NotImplementedError
+
+    def drop(self, items):
+        """Record that the first items of `data` have been removed (see `flatfindr.table.Table.drop()`).
+        The saved ones are removed from the disk at the next save.
+
+        Args:
+            items (list): The (url, seen date) of the removed items, from the first one.
+        """
+        items = list(items)[: self.saved_rows]
+        self.saved_rows -= len(items)
+        self.dropped_rows += len(items)
+        self.dropped_items.extend(items)
+
+    def load_tombstones(self):
+        """Load the tombstones of the removed items.
+
+        Returns:
+            list: The tombstones, as [url hash, description fingerprint, expiry date] lists. Empty if there are none.
+        """
+        raise NotImplementedError
+
+    def save_tombstones(self, tombstones, today=None):
+        """Save the tombstones of the removed items.
+
+        Args:
+            tombstones (list): The tombstones, as [url hash, description fingerprint, expiry date] lists.
+            today (datetime.date): The current date, before which the saved tombstones are expired. Defaults to None, meaning `date.today()`.
+        """
+        raise NotImplementedError
+
+    def save(self, db):
+        """Save the database.
+
+        Args:
+            db (dict): The database, with a `columns` and a `data` keys.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the resources held by the storage, if any."""
+
+
+class JSONStorage(Storage):
+    """Store the database as a JSON snapshot (`db_path`) plus an append-only journal (`db_path` + `.journal`), with one JSON line per item.
+    Saving only appends the new items to the journal, so that its cost doesn't grow with the database and an interrupted save can't truncate the snapshot.
+    The removal of the first items is journaled as a `{"drop": cnt}` line.
+    Every `compact_every` journaled items, the journal is folded into a new snapshot, written to a temporary file then atomically renamed.
+    The tombstones are stored aside, inside `db_path` + `.tombstones`.
+    """
+
+    def __init__(self, db_path, compact_every=COMPACT_EVERY):
+        """
+        Args:
+            db_path (str): The path to the JSON snapshot.
+            compact_every (int): The number of journaled items after which the journal is compacted into the snapshot. Defaults to COMPACT_EVERY.
+        """
+        super().__init__(db_path)
+        self.journal_path = db_path + JOURNAL_EXTENSION
+        self.tombstones_path = db_path + TOMBSTONES_EXTENSION
+        self.compact_every = compact_every
+        self.columns = None
+        self.rewrite = False  # True if the snapshot must be rewritten one item per line
+        self.journaled_rows = 0
+        self.journal_offset = 0
+
+    def load(self):
+        if os.path.isfile(self.db_path):
+            table = self.load_snapshot()
+        elif os.path.isfile(self.journal_path):
+            table = self.new_table()
+        else:
+            return None
+        self.journaled_rows = 0
+        self.journal_offset = 0
+        if os.path.isfile(self.journal_path):
+            with open(self.journal_path, "rb") as journal_file:
+                for line in journal_file:
+                    try:
+                        data = json.loads(line)
+                    except ValueError:
+                        # A save has been interrupted while writing this line: ignore it and what follows
+                        break
+                    if not line.endswith(b"\n"):
+                        break
+                    if isinstance(data, dict):
+                        table.drop(data["drop"])
+                        self.journaled_rows += data["drop"]
+                    else:
+                        # The locations inside the journal are negative, see `load_description()`
+                        table.append(data, location=-(self.journal_offset + 1))
+                        self.journaled_rows += 1
+                    self.journal_offset += len(line)
+        self.columns = list(table.columns)
+        self.saved_rows = len(table)
+        self.dropped_rows = 0
+        self.dropped_items = []
+        return {"columns": table.columns, "data": table}
+
+    def load_snapshot(self):
+        """Load the snapshot, with one item per line, so that the location of each item is its offset inside the file.
+        A snapshot written on a single line (by a previous version) is loaded as a whole, and rewritten one item per line at the next save.
+
+        Returns:
+            flatfindr.table.Table: The items of the snapshot.
+        """
+        with open(self.db_path, "rb") as db_file:
+            header = db_file.readline()
+            if not header.rstrip().endswith(b'"data": ['):
+                db = json.loads(header + db_file.read())
+                table = self.new_table(db["columns"])
+                table.extend(db["data"])
+                self.rewrite = True
+                return table
+            table = self.new_table(json.loads(header + b"]}")["columns"])
+            offset = len(header)
+            for line in db_file:
+                data = line.rstrip()
+                if data != b"]}":
+                    table.append(json.loads(data.rstrip(b",")), location=offset)
+                offset += len(line)
+        self.rewrite = False
+        return table
+
+    def load_description(self, location):
+        if location < 0:
+            path, offset = self.journal_path, -location - 1
+        else:
+            path, offset = self.db_path, location
+        with open(path, "rb") as db_file:
+            db_file.seek(offset)
+            data = json.loads(db_file.readline().rstrip().rstrip(b","))
+        return data[self.columns.index("description")]
+
+    def save(self, db):
+        if (
+            self.columns != db["columns"]
+            or self.rewrite
+            or not os.path.isfile(self.db_path)
+        ):
+            self.compact(db)
+            return
+        new_rows = db["data"][self.saved_rows :]
+        if not new_rows and not self.dropped_rows:
+            return
+        if (
+            os.path.isfile(self.journal_path)
+            and os.path.getsize(self.journal_path) > self.journal_offset
+        ):
+            # Drop the remains of an interrupted save before appending
+            os.truncate(self.journal_path, self.journal_offset)
+        lines = "".join(json.dumps(data) + "\n" for data in new_rows)
+        if self.dropped_rows:
+            lines = json.dumps({"drop": self.dropped_rows}) + "\n" + lines
+        lines = lines.encode("utf-8")
+        with open(self.journal_path, "ab") as journal_file:
+            journal_file.write(lines)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.journal_offset += len(lines)
+        self.journaled_rows += len(new_rows) + self.dropped_rows
+        self.saved_rows = len(db["data"])
+        self.dropped_rows = 0
+        self.dropped_items = []
+        if self.journaled_rows >= self.compact_every:
+            self.compact(db)
+
+    def compact(self, db):
+        """Write the whole database as a new snapshot, with one item per line (through a temporary file and an atomic rename), then empty the journal.
+
+        Args:
+            db (dict): The database, with a `columns` and a `data` keys.
+        """
+        tmp_path = self.db_path + ".tmp"
+        locations = array("q")
+        rows_cnt = len(db["data"])
+        with open(tmp_path, "wb") as db_file:
+            header = f'{{"columns": {json.dumps(db["columns"])}, "data": [\n'.encode()
+            db_file.write(header)
+            offset = len(header)
+            for i, data in enumerate(db["data"]):
+                line = json.dumps(data).encode() + (
+                    b",\n" if i < rows_cnt - 1 else b"\n"
+                )
+                db_file.write(line)
+                locations.append(offset)
+                offset += len(line)
+            db_file.write(b"]}\n")
+            db_file.flush()
+            os.fsync(db_file.fileno())
+        os.replace(tmp_path, self.db_path)
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+        self.columns = list(db["columns"])
+        self.rewrite = False
+        self.journaled_rows = 0
+        self.journal_offset = 0
+        self.saved_rows = len(db["data"])
+        self.dropped_rows = 0
+        self.dropped_items = []
+        if isinstance(db["data"], Table):
+            db["data"].relocate(locations)
+
+    def load_tombstones(self):
+        try:
+            with open(self.tombstones_path, "r") as tombstones_file:
+                return json.load(tombstones_file)
+        except (OSError, ValueError):
+            return []
+
+    def save_tombstones(self, tombstones, today=None):
+        tmp_path = self.tombstones_path + ".tmp"
+        with open(tmp_path, "w") as tombstones_file:
+            json.dump(tombstones, tombstones_file)
+        os.replace(tmp_path, self.tombstones_path)
+
+
+class SQLiteStorage(Storage):
+    """Store the database inside a SQLite table, with one row per item.
+    Only the items appended since the last load/save are written, so that saving costs O(new items) instead of O(database size).
+    """
+
+    TABLE = "listings"
+    TOMBSTONES_TABLE = "tombstones"
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.connection = None
+
+    def connect(self):
+        """Open the SQLite connection (in WAL mode) if it is not opened yet.
+
+        Returns:
+            sqlite3.Connection: The connection to the database.
+        """
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        return self.connection
+
+    def get_columns(self):
+        """Get the columns of the listings table, in order.
+
+        Returns:
+            list: The names of the columns, without the internal `id`. Empty if the table doesn't exist.
+        """
+        table_info = self.connect().execute(f"PRAGMA table_info({self.TABLE})")
+        return [column[1] for column in table_info if column[1] != "id"]
+
+    def create_table(self, columns):
+        """Create the listings table and its indexes, or add the missing columns to an existing one.
+
+        Args:
+            columns (list): The names of the columns.
+        """
+        connection = self.connect()
+        existing_columns = self.get_columns()
+        if not existing_columns:
+            columns_sql = ", ".join(f'"{column}"' for column in columns)
+            connection.execute(
+                f"CREATE TABLE {self.TABLE} (id INTEGER PRIMARY KEY AUTOINCREMENT, {columns_sql})"
+            )
+        else:
+            for column in columns:
+                if column not in existing_columns:
+                    connection.execute(
+                        f'ALTER TABLE {self.TABLE} ADD COLUMN "{column}"'
+                    )
+        for column in INDEXED_COLUMNS:
+            if column in columns:
+                connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS idx_{self.TABLE}_{column} ON {self.TABLE} ("{column}")'
+                )
+        connection.commit()
+
+    def load(self):
+        if not os.path.isfile(self.db_path):
+            return None
+        columns = self.get_columns()
+        if not columns:
+            return None
+        columns_sql = ", ".join(f'"{column}"' for column in columns)
+        json_idx = [i for i, column in enumerate(columns) if column in JSON_COLUMNS]
+        table = self.new_table(columns)
+        for row in self.connect().execute(
+            f"SELECT id, {columns_sql} FROM {self.TABLE} ORDER BY id"
+        ):
+            # The columns added after an item was saved are NULL for this item
+            data = ["" if value is None else value for value in row[1:]]
+            for i in json_idx:
+                data[i] = json.loads(data[i]) if data[i] else []
+            table.append(data, location=row[0])
+        self.saved_rows = len(table)
+        return {"columns": table.columns, "data": table}
+
+    def load_description(self, location):
+        row = (
+            self.connect()
+            .execute(f"SELECT description FROM {self.TABLE} WHERE id = ?", (location,))
+            .fetchone()
+        )
+        return row[0]
+
+    def load_tombstones(self):
+        if not os.path.isfile(self.db_path):
+            return []
+        try:
+            rows = self.connect().execute(
+                f"SELECT url_hash, fingerprint, expires FROM {self.TOMBSTONES_TABLE} ORDER BY rowid"
+            )
+        except sqlite3.OperationalError:  # The table doesn't exist yet
+            return []
+        return [list(row) for row in rows]
+
+    def save_tombstones(self, tombstones, today=None):
+        """Add the tombstones to the saved ones (or update them), and remove the expired ones.
+        The tombstones saved by the other writers of the database are kept.
+        """
+        today = (today or date.today()).isoformat()
+        with self.connect() as connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.TOMBSTONES_TABLE} (url_hash TEXT PRIMARY KEY, fingerprint TEXT, expires TEXT)"
+            )
+            connection.execute(
+                f"DELETE FROM {self.TOMBSTONES_TABLE} WHERE expires < ?", (today,)
+            )
+            connection.executemany(
+                f"INSERT INTO {self.TOMBSTONES_TABLE} VALUES (?, ?, ?) "
+                "ON CONFLICT(url_hash) DO UPDATE SET fingerprint = excluded.fingerprint, expires = excluded.expires",
+                tombstones,
+            )
+
+    def save(self, db):
+        columns = db["columns"]
+        if self.dropped_items:
+            # Removed by url and seen date rather than by position: the other writers of the database may have inserted or removed items since
+            with self.connect() as connection:
+                connection.executemany(
+                    f"DELETE FROM {self.TABLE} WHERE url = ? AND seen = ?",
+                    self.dropped_items,
+                )
+            self.dropped_rows = 0
+            self.dropped_items = []
+        saved_columns = self.get_columns()
+        if saved_columns != columns:
+            self.create_table(columns)
+            self.backfill(
+                db, [column for column in columns if column not in saved_columns]
+            )
+        new_rows = [
+            [
+                json.dumps(value) if column in JSON_COLUMNS else value
+                for column, value in zip(columns, data)
+            ]
+            for data in db["data"][self.saved_rows :]
+        ]
+        if new_rows:
+            columns_sql = ", ".join(f'"{column}"' for column in columns)
+            placeholders = ", ".join("?" for _ in columns)
+            with self.connect() as connection:
+                connection.executemany(
+                    f"INSERT INTO {self.TABLE} ({columns_sql}) VALUES ({placeholders})",
+                    new_rows,
+                )
+        self.saved_rows = len(db["data"])
+
+    def backfill(self, db, columns):
+        """Write the values of new columns for the items saved before these columns were added.
+
+        Args:
+            db (dict): The database, with a `columns` and a `data` keys.
+            columns (list): The names of the new columns.
+        """
+        if not columns or not self.saved_rows:
+            return
+        connection = self.connect()
+
+        def get_values(column):
+            if isinstance(db["data"], Table):
+                values = db["data"].column(column)
+            else:
+                values = (data[db["columns"].index(column)] for data in db["data"])
+            return itertools.islice(values, self.saved_rows)
+
+        # Matched by url rather than by position: the other writers of the database may have inserted or removed items since
+        urls = list(get_values("url"))
+        for column in columns:
+            values = get_values(column)
+            if column in JSON_COLUMNS:
+                values = map(json.dumps, values)
+            with connection:
+                connection.executemany(
+                    f'UPDATE {self.TABLE} SET "{column}" = ? WHERE url = ?',
+                    zip(values, urls),
+                )
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def migrate_json_to_sqlite(json_path, sqlite_path):
+    """Copy a JSON database (with the `{"columns", "data"}` layout) into a new SQLite database.
+
+    Args:
+        json_path (str): The path to the existing JSON database, e.g. `./saves/db.json`.
+        sqlite_path (str): The path to the SQLite database to create, e.g. `./saves/db.sqlite`.
+
+    Returns:
+        int: The number of items copied.
+    """
+    db = JSONStorage(json_path).load()
+    if db is None:
+        raise FileNotFoundError(f"No JSON database found at `{json_path}`")
+    storage = SQLiteStorage(sqlite_path)
+    if storage.load() is not None:
+        storage.close()
+        raise FileExistsError(f"A SQLite database already exists at `{sqlite_path}`")
+    storage.save(db)
+    storage.close()
+    return len(db["data"])
+
+
+if __name__ == "__main__":
+    # Usage: python -m flatfindr.storage ./saves/db.json ./saves/db.sqlite
+    cnt = migrate_json_to_sqlite(sys.argv[1], sys.argv[2])
+    print(f"{cnt} items migrated from `{sys.argv[1]}` to `{sys.argv[2]}`")
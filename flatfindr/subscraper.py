@@ -11,6 +11,7 @@ from selenium.webdriver.common.by import By
 
 MAX_SURFACE = 200  # The max surface after which it is considered that the surface is actually in square feet and not square metre.
 WEBSITE_NAME = "<WEBSITE_NAME"
+ITEM_LINK = "/marketplace/item/"
 KEYWORDS = {
     "day": "jours",
     "week": "semaine",
@@ -50,14 +51,20 @@ class Subscraper(Scraper):
         try:
             email_input = self.driver.find_element(By.ID, "email")
             email_input.send_keys(self.email)
-            sleep(random.uniform(0.2, 0.5))
+            self.politeness.pause("typing")
             password_input = self.driver.find_element(By.ID, "pass")
             password_input.send_keys(self.password)
-            sleep(random.uniform(0.2, 0.5))
+            self.politeness.pause("typing")
             login_button = self.driver.find_element(By.XPATH, "//*[@type='submit']")
             login_button.click()
-            sleep(random.uniform(2, 3))
-            # self.save_cookies()
+            # Wait for the log in form to be gone
+            self.wait_for(
+                lambda driver: driver.execute_script(
+                    "return document.getElementById('email') === null;"
+                )
+            )
+            if self.is_logged_in():
+                self.save_cookies()
         except Exception:
             print(
                 "Some exception occurred while trying to find username or password field"
@@ -95,30 +102,19 @@ class Subscraper(Scraper):
         if self.slow:
             sleep(random.uniform(5, 7))
 
-        seen_links = [data[0] for data in self.db["data"]]
-
         for _ in range(scroll):
             try:
+                self.politeness.pause("scroll")
                 self.driver.execute_script(
                     "window.scrollTo(0, document.body.scrollHeight);"
                 )
-                sleep(random.uniform(1.5, 2))
             except:
                 pass
 
         if self.slow:
             sleep(random.uniform(2, 3))
-        all_href = self.driver.find_elements(By.XPATH, "//a[@href]")
-        for item in all_href:
-            try:
-                item_url = item.get_attribute("href")
-                if "/marketplace/item/" in item_url:
-                    item_url = item_url[: item_url.find("?")]
-                    # If this item has never been scraped before, we add it
-                    if item_url not in seen_links and item_url not in self.items_links:
-                        self.items_links.append(item_url)
-            except:
-                pass
+        # Add the links of the items that have never been scraped before
+        self.add_items_links(self.harvest_links(ITEM_LINK))
 
         return self.items_links
 
@@ -255,23 +251,22 @@ class Subscraper(Scraper):
                     By.XPATH, f"//div[@aria-label='{KEYWORDS['next_img']}']"
                 )
                 next_button.click()
-                sleep(random.uniform(1, 1.2))
+                self.politeness.pause("gallery")
             except:  # only 1 picture for this ad so there is no next button
                 break
         return images
 
-    def get_item_details(self, item_url, remove_swap=True, remove_first_floor=True):
+    def scrape_item_details(self, item_url):
         """Go to the item url with the webdriver and scrap as much details as possible about the item.
+        Whether the item is interesting is decided afterwards, see `Scraper.classify_item()`.
 
         Args:
             item_url (str): The url (or link) of the item.
-            remove_swap (bool): Set to False if you want to see ads about swaping apartments. Defaults to True.
-            remove_first_floor (bool): Set to False if you want to see ads with flats on ground floor. Defaults to True.
 
         Returns:
             dict: A dictionnary with all the item details.
         """
-        item_details = super().get_item_details(item_url)
+        item_details = super().scrape_item_details(item_url)
         if self.slow:
             sleep(random.uniform(5, 5.5))
 
@@ -283,19 +278,4 @@ class Subscraper(Scraper):
         item_details["furnished"] = self.get_item_furnished()
         item_details["description"] = self.get_item_description()
 
-        if any(
-            (
-                self.is_old(item_details),
-                self.is_duplicate(item_details),
-                self.is_swap(item_details) and remove_swap,
-                self.is_first_floor(item_details) and remove_first_floor,
-            )
-        ):
-            # We are not interested by this ads
-            item_details["state"] = "NI"
-            item_details["description"] = ""
-            item_details["images"] = []
-        else:
-            item_details["state"] = "new"
-            item_details["images"] = []  # self.get_item_images()
         return item_details
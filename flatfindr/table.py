@@ -0,0 +1,492 @@
+import hashlib
+import math
+import sys
+from array import array
+from datetime import date
+
+MISSING_INT = -(2**63)  # Stands for an empty value ("") inside the integer columns
+NO_LOCATION = MISSING_INT  # Location of a description that is only held in memory
+EMPTY_FINGERPRINT = bytes(20)
+
+"""
+Compact, column-oriented, in-memory representation of the `data` of the database.
+Instead of one list of boxed values per item, each column is stored on its own: typed arrays for the numbers and dates, interned codes for the enumerations (e.g. `state`),
+and only a fingerprint for the descriptions, whose text is loaded from disk when needed (see `TextColumn`).
+A Table still behaves like the list of rows it replaces: `append()`, `len()`, iteration, indexing and slicing all work with rows (lists of values, in the `columns` order).
+A value that doesn't fit the type of its column (e.g. a price that is not an integer) turns the column into a plain list, so nothing is ever lost.
+"""
+
+
+def description_fingerprint(description):
+    """Get a fingerprint of an item description, insensitive to case and whitespace changes.
+
+    Args:
+        description (str): The item description.
+
+    Returns:
+        str: A hexadecimal digest of the normalized description, or an empty string if there is no description.
+    """
+    if not description:
+        return ""
+    normalized = " ".join(description.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class Column:
+    """A column of boxed values, for the columns without a more compact type (e.g. `url`), or whose values don't fit their type."""
+
+    def __init__(self):
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        """Append a value to the column.
+
+        Args:
+            value: The value.
+
+        Returns:
+            bool: True if the value has been appended, False if it doesn't fit the type of the column.
+        """
+        self.values.append(value)
+        return True
+
+    def get(self, i):
+        return self.values[i]
+
+    def drop(self, cnt):
+        """Remove the first `cnt` values of the column."""
+        del self.values[:cnt]
+
+
+class StrColumn(Column):
+    """A column of strings that repeat, e.g. addresses: the strings are interned so that each one is only held once."""
+
+    def append(self, value):
+        self.values.append(sys.intern(value) if isinstance(value, str) else value)
+        return True
+
+
+class IntColumn(Column):
+    """A column of integers, e.g. prices, stored inside an array of 64 bits integers."""
+
+    def __init__(self):
+        self.values = array("q")
+
+    def append(self, value):
+        if value == "":
+            self.values.append(MISSING_INT)
+        elif type(value) is int and MISSING_INT < value < 2**63:
+            self.values.append(value)
+        else:
+            return False
+        return True
+
+    def get(self, i):
+        value = self.values[i]
+        return "" if value == MISSING_INT else value
+
+
+class FloatColumn(Column):
+    """A column of floats, e.g. latitudes, stored inside an array of doubles."""
+
+    def __init__(self):
+        self.values = array("d")
+
+    def append(self, value):
+        if value == "":
+            self.values.append(math.nan)
+        elif type(value) is float and not math.isnan(value):
+            self.values.append(value)
+        else:
+            return False
+        return True
+
+    def get(self, i):
+        value = self.values[i]
+        return "" if math.isnan(value) else value
+
+
+class DateColumn(Column):
+    """A column of dates in isoformat, e.g. '2022-02-11', stored as ordinal days inside an array of integers."""
+
+    def __init__(self):
+        self.values = array("l")
+
+    def append(self, value):
+        if value == "":
+            self.values.append(0)
+            return True
+        try:
+            day = date.fromisoformat(value)
+        except (TypeError, ValueError):
+            return False
+        if day.isoformat() != value:
+            return False
+        self.values.append(day.toordinal())
+        return True
+
+    def get(self, i):
+        value = self.values[i]
+        return "" if value == 0 else date.fromordinal(value).isoformat()
+
+
+class EnumColumn(Column):
+    """A column with a few distinct values, e.g. `state`: each distinct value is held once, and each item only holds its code."""
+
+    def __init__(self):
+        self.codes = array("H")
+        self.values = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, value):
+        if not (value is None or isinstance(value, str)):
+            return False
+        code = self.index.get(value)
+        if code is None:
+            if len(self.values) >= 2**16:
+                return False
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+        return True
+
+    def get(self, i):
+        return self.values[self.codes[i]]
+
+    def drop(self, cnt):
+        del self.codes[:cnt]
+
+
+class ListColumn(Column):
+    """A column of lists, e.g. `images`, where most items have an empty list: empty lists are not held."""
+
+    def append(self, value):
+        if not isinstance(value, list):
+            return False
+        self.values.append(value or None)
+        return True
+
+    def get(self, i):
+        value = self.values[i]
+        return [] if value is None else value
+
+
+class TextColumn(Column):
+    """A column of long texts, i.e. the descriptions. Only the fingerprint of each text (see `description_fingerprint()`) and its location on disk are held:
+    the text itself is loaded from disk when needed, by the `loader` of the storage. The texts without a location yet (i.e. of the items appended since the load) are held in memory.
+    """
+
+    def __init__(self, loader=None):
+        """
+        Args:
+            loader (callable): A function returning the text stored at a given location, e.g. `JSONStorage.load_description`. Defaults to None.
+        """
+        self.loader = loader
+        self.fingerprints = bytearray()
+        self.locations = array("q")
+        self.texts = {}  # {row index: text} for the texts without a location
+
+    def __len__(self):
+        return len(self.locations)
+
+    def append(self, value, location=NO_LOCATION):
+        """Append a text to the column.
+
+        Args:
+            value (str): The text.
+            location (int): Where the text is stored on disk, in the format of the `loader`. Defaults to NO_LOCATION, meaning the text is held in memory.
+
+        Returns:
+            bool: True if the text has been appended, False if it is not a string.
+        """
+        if not isinstance(value, str):
+            return False
+        fingerprint = description_fingerprint(value)
+        if not fingerprint:
+            self.fingerprints += EMPTY_FINGERPRINT
+            self.locations.append(NO_LOCATION)
+            return True
+        if location == NO_LOCATION or self.loader is None:
+            self.texts[len(self.locations)] = value
+            location = NO_LOCATION
+        self.fingerprints += bytes.fromhex(fingerprint)
+        self.locations.append(location)
+        return True
+
+    def fingerprint(self, i):
+        """Get the fingerprint of a text, without loading it.
+
+        Args:
+            i (int): The row index.
+
+        Returns:
+            str: The fingerprint, see `description_fingerprint()`. Empty if there is no text.
+        """
+        fingerprint = bytes(self.fingerprints[i * 20 : (i + 1) * 20])
+        return "" if fingerprint == EMPTY_FINGERPRINT else fingerprint.hex()
+
+    def get(self, i):
+        if i < 0:
+            i += len(self)
+        if i in self.texts:
+            return self.texts[i]
+        fingerprint = self.fingerprint(i)
+        if not fingerprint:
+            return ""
+        try:
+            text = self.loader(self.locations[i])
+        except Exception as e:
+            print(f"Error while loading a description from the database: {e}")
+            return ""
+        if description_fingerprint(text) != fingerprint:
+            print("Error while loading a description: the database has changed on disk")
+            return ""
+        return text
+
+    def drop(self, cnt):
+        del self.fingerprints[: cnt * 20]
+        del self.locations[:cnt]
+        self.texts = {i - cnt: text for i, text in self.texts.items() if i >= cnt}
+
+    def relocate(self, locations):
+        """Set the locations of all the texts, e.g. once the database has been written again, and drop the texts held in memory.
+
+        Args:
+            locations (array): The new location of each row.
+        """
+        if self.loader is None:
+            return
+        self.texts = {}
+        self.locations = array("q", locations)
+
+
+COLUMN_TYPES = {
+    "state": EnumColumn,
+    "published": DateColumn,
+    "price": IntColumn,
+    "bedrooms": IntColumn,
+    "surface": IntColumn,
+    "address": StrColumn,
+    "furnished": EnumColumn,
+    "images": ListColumn,
+    "description": TextColumn,
+    "lat": FloatColumn,
+    "lng": FloatColumn,
+    "seen": DateColumn,
+}
+
+
+class Table:
+    def __init__(self, columns, loader=None):
+        """
+        Args:
+            columns (list): The names of the columns, e.g. DEFAULT_COLUMNS.
+            loader (callable): A function returning the description stored at a given location, see `TextColumn`. Defaults to None, meaning the descriptions are held in memory.
+        """
+        self.columns = list(columns)
+        self.loader = loader
+        self.data = [self.new_column(column) for column in self.columns]
+        self.size = 0
+
+    def new_column(self, name):
+        """Get a new empty column, of the type matching its name (see COLUMN_TYPES)."""
+        column_type = COLUMN_TYPES.get(name, Column)
+        if column_type is TextColumn:
+            return TextColumn(self.loader)
+        return column_type()
+
+    def __len__(self):
+        return self.size
+
+    def append(self, row, location=NO_LOCATION):
+        """Append a row.
+
+        Args:
+            row (list): The values of the row, in the `columns` order. Missing values at the end of the row (e.g. from before a column was added) are empty.
+            location (int): Where the row is stored on disk, in the format of the `loader`. Defaults to NO_LOCATION, meaning the row is only held in memory.
+        """
+        for j, column in enumerate(self.data):
+            value = row[j] if j < len(row) else ""
+            if isinstance(column, TextColumn):
+                appended = column.append(value, location)
+            else:
+                appended = column.append(value)
+            if not appended:
+                # The value doesn't fit the type of the column: fall back on boxed values
+                boxed = Column()
+                boxed.values = [column.get(i) for i in range(self.size)]
+                boxed.append(value)
+                self.data[j] = boxed
+        self.size += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def add_column(self, name, value=""):
+        """Add a column, with the same value for each existing row.
+
+        Args:
+            name (str): The name of the column.
+            value: The value of the existing rows. Defaults to '' (empty).
+        """
+        column = self.new_column(name)
+        if self.size and not column.append(value):
+            column = Column()
+            column.append(value)
+        for _ in range(self.size - 1):
+            column.append(value)
+        self.columns.append(name)
+        self.data.append(column)
+
+    def get(self, i, name):
+        """Get a single value, without building the whole row.
+
+        Args:
+            i (int): The row index.
+            name (str): The name of the column.
+        """
+        return self.data[self.columns.index(name)].get(i)
+
+    def column(self, name):
+        """Iterate over the values of a column.
+
+        Args:
+            name (str): The name of the column.
+        """
+        column = self.data[self.columns.index(name)]
+        for i in range(self.size):
+            yield column.get(i)
+
+    def fingerprint(self, i, name="description"):
+        """Get the fingerprint of a text, without loading it, see `TextColumn.fingerprint()`.
+
+        Args:
+            i (int): The row index.
+            name (str): The name of the column. Defaults to 'description'.
+        """
+        column = self.data[self.columns.index(name)]
+        if isinstance(column, TextColumn):
+            return column.fingerprint(i)
+        return description_fingerprint(column.get(i))
+
+    def fingerprints(self, name="description"):
+        """Iterate over the fingerprints of the texts of a column, without loading the texts.
+
+        Args:
+            name (str): The name of the column. Defaults to 'description'.
+        """
+        for i in range(self.size):
+            yield self.fingerprint(i, name)
+
+    def drop(self, cnt):
+        """Remove the first `cnt` rows, e.g. the oldest ones, see `flatfindr.retention.Retention`.
+
+        Args:
+            cnt (int): The number of rows to remove.
+        """
+        cnt = min(cnt, self.size)
+        for column in self.data:
+            column.drop(cnt)
+        self.size -= cnt
+
+    def relocate(self, locations):
+        """Set the location on disk of every row, e.g. once the database has been written again, see `TextColumn.relocate()`.
+
+        Args:
+            locations (array): The new location of each row.
+        """
+        for column in self.data:
+            if isinstance(column, TextColumn):
+                column.relocate(locations)
+
+    def row(self, i):
+        return [column.get(i) for column in self.data]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.row(i) for i in range(*key.indices(self.size))]
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("Table index out of range")
+        return self.row(key)
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.row(i)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"Table(columns={self.columns}, rows={self.size})"
+
+
+if __name__ == "__main__":
+    # Measure the memory held by a large database, loaded as lists of rows then as a Table
+    import json
+    import random
+    import resource
+    import subprocess
+    import tempfile
+
+    from flatfindr.storage import DEFAULT_COLUMNS, JSONStorage
+
+    def generate(path, rows_cnt):
+        storage = JSONStorage(path)
+        data = []
+        for i in range(rows_cnt):
+            row = dict.fromkeys(DEFAULT_COLUMNS, "")
+            row["url"] = f"https://www.facebook.com/marketplace/item/{10**14 + i}/"
+            row["state"] = "NI"
+            row["images"] = []
+            if i % 10 == 0:  # Most of the items are filtered out, with no description
+                row["state"] = "new"
+                row["published"] = date.fromordinal(738000 + i % 300).isoformat()
+                row["price"] = random.randint(700, 2500)
+                row["bedrooms"] = random.randint(1, 4)
+                row["address"] = random.choice(["Montréal, QC", "Laval, QC"])
+                row["furnished"] = random.choice(["meublé", "non meublé"])
+                row["description"] = " ".join(
+                    random.choice(["Beau", "4 1/2", "lumineux", "près du métro"])
+                    for _ in range(150)
+                )
+                row["images"] = [
+                    f"https://scontent.xx.fbcdn.net/{i}-{j}.jpg" for j in range(5)
+                ]
+                row["lat"], row["lng"] = (
+                    45.5 + random.random() / 10,
+                    -73.6 + random.random() / 10,
+                )
+            data.append([row[column] for column in DEFAULT_COLUMNS])
+        storage.compact({"columns": list(DEFAULT_COLUMNS), "data": data})
+
+    def measure(path, as_table):
+        if as_table:
+            db = JSONStorage(path).load()
+        else:
+            with open(path, "r") as f:
+                db = json.load(f)
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * resource.getpagesize()
+        print(rss // 2**20)
+
+    rows_cnt = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    if len(sys.argv) > 3:
+        measure(sys.argv[2], sys.argv[3] == "table")
+        sys.exit()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = f"{tmp_dir}/db.json"
+        generate(path, rows_cnt)
+        for name in ("lists", "table"):
+            rss = subprocess.check_output(
+                [sys.executable, "-m", "flatfindr.table", str(rows_cnt), path, name]
+            )
+            print(f"{rows_cnt} items loaded as {name}: {int(rss)} MB of RSS")
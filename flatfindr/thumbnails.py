@@ -0,0 +1,270 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import urllib.request
+from functools import partial
+
+from PIL import Image
+
+from flatfindr.executor import ScrapeExecutor
+
+DEFAULT_THUMBNAILS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    os.path.join("saves", "thumbnails"),
+)
+INDEX_FILENAME = "index.json"
+THUMBNAIL_SIZE = (320, 320)  # Maximum width and height of a thumbnail
+THUMBNAIL_QUALITY = 80  # JPEG quality of the thumbnails
+MAX_IMAGES = 3  # Number of images of an item turned into thumbnails
+MAX_DOWNLOADS = 4  # Maximum number of images downloaded at the same time
+MAX_QUEUED = 200  # Maximum number of images waiting to be downloaded
+DOWNLOAD_TIMEOUT = 10  # Maximum number of seconds to wait for an image server
+MAX_IMAGE_BYTES = 10 * 1024 * 1024  # Bigger images are not downloaded
+USER_AGENT = "flatfindr"
+SAVE_EVERY = 20  # Number of new thumbnails after which the index is persisted
+
+"""
+Thumbnails of the items images, so that the alerts can show a few photos of each new ad.
+The images are downloaded outside of `Scraper.update_db()`, by a fixed number of worker threads pulling from a bounded queue (see `flatfindr.executor.ScrapeExecutor`),
+then resized and stored inside a content-addressed cache (./saves/thumbnails/<2 first characters>/<sha256 of the image>.jpg):
+the same image reposted under another url is only stored once, and a thumbnail never needs to be invalidated.
+An index maps the urls (without their query string, which holds expiring signatures) to the digests of their images.
+"""
+
+
+def get_image_key(url):
+    """Get the key of an image url inside the index: the url without its query string.
+
+    Args:
+        url (str): The url of the image.
+
+    Returns:
+        str: The key.
+    """
+    return url.split("?")[0]
+
+
+def download(url, timeout=DOWNLOAD_TIMEOUT, max_bytes=MAX_IMAGE_BYTES):
+    """Download an image.
+
+    Args:
+        url (str): The url of the image.
+        timeout (float): The maximum number of seconds to wait for the server. Defaults to DOWNLOAD_TIMEOUT.
+        max_bytes (int): The maximum size of the image. Defaults to MAX_IMAGE_BYTES.
+
+    Returns:
+        bytes: The content of the image.
+    """
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        data = response.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"The image is bigger than {max_bytes} bytes")
+    return data
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE, quality=THUMBNAIL_QUALITY):
+    """Resize an image to fit inside a box, keeping its aspect ratio.
+
+    Args:
+        data (bytes): The content of the image, in any format known by Pillow.
+        size (tuple): The maximum width and height of the thumbnail. Defaults to THUMBNAIL_SIZE.
+        quality (int): The JPEG quality of the thumbnail. Defaults to THUMBNAIL_QUALITY.
+
+    Returns:
+        bytes: The thumbnail, as JPEG.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail(size)
+        output = io.BytesIO()
+        image.convert("RGB").save(output, "JPEG", quality=quality)
+    return output.getvalue()
+
+
+class ThumbnailCache:
+    def __init__(
+        self,
+        path=DEFAULT_THUMBNAILS_PATH,
+        size=THUMBNAIL_SIZE,
+        max_workers=MAX_DOWNLOADS,
+        max_queued=MAX_QUEUED,
+        timeout=DOWNLOAD_TIMEOUT,
+        save_every=SAVE_EVERY,
+    ):
+        """
+        Args:
+            path (str): The directory of the thumbnails and of their index. Defaults to ./saves/thumbnails from the package root.
+            size (tuple): The maximum width and height of the thumbnails. Defaults to THUMBNAIL_SIZE.
+            max_workers (int): The maximum number of images downloaded at the same time. Defaults to MAX_DOWNLOADS.
+            max_queued (int): The maximum number of images waiting to be downloaded, the next ones are skipped. Defaults to MAX_QUEUED.
+            timeout (float): The maximum number of seconds to wait for an image server. Defaults to DOWNLOAD_TIMEOUT.
+            save_every (int): The number of new thumbnails after which the index is persisted. The others are persisted by `flush()`. Defaults to SAVE_EVERY.
+        """
+        self.path = path
+        self.size = size
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.save_every = save_every
+        self.index = {}  # {image key: sha256 of the image}
+        self.tasks = (
+            {}
+        )  # {image key: flatfindr.executor.Task} of the queued and running downloads
+        self.executor = None  # Started with the first download
+        self.unsaved = 0  # Number of thumbnails indexed since the last save
+        self.lock = threading.Lock()
+        # Held while writing the index, so that the downloads don't wait for the disk
+        self.save_lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest + ".jpg")
+
+    def get(self, url):
+        """Get the thumbnail of an image, if it has been downloaded.
+
+        Args:
+            url (str): The url of the image.
+
+        Returns:
+            str: The path of the thumbnail, or None if it is not cached.
+        """
+        digest = self.index.get(get_image_key(url))
+        if digest is None or not os.path.isfile(self.get_path(digest)):
+            return None
+        return self.get_path(digest)
+
+    def submit(self, urls):
+        """Queue the download of the images that are not cached yet, without waiting for it.
+        An image already being downloaded is not queued again. If the queue is full, the images are skipped.
+
+        Args:
+            urls (list): The urls of the images.
+
+        Returns:
+            int: The number of queued images.
+        """
+        cnt = 0
+        with self.lock:
+            if self.executor is None:
+                self.executor = ScrapeExecutor(
+                    max_workers=self.max_workers, max_queued=self.max_queued
+                )
+            for url in urls:
+                key = get_image_key(url)
+                if key in self.tasks or self.get(url) is not None:
+                    continue
+                task = self.executor.submit(partial(self.fetch, url), [key])
+                if task is not None:
+                    self.tasks[key] = task
+                    cnt += 1
+        return cnt
+
+    def fetch(self, url, task=None):
+        """Download an image and store its thumbnail. Run by a worker of the executor.
+
+        Args:
+            url (str): The url of the image.
+            task (flatfindr.executor.Task): The task of the download. Defaults to None.
+
+        Returns:
+            str: The path of the thumbnail, or None if the image could not be downloaded.
+        """
+        key = get_image_key(url)
+        try:
+            if task is not None and task.cancelled.is_set():
+                return None
+            data = download(url, timeout=self.timeout)
+            digest = hashlib.sha256(data).hexdigest()
+            thumbnail_path = self.get_path(digest)
+            # The same image may have been stored under another url
+            if not os.path.isfile(thumbnail_path):
+                thumbnail = make_thumbnail(data, size=self.size)
+                os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+                tmp_path = f"{thumbnail_path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as thumbnail_file:
+                    thumbnail_file.write(thumbnail)
+                os.replace(tmp_path, thumbnail_path)
+            with self.lock:
+                self.index[key] = digest
+                self.unsaved += 1
+                full = self.unsaved >= self.save_every
+            if full:
+                self.flush()
+            return thumbnail_path
+        except Exception as e:
+            print(f"Error while making the thumbnail of `{url}`: {e}")
+            return None
+        finally:
+            with self.lock:
+                self.tasks.pop(key, None)
+
+    def wait(self, urls, timeout=None):
+        """Wait for the images being downloaded, then get their thumbnails.
+
+        Args:
+            urls (list): The urls of the images.
+            timeout (float): The maximum number of seconds to wait for all the images. Defaults to None, meaning no limit.
+
+        Returns:
+            list: The paths of the thumbnails found, in the same order as `urls`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        paths = []
+        for url in urls:
+            with self.lock:
+                task = self.tasks.get(get_image_key(url))
+            if task is not None:
+                task.done.wait(
+                    None if deadline is None else max(deadline - time.monotonic(), 0)
+                )
+            path = self.get(url)
+            if path is not None and path not in paths:
+                paths.append(path)
+        return paths
+
+    def load(self):
+        """Load the index of the thumbnails, if any."""
+        try:
+            with open(os.path.join(self.path, INDEX_FILENAME), "r") as index_file:
+                self.index = json.load(index_file)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def flush(self):
+        """Save the index of the thumbnails if some have been added since the last save, through a temporary file and an atomic rename."""
+        index_path = os.path.join(self.path, INDEX_FILENAME)
+        with self.save_lock:
+            with self.lock:
+                if not self.unsaved:
+                    return
+                index = dict(self.index)
+                unsaved, self.unsaved = self.unsaved, 0
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                with open(index_path + ".tmp", "w") as index_file:
+                    json.dump(index, index_file)
+                os.replace(index_path + ".tmp", index_path)
+            except OSError as e:
+                print(f"Error while saving the thumbnails index to `{index_path}`: {e}")
+                with self.lock:
+                    self.unsaved += unsaved
+
+    def close(self, wait=True):
+        """Stop the downloads, then save the index of the thumbnails.
+
+        Args:
+            wait (bool): Set to False to return without waiting for the running downloads. Defaults to True.
+        """
+        with self.lock:
+            executor, self.executor = self.executor, None
+            self.tasks.clear()
+        if executor is not None:
+            executor.close(wait=wait)
+        self.flush()
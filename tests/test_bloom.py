@@ -0,0 +1,79 @@
+# pylint: disable-all
+
+import os
+import tempfile
+import unittest
+
+from flatfindr.bloom import BloomFilter, get_parameters, open_seen_filter
+from flatfindr.retention import get_url_hash
+
+""" Test the memory-mapped Bloom filter of the seen urls """
+
+
+def make_url(i):
+    return f"https://www.facebook.com/marketplace/item/{10**14 + i}/"
+
+
+class TestBloom(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "db.json.bloom")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parameters(self):
+        bits, hashes = get_parameters(1000, 0.01)
+        self.assertEqual((bits, hashes), (9592, 7))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter.create(self.path, capacity=2000, error_rate=0.01)
+        added = sum(bloom.add(make_url(i)) for i in range(2000))
+        self.assertFalse(bloom.add(make_url(0)))
+        self.assertGreater(added, 1950)  # A few are false positives already
+        self.assertEqual(len(bloom), added)
+        self.assertTrue(all(make_url(i) in bloom for i in range(2000)))
+        false_positives = sum(make_url(i) in bloom for i in range(2000, 22000))
+        self.assertLess(false_positives / 20000, 0.02)
+        self.assertFalse(bloom.is_full())
+        for i in range(2000, 2100):
+            bloom.add(make_url(i))
+        self.assertTrue(bloom.is_full())
+        bloom.close()
+
+    def test_shared_readonly(self):
+        bloom = BloomFilter.create(self.path, [get_url_hash(make_url(0))])
+        reader = BloomFilter(self.path, readonly=True)
+        self.assertIn(make_url(0), reader)
+        bloom.add(make_url(1))
+        self.assertIn(make_url(1), reader)  # Same pages, no reload
+        with self.assertRaises(TypeError):
+            reader.add(make_url(2))
+        reader.close()
+        bloom.close()
+
+    def test_open_seen_filter(self):
+        hashes = [get_url_hash(make_url(i)) for i in range(10)]
+        rebuilds = []
+
+        def url_hashes():
+            rebuilds.append(True)
+            return hashes
+
+        bloom = open_seen_filter(self.path, url_hashes, 10)
+        bloom.close()
+        bloom = open_seen_filter(self.path, url_hashes, 10, [make_url(9)])
+        self.assertEqual(len(rebuilds), 1)
+        bloom.close()
+        # The database has been updated without the filter
+        hashes.append(get_url_hash(make_url(10)))
+        bloom = open_seen_filter(self.path, url_hashes, 11, [make_url(10)])
+        self.assertEqual(len(rebuilds), 2)
+        self.assertIn(make_url(10), bloom)
+        bloom.close()
+        with open(self.path, "wb") as f:
+            f.write(b"not a filter")
+        bloom = open_seen_filter(self.path, url_hashes, 11)
+        self.assertEqual(len(rebuilds), 3)
+        self.assertEqual(len(bloom), 11)
+        bloom.close()
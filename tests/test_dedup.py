@@ -0,0 +1,109 @@
+# pylint: disable-all
+
+import os
+import tempfile
+import unittest
+
+from flatfindr.dedup import NearDuplicateIndex, get_shingles
+
+""" Test the near-duplicate detection of descriptions """
+
+DESCRIPTION = (
+    "Superbe 4 1/2 mise à neuf, moderne et au goût du jour dans le magnifique quartier "
+    "de Centre-Sud-Ville-Marie. Cuisine équipée, laveuse et sécheuse incluses, "
+    "grand balcon arrière, proche du métro Papineau. Disponible le 1er juillet, 1600$ par mois."
+)
+REPOST = DESCRIPTION.replace("1600$", "1550$").replace("Superbe", "Magnifique")
+OTHER = (
+    "Grand 5 1/2 lumineux au deuxième étage d'un triplex sur le Plateau, "
+    "chauffage inclus, stationnement disponible, animaux acceptés, libre immédiatement."
+)
+
+
+class TestNearDuplicateIndex(unittest.TestCase):
+    def test_shingles(self):
+        self.assertEqual(get_shingles("Hello, World!"), {"hello world"})
+        self.assertEqual(get_shingles(""), set())
+        self.assertEqual(len(get_shingles("a b c d e")), 3)
+
+    def test_near_duplicate(self):
+        index = NearDuplicateIndex()
+        index.add("https://www.facebook.com/marketplace/item/1/", DESCRIPTION)
+        self.assertTrue(index.is_near_duplicate(DESCRIPTION))
+        self.assertTrue(index.is_near_duplicate(REPOST))
+        self.assertFalse(index.is_near_duplicate(OTHER))
+        self.assertFalse(index.is_near_duplicate(""))
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "db.json.lsh")
+            index = NearDuplicateIndex(path=path)
+            index.add("https://www.facebook.com/marketplace/item/1/", DESCRIPTION)
+            index.save()
+            loaded = NearDuplicateIndex(path=path)
+            loaded.load()
+            self.assertIn("https://www.facebook.com/marketplace/item/1/", loaded)
+            self.assertEqual(loaded.query(REPOST), index.query(REPOST))
+
+    def test_journal(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "db.json.lsh")
+            index = NearDuplicateIndex(path=path)
+            index.journal.compact_every = 3
+            index.add("a", DESCRIPTION)
+            index.save()  # The first save writes the snapshot
+            snapshot_size = os.path.getsize(path)
+            self.assertFalse(os.path.isfile(path + ".journal"))
+            index.add("b", OTHER)
+            index.remove("a")
+            self.assertTrue(index.dirty)
+            index.save()
+            self.assertFalse(index.dirty)
+            # Only the changes are appended
+            self.assertEqual(os.path.getsize(path), snapshot_size)
+            with open(path + ".journal") as journal_file:
+                self.assertEqual(len(journal_file.readlines()), 2)
+            with open(path + ".journal", "a") as journal_file:
+                journal_file.write('["c", [1, 2')  # An interrupted save
+            loaded = NearDuplicateIndex(path=path)
+            loaded.journal.compact_every = 3
+            loaded.load()
+            self.assertEqual(sorted(loaded.signatures), ["b"])
+            self.assertFalse(loaded.dirty)
+            loaded.add("a", REPOST)
+            loaded.save()  # The journal holds 3 changes: it is compacted
+            self.assertFalse(os.path.isfile(path + ".journal"))
+            reloaded = NearDuplicateIndex(path=path)
+            reloaded.load()
+            self.assertEqual(reloaded.signatures, loaded.signatures)
+            # Signatures of other parameters are not loaded
+            other = NearDuplicateIndex(path=path, num_perm=32)
+            other.load()
+            self.assertEqual(len(other), 0)
+
+    def test_shared(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "db.sqlite.lsh")
+            first = NearDuplicateIndex(path=path)
+            first.journal.compact_every = 3
+            first.add("a", DESCRIPTION)
+            first.save()
+            # Two scrapers of the same database, saving one at a time
+            second = NearDuplicateIndex(path=path)
+            second.journal.compact_every = 3
+            second.load()
+            first.add("b", OTHER)
+            first.save()
+            second.remove("a")
+            second.save()  # Merges `b` from the journal
+            self.assertEqual(sorted(second.signatures), ["b"])
+            first.add("c", REPOST)
+            first.save()  # Compacted: `a` is not written back
+            self.assertEqual(sorted(first.signatures), ["b", "c"])
+            second.add("d", DESCRIPTION)
+            second.save()  # Merges the new snapshot of `first`
+            self.assertEqual(sorted(second.signatures), ["b", "c", "d"])
+            self.assertEqual(second.query(REPOST)[0][0], "c")
+            reloaded = NearDuplicateIndex(path=path)
+            reloaded.load()
+            self.assertEqual(sorted(reloaded.signatures), ["b", "c", "d"])
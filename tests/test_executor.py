@@ -0,0 +1,125 @@
+# pylint: disable-all
+
+import threading
+import time
+import unittest
+
+from flatfindr.executor import ScrapeExecutor
+
+""" Test the ScrapeExecutor Class with fake scrapes """
+
+
+class FakeScrape:
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.cancelled = False
+
+    def __call__(self, task):
+        self.started.set()
+        while not self.release.wait(0.01):
+            if task.cancelled.is_set():
+                self.cancelled = True
+                return
+
+
+class TestScrapeExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = ScrapeExecutor(max_workers=1, max_queued=2)
+
+    def tearDown(self):
+        self.executor.close()
+
+    def test_run(self):
+        scrape = FakeScrape()
+        scrape.release.set()
+        task = self.executor.submit(scrape, [1])
+        self.assertTrue(task.done.wait(1))
+        self.assertTrue(scrape.started.is_set())
+        self.assertFalse(self.executor.is_busy(1))
+
+    def test_one_scrape_per_key(self):
+        scrape = FakeScrape()
+        self.assertIsNotNone(self.executor.submit(scrape, [1, 2]))
+        self.assertIsNone(self.executor.submit(FakeScrape(), [2]))
+        self.assertIsNotNone(self.executor.submit(FakeScrape(), [3]))
+        scrape.release.set()
+
+    def test_bounded_queue(self):
+        running = FakeScrape()
+        self.executor.submit(running, [0])
+        running.started.wait(1)
+        self.assertIsNotNone(self.executor.submit(FakeScrape(), [1]))
+        self.assertIsNotNone(self.executor.submit(FakeScrape(), [2]))
+        self.assertIsNone(self.executor.submit(FakeScrape(), [3]))
+        self.assertEqual(len(self.executor), 2)
+        running.release.set()
+
+    def test_cancel_queued(self):
+        running = FakeScrape()
+        self.executor.submit(running, [0])
+        running.started.wait(1)
+        queued = FakeScrape()
+        task = self.executor.submit(queued, [1])
+        self.assertTrue(self.executor.cancel(1))
+        self.assertTrue(task.done.is_set())
+        self.assertEqual(len(self.executor), 0)
+        self.assertFalse(self.executor.cancel(1))
+        running.release.set()
+        self.assertFalse(queued.started.wait(0.1))
+
+    def test_cancel_running(self):
+        scrape = FakeScrape()
+        task = self.executor.submit(scrape, [1, 2])
+        scrape.started.wait(1)
+        self.executor.cancel(1)
+        self.assertEqual(task.keys, {2})
+        self.assertFalse(task.cancelled.is_set())
+        # The chat stays busy until the cancelled scrape is over
+        self.assertTrue(self.executor.is_busy(1))
+        self.assertIsNone(self.executor.submit(FakeScrape(), [1]))
+        self.assertFalse(self.executor.cancel(1))
+        self.executor.cancel(2)
+        self.assertTrue(task.done.wait(1))
+        self.assertTrue(scrape.cancelled)
+        self.assertFalse(self.executor.is_busy(1))
+        self.assertIsNotNone(self.executor.submit(FakeScrape(), [1]))
+
+    def test_submit_does_not_wait(self):
+        scrapes = [FakeScrape() for _ in range(2)]
+        start = time.monotonic()
+        for i, scrape in enumerate(scrapes):
+            self.executor.submit(scrape, [i])
+        self.assertLess(time.monotonic() - start, 0.05)
+        for scrape in scrapes:
+            scrape.release.set()
+
+    def test_restart(self):
+        restarted = []
+        # No scrape in flight: restarted right away
+        self.assertFalse(self.executor.cancel(1, restart=lambda: restarted.append(1)))
+        self.assertEqual(restarted, [1])
+        scrape = FakeScrape()
+        task = self.executor.submit(scrape, [1, 2])
+        scrape.started.wait(1)
+        self.executor.cancel(1, restart=lambda: restarted.append("first"))
+        # Only the last restart is kept
+        self.executor.cancel(
+            1, restart=lambda: restarted.append(self.executor.is_busy(1))
+        )
+        self.executor.cancel(2, restart=lambda: restarted.append(2))
+        self.assertEqual(restarted, [1])
+        self.assertTrue(task.done.wait(1))
+        # Once the cancelled scrape is over, the keys are free
+        self.assertEqual(restarted, [1, False, 2])
+
+    def test_cancel_without_restart(self):
+        restarted = []
+        scrape = FakeScrape()
+        task = self.executor.submit(scrape, [1])
+        scrape.started.wait(1)
+        self.executor.cancel(1, restart=lambda: restarted.append(1))
+        # E.g. the search has been stopped in the meantime
+        self.executor.cancel(1)
+        self.assertTrue(task.done.wait(1))
+        self.assertEqual(restarted, [])
@@ -1,13 +1,32 @@
 # pylint: disable-all
 
 import io
+import json
 import os
+import stat
+import tempfile
+import time
 import unittest
 import unittest.mock
 import platform
+from datetime import date, timedelta
 
 
-from flatfindr.facebook import Facebook
+from flatfindr.facebook import (
+    EXTRACT_DETAILS_SCRIPT,
+    GALLERY_SCRIPT,
+    ITEM_LINK,
+    ITEM_READY_SCRIPT,
+    KEYWORDS,
+    LOGGED_IN_SCRIPT,
+    PAYLOADS_SCRIPT,
+    Facebook,
+)
+from flatfindr.geocoding import Geocoder, LocalBackend
+from flatfindr.metrics import Metrics
+from flatfindr.politeness import Politeness
+from flatfindr.pool import Lease
+from flatfindr.scraper import COUNT_LINKS_SCRIPT, HARVEST_LINKS_SCRIPT
 
 """ Test the Facebook Class """
 
@@ -29,3 +48,314 @@ class TestLogIn(unittest.TestCase):
         fb.log_in()
         self.assertEqual(mock_stdout.getvalue(), "")
         fb.quit_driver()
+
+
+class FakeDriver:
+    """A stub of the webdriver, answering the scripts of the scraper from a fake page."""
+
+    def __init__(self, spans=(), images=(), screens=(), cookies=(), payloads=()):
+        self.spans = list(spans)  # The texts of the <span dir> of an item page
+        self.payloads = payloads  # Its JSON payloads, or the exception raised
+        self.images = list(images)  # The pictures of its gallery
+        self.screens = [
+            list(links) for links in screens
+        ]  # The links of each screen of the feed
+        self.shown = 0  # The number of screens of the feed rendered
+        self.cookies = {cookie["name"]: cookie for cookie in cookies}
+        self.urls = []  # The loaded pages
+        self.scripts = []  # The executed scripts
+
+    def get(self, url):
+        self.urls.append(url)
+        self.shown = min(1, len(self.screens))
+
+    def refresh(self):
+        self.urls.append(self.urls[-1])
+
+    def quit(self):
+        pass
+
+    def get_cookie(self, name):
+        return self.cookies.get(name)
+
+    def get_cookies(self):
+        return list(self.cookies.values())
+
+    def add_cookie(self, cookie):
+        self.cookies[cookie["name"]] = cookie
+
+    def find_element(self, by, value):
+        raise RuntimeError("No log in form")
+
+    def get_links(self, pattern):
+        return [
+            link
+            for links in self.screens[: self.shown]
+            for link in links
+            if pattern in link
+        ]
+
+    def execute_script(self, script, *args):
+        self.scripts.append(script)
+        if script == PAYLOADS_SCRIPT:
+            if isinstance(self.payloads, Exception):
+                raise self.payloads
+            return list(self.payloads)
+        if script == ITEM_READY_SCRIPT:
+            return True
+        if script == GALLERY_SCRIPT:
+            return self.images
+        if script == LOGGED_IN_SCRIPT:
+            return True
+        if script == COUNT_LINKS_SCRIPT:
+            return len(self.get_links(args[0]))
+        if script == HARVEST_LINKS_SCRIPT:
+            return list(
+                dict.fromkeys(link.split("?")[0] for link in self.get_links(args[0]))
+            )
+        if script.startswith("window.scrollTo"):
+            self.shown = min(self.shown + 1, len(self.screens))
+            return None
+        raise ValueError(f"Unexpected script: {script}")
+
+    def execute_async_script(self, script, *args):
+        self.scripts.append(script)
+        if script == EXTRACT_DETAILS_SCRIPT and args == (KEYWORDS["see_more"],):
+            return self.spans
+        raise ValueError(f"Unexpected script: {script}")
+
+
+def make_link(i, query=""):
+    return f"https://www.facebook.com/marketplace/item/{i}/{query}"
+
+
+def make_facebook(tmp_dir, driver):
+    fb = Facebook(
+        db_path=os.path.join(tmp_dir, "db.json"),
+        lease=Lease(driver),
+        politeness=Politeness(scale=0),
+        metrics=Metrics(),
+        geocoder=Geocoder(backend=LocalBackend(), cache_path=None),
+    )
+    fb.cookies_path = os.path.join(tmp_dir, "cookies-facebook.json")
+    return fb
+
+
+def make_cookie(name, expiry):
+    return {"name": name, "value": "1", "domain": ".facebook.com", "expiry": expiry}
+
+
+class TestItemPage(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_scrape_item_details(self):
+        driver = FakeDriver(
+            spans=[
+                "Appartement",
+                "Mis en vente il y a 3 jours à Montréal, QC",
+                "1 450 $ / mois",
+                "2212 Rue d'Iberville, Montréal, QC",
+                "700 pieds carrés",
+                "2 chambres · 1 salle de bain",
+                "Meublé",
+                "Description",
+                "Superbe 4 1/2 lumineux près du métro. Voir moins",
+            ],
+            images=["https://scontent.xx.fbcdn.net/v/t1/1_n.jpg"],
+        )
+        fb = make_facebook(self.tmp_dir.name, driver)
+        item_url = "https://www.facebook.com/marketplace/item/1/"
+        item_details = fb.scrape_item_details(item_url)
+        self.assertEqual(
+            item_details,
+            {
+                "url": item_url,
+                "images": ["https://scontent.xx.fbcdn.net/v/t1/1_n.jpg"],
+                "published": (date.today() - timedelta(days=3)).isoformat(),
+                "price": 1450,
+                "address": "2212 Rue d'Iberville",
+                "surface": 65,
+                "bedrooms": 2,
+                "furnished": "Meublé",
+                "description": "Superbe 4 1/2 lumineux près du métro. ",
+            },
+        )
+        self.assertEqual(driver.urls, [item_url])
+        # The texts of the page are read in a single call
+        self.assertEqual(driver.scripts.count(EXTRACT_DETAILS_SCRIPT), 1)
+        # The texts are parsed as well when the payload can't be read
+        driver = FakeDriver(
+            spans=driver.spans, images=driver.images, payloads=RuntimeError()
+        )
+        fb.driver = driver
+        with unittest.mock.patch("sys.stdout", new_callable=io.StringIO):
+            self.assertEqual(fb.scrape_item_details(item_url), item_details)
+
+    def test_scrape_payload(self):
+        listing = {
+            "listing_price": {"amount": "1450.00"},
+            "creation_time": int(time.time()),
+            "bedrooms": 0,
+            "redacted_description": {"text": ""},
+        }
+        driver = FakeDriver(payloads=[json.dumps({"data": listing})])
+        fb = make_facebook(self.tmp_dir.name, driver)
+        item_details = fb.scrape_item_details(make_link(1))
+        self.assertEqual(item_details["bedrooms"], 0)
+        self.assertEqual(item_details["description"], "")
+        # A studio with no description is complete: the texts of the page are not parsed
+        self.assertNotIn(EXTRACT_DETAILS_SCRIPT, driver.scripts)
+
+
+class TestFeed(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def search(self, fb, scroll):
+        return fb.get_items_links(
+            min_price=1200,
+            max_price=1750,
+            min_bedrooms=2,
+            lat=45.5254,
+            lng=-73.5724,
+            radius=2,
+            scroll=scroll,
+        )
+
+    def test_harvest_links(self):
+        driver = FakeDriver(
+            screens=[
+                [
+                    make_link(1, "?ref=search"),
+                    "https://www.facebook.com/marketplace/category/propertyrentals",
+                    make_link(2),
+                    make_link(1, "?ref=browse"),
+                ]
+            ]
+        )
+        fb = make_facebook(self.tmp_dir.name, driver)
+        driver.get(fb.main_url)
+        # Deduplicated, without their query string, in document order
+        self.assertEqual(fb.harvest_links(ITEM_LINK), [make_link(1), make_link(2)])
+        self.assertEqual(driver.scripts, [HARVEST_LINKS_SCRIPT])
+        with unittest.mock.patch.object(
+            driver, "execute_script", side_effect=RuntimeError
+        ), unittest.mock.patch("sys.stdout", new_callable=io.StringIO):
+            self.assertEqual(fb.harvest_links(ITEM_LINK), [])
+
+    def test_unseen_links(self):
+        driver = FakeDriver(
+            screens=[[make_link(i, "?ref=search") for i in (1, 2, 3, 2)]]
+        )
+        fb = make_facebook(self.tmp_dir.name, driver)
+        fb.index_item({"url": make_link(2), "state": "NI"})
+        self.assertEqual(self.search(fb, scroll=0), [make_link(1), make_link(3)])
+        self.assertEqual(driver.scripts.count(HARVEST_LINKS_SCRIPT), 1)
+
+    def test_early_stop(self):
+        # The feed only shows seen ads: it is scrolled `scroll_patience` times at most
+        screens = [[make_link(i), make_link(i + 1)] for i in range(0, 20, 2)]
+        driver = FakeDriver(screens=screens)
+        fb = make_facebook(self.tmp_dir.name, driver)
+        for i in range(20):
+            fb.index_item({"url": make_link(i), "state": "NI"})
+        with unittest.mock.patch("sys.stdout", new_callable=io.StringIO):
+            self.assertEqual(self.search(fb, scroll=8), [])
+        self.assertEqual(driver.shown, 2)
+        self.assertEqual(fb.scrolls_saved, 7)
+        self.assertEqual(fb.report.counters["scrolls_saved"], 7)
+
+    def test_scroll_while_unseen(self):
+        # Each scroll brings unseen ads, until the end of the feed
+        screens = [[make_link(i)] for i in range(4)]
+        driver = FakeDriver(screens=screens)
+        fb = make_facebook(self.tmp_dir.name, driver)
+        with unittest.mock.patch("flatfindr.facebook.SCROLL_TIMEOUT", 0.05):
+            links = self.search(fb, scroll=8)
+        self.assertEqual(links, [make_link(i) for i in range(4)])
+        # Then the scrolling stops after 2 scrolls bringing nothing
+        self.assertEqual(driver.scripts.count(HARVEST_LINKS_SCRIPT), 1 + 3 + 2)
+        self.assertEqual(fb.scrolls_saved, 3)
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_restore_session(self):
+        now = int(time.time())
+        driver = FakeDriver(
+            cookies=[make_cookie("c_user", now + 3600), make_cookie("xs", now - 1)]
+        )
+        make_facebook(self.tmp_dir.name, driver).save_cookies()
+        fb = make_facebook(self.tmp_dir.name, FakeDriver())
+        # Saved as JSON, readable by the owner only
+        with open(fb.cookies_path) as cookies_file:
+            self.assertEqual(len(json.load(cookies_file)), 2)
+        self.assertEqual(stat.S_IMODE(os.stat(fb.cookies_path).st_mode), 0o600)
+        self.assertTrue(fb.restore_session())
+        # The expired cookies are not restored
+        self.assertEqual(list(fb.driver.cookies), ["c_user"])
+        self.assertEqual(fb.driver.urls, [fb.main_url, fb.main_url])
+
+    def test_expired_session(self):
+        driver = FakeDriver(cookies=[make_cookie("c_user", int(time.time()) - 1)])
+        make_facebook(self.tmp_dir.name, driver).save_cookies()
+        fb = make_facebook(self.tmp_dir.name, FakeDriver())
+        self.assertFalse(fb.restore_session())
+        self.assertEqual(fb.driver.urls, [])
+        # Without the session cookie, the restored session is not logged in
+        driver = FakeDriver(cookies=[make_cookie("xs", int(time.time()) + 3600)])
+        make_facebook(self.tmp_dir.name, driver).save_cookies()
+        self.assertFalse(
+            make_facebook(self.tmp_dir.name, FakeDriver()).restore_session()
+        )
+
+    def test_run(self):
+        driver = FakeDriver(
+            screens=[[make_link(1)]],
+            cookies=[make_cookie("c_user", int(time.time()) + 3600)],
+        )
+        fb = make_facebook(self.tmp_dir.name, driver)
+        with unittest.mock.patch.object(fb, "log_in") as log_in:
+            fb.run(max_items=0, scroll=0)
+        # No saved session yet: full log in
+        log_in.assert_called_once()
+        fb.save_cookies()
+        fb = make_facebook(self.tmp_dir.name, FakeDriver(screens=[[make_link(1)]]))
+        with unittest.mock.patch.object(fb, "log_in") as log_in:
+            fb.run(max_items=0, scroll=0)
+            self.assertTrue(fb.lease.logged_in)
+            # Closed at the end of the run, and loaded again by the next one
+            self.assertIsNone(fb.storage)
+            self.assertTrue(fb.seen_filter.mmap.closed)
+            # The leased webdriver is already logged in: the session is not restored again
+            fb.run(max_items=0, scroll=0)
+        log_in.assert_not_called()
+        self.assertEqual(fb.driver.urls.count(fb.main_url), 2)
+
+    def test_run_logged_out(self):
+        fb = make_facebook(self.tmp_dir.name, FakeDriver(screens=[[make_link(1)]]))
+        with unittest.mock.patch.object(fb, "log_in") as log_in:
+            fb.run(max_items=0, scroll=0)
+            # The log in failed: no session cookie
+            self.assertFalse(fb.lease.logged_in)
+            fb.driver.add_cookie(make_cookie("c_user", int(time.time()) + 3600))
+            fb.run(max_items=0, scroll=0)
+            self.assertEqual(log_in.call_count, 2)
+            self.assertTrue(fb.lease.logged_in)
+            # The session of the leased webdriver expired
+            fb.driver.cookies.clear()
+            fb.run(max_items=0, scroll=0)
+            self.assertEqual(log_in.call_count, 3)
+            self.assertFalse(fb.lease.logged_in)
@@ -0,0 +1,53 @@
+# pylint: disable-all
+
+import unittest
+
+from flatfindr.filters import DEFAULT_RULES, INCLUDE, Rule, RuleSet, normalize
+
+""" Test the filter engine of the descriptions """
+
+
+class TestFilters(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEqual(
+            normalize("  Rez-de-Chaussée\n  ÉCHANGE "), "rez-de-chaussee echange"
+        )
+
+    def test_default_rules(self):
+        result = DEFAULT_RULES.evaluate(
+            "Beau 4 1/2 au REZ DE CHAUSSÉE, échange possible"
+        )
+        self.assertTrue(result.excluded)
+        self.assertEqual(result.fired, ["swap", "first_floor"])
+        result = DEFAULT_RULES.evaluate("Beau 4 1/2 au 2e étage")
+        self.assertFalse(result)
+        self.assertEqual(result.fired, [])
+        self.assertFalse(DEFAULT_RULES.evaluate(""))
+
+    def test_user_rules(self):
+        rules = DEFAULT_RULES.extend(
+            exclude=["sous-sol"], include=["balcon", "terrasse"]
+        )
+        self.assertTrue(rules.evaluate("Grand 5 1/2 au sous-sol avec terrasse"))
+        self.assertTrue(rules.evaluate("Grand 5 1/2 au 3e étage"))
+        result = rules.evaluate("Grand 5 1/2 au 3e étage avec balcon")
+        self.assertFalse(result)
+        self.assertEqual(result.fired, ["user_include"])
+
+    def test_include_only(self):
+        rules = RuleSet([Rule("pets", ["animaux acceptés", "pets allowed"], INCLUDE)])
+        self.assertFalse(rules.evaluate("Animaux Acceptes"))
+        self.assertTrue(rules.evaluate("No pets"))
+
+    def test_overlapping_rules(self):
+        rules = RuleSet(
+            [
+                Rule("first_floor", ["rez-de-chaussée"]),
+                Rule("noise", ["chaussée"]),
+                Rule("view", ["vue sur le parc"], INCLUDE),
+                Rule("park", ["sur le parc du"], INCLUDE),
+            ]
+        )
+        result = rules.evaluate("Au rez-de-chaussée, vue sur le parc du quartier")
+        self.assertEqual(result.fired, ["first_floor", "noise", "view", "park"])
+        self.assertTrue(result.excluded)
@@ -0,0 +1,80 @@
+# pylint: disable-all
+
+import random
+import unittest
+
+from flatfindr.geo import (
+    CircleIndex,
+    PointIndex,
+    encode,
+    get_covering_cells,
+    get_precision,
+)
+from flatfindr.planner import haversine
+
+""" Test the spatial indexes of the listings and of the search circles """
+
+
+def random_point(rng):
+    # Around Montreal
+    return 45.5 + rng.uniform(-0.3, 0.3), -73.6 + rng.uniform(-0.4, 0.4)
+
+
+class TestGeo(unittest.TestCase):
+    def test_encode(self):
+        self.assertEqual(encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertEqual(encode(45.5254, -73.5724, 5), "f25dv")
+
+    def test_covering_cells(self):
+        precision = get_precision(45.5, 2)
+        cells = get_covering_cells(45.5, -73.6, 2, precision)
+        self.assertLessEqual(len(cells), 9)
+        self.assertIn(encode(45.5, -73.6, precision), cells)
+        # Across the antimeridian
+        cells = get_covering_cells(0, 179.99, 5, 4)
+        self.assertIn(encode(0, -179.99, 4), cells)
+
+    def test_point_index(self):
+        rng = random.Random(42)
+        points = {i: random_point(rng) for i in range(2000)}
+        index = PointIndex()
+        for key, (lat, lng) in points.items():
+            index.add(key, lat, lng)
+        for key in range(0, 2000, 2):
+            index.remove(key)
+        for radius in (0.5, 2, 10, 100):
+            lat, lng = random_point(rng)
+            expected = sorted(
+                key
+                for key, point in points.items()
+                if key % 2 and haversine(lat, lng, *point) <= radius
+            )
+            found = index.within(lat, lng, radius)
+            self.assertEqual(sorted(key for key, _ in found), expected)
+            distances = [distance for _, distance in found]
+            self.assertEqual(distances, sorted(distances))
+        index.add(1, 0, 0)  # Moved
+        self.assertEqual(index.within(0, 0, 1), [(1, 0)])
+        self.assertEqual(len(index), 1000)
+
+    def test_circle_index(self):
+        rng = random.Random(42)
+        circles = {
+            i: (*random_point(rng), rng.choice((0.5, 1, 2, 5, 20))) for i in range(2000)
+        }
+        index = CircleIndex()
+        for key, circle in circles.items():
+            index.add(key, *circle)
+        index.remove(0)
+        del circles[0]
+        for _ in range(50):
+            lat, lng = random_point(rng)
+            expected = sorted(
+                key
+                for key, (c_lat, c_lng, radius) in circles.items()
+                if haversine(lat, lng, c_lat, c_lng) <= radius
+            )
+            self.assertEqual(sorted(index.containing(lat, lng)), expected)
+        for key in list(circles):
+            index.remove(key)
+        self.assertEqual(index.cells, {})
@@ -0,0 +1,123 @@
+# pylint: disable-all
+
+import os
+import tempfile
+import threading
+import unittest
+
+from flatfindr.geocoding import (
+    GeocodingCache,
+    Geocoder,
+    LocalBackend,
+    normalize_address,
+)
+
+""" Test the geocoding cache and the offline geocoder """
+
+PLACES = [
+    {
+        "address": "2212 Rue d'Iberville, Montréal, QC",
+        "lat": 45.5307,
+        "lng": -73.5563,
+        "city": "Montréal",
+    },
+    {
+        "address": "1 Place Laval, Laval, QC",
+        "lat": 45.5575,
+        "lng": -73.7212,
+        "city": "Laval",
+    },
+]
+
+
+class TestGeocoding(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "geocoding.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_normalize_address(self):
+        self.assertEqual(
+            normalize_address("2212  Rue d’Iberville, MONTRÉAL, QC"),
+            "2212 rue d'iberville, montreal, qc",
+        )
+
+    def test_cached(self):
+        backend = LocalBackend(PLACES)
+        geocoder = Geocoder(backend, cache_path=self.path)
+        self.assertEqual(geocoder.geocode("2212 Rue d'Iberville"), (45.5307, -73.5563))
+        self.assertEqual(
+            geocoder.geocode("2212 rue d'Iberville, Montreal, QC"), (45.5307, -73.5563)
+        )
+        self.assertIsNone(geocoder.geocode("Nowhere"))
+        self.assertIsNone(geocoder.geocode("Nowhere"))
+        self.assertEqual(geocoder.reverse(45.55752, -73.72121)["city"], "Laval")
+        self.assertEqual(geocoder.reverse(45.55760, -73.72138)["city"], "Laval")
+        self.assertEqual(backend.lookups_cnt, 3)
+        # Persisted in batches, or when flushed
+        self.assertFalse(os.path.isfile(self.path))
+        geocoder.flush()
+        backend = LocalBackend(PLACES)
+        geocoder = Geocoder(backend, cache_path=self.path)
+        self.assertEqual(geocoder.geocode("2212 Rue d'Iberville"), (45.5307, -73.5563))
+        self.assertEqual(backend.lookups_cnt, 0)
+
+    def test_lru_and_ttl(self):
+        cache = GeocodingCache(self.path, max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)  # Evicts b, the least recently used
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("a"), (True, 1))
+        cache.put("d", 4, ttl=-1)  # Evicts c
+        self.assertEqual(cache.get("d"), (False, None))
+        cache.flush()
+        self.assertEqual(list(GeocodingCache(self.path).entries), ["a"])
+
+    def test_save_every(self):
+        cache = GeocodingCache(self.path, save_every=3)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertFalse(os.path.isfile(self.path))
+        cache.put("c", 3)
+        self.assertEqual(len(GeocodingCache(self.path)), 3)
+        mtime = os.stat(self.path).st_mtime_ns
+        cache.flush()  # Nothing new to persist
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+    def test_coalescing(self):
+        backend = LocalBackend(PLACES, delay=0.2)
+        geocoder = Geocoder(backend, cache_path=None)
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(geocoder.geocode("2212 Rue d'Iberville"))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [(45.5307, -73.5563)] * 5)
+        self.assertEqual(backend.lookups_cnt, 1)
+
+    def test_errors_not_cached(self):
+        class FailingBackend:
+            def geocode(self, address):
+                raise ConnectionError
+
+        geocoder = Geocoder(FailingBackend(), cache_path=None)
+        with self.assertRaises(ConnectionError):
+            geocoder.geocode("2212 Rue d'Iberville")
+        self.assertEqual(len(geocoder.cache), 0)
+        self.assertEqual(geocoder.in_flight, {})
+
+    def test_made_up_coordinates(self):
+        backend = LocalBackend(center=(45.5254, -73.5724))
+        lat, lng = backend.geocode("5510 Avenue Stirling")
+        self.assertEqual(backend.geocode("5510 avenue stirling"), (lat, lng))
+        self.assertLess(abs(lat - 45.5254), 0.05)
@@ -0,0 +1,87 @@
+# pylint: disable-all
+
+import json
+import os
+import tempfile
+import unittest
+
+from flatfindr.metrics import (
+    PROMETHEUS_FILE,
+    REPORT_FILE,
+    Histogram,
+    Metrics,
+    RunReport,
+    format_key,
+)
+
+""" Test the run reports and the metrics aggregating them """
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "metrics")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_format_key(self):
+        self.assertEqual(format_key("links", {}), "links")
+        self.assertEqual(
+            format_key("items", {"decision": "new", "a": 1}),
+            'items{a="1",decision="new"}',
+        )
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(1, 10))
+        for value in (0.5, 1, 5, 100):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1])
+        self.assertEqual(histogram.cnt, 4)
+        self.assertEqual(histogram.sum, 106.5)
+
+    def test_run_report(self):
+        report = RunReport(website="facebook")
+        for _ in range(3):
+            with report.timer("scroll"):
+                pass
+        with self.assertRaises(ValueError):
+            with report.timer("save_db"):
+                raise ValueError
+        report.count("items", decision="new")
+        report.count("items", 2, decision="new")
+        run = report.to_dict()
+        self.assertEqual(run["website"], "facebook")
+        self.assertEqual(run["stages"]["scroll"]["cnt"], 3)
+        self.assertEqual(run["stages"]["save_db"]["cnt"], 1)
+        self.assertEqual(run["counters"], {'items{decision="new"}': 3})
+        self.assertEqual(report.metrics.histograms["scroll"].cnt, 3)
+
+    def test_files_and_state(self):
+        metrics = Metrics(self.path, buckets=(1, 10))
+        report = RunReport(metrics=metrics)
+        metrics.observe("log_in", 5)
+        report.count("items", decision="old")
+        report.finish()
+        with open(os.path.join(self.path, REPORT_FILE)) as f:
+            self.assertEqual(json.load(f)["counters"], {'items{decision="old"}': 1})
+        with open(os.path.join(self.path, PROMETHEUS_FILE)) as f:
+            prometheus = f.read().splitlines()
+        self.assertIn(
+            'flatfindr_stage_seconds_bucket{stage="log_in",le="1"} 0', prometheus
+        )
+        self.assertIn(
+            'flatfindr_stage_seconds_bucket{stage="log_in",le="10"} 1', prometheus
+        )
+        self.assertIn(
+            'flatfindr_stage_seconds_bucket{stage="log_in",le="+Inf"} 1', prometheus
+        )
+        self.assertIn('flatfindr_items_total{decision="old"} 1', prometheus)
+        self.assertIn("flatfindr_runs_total 1", prometheus)
+        # The histograms and counters accumulate across processes
+        metrics = Metrics(self.path, buckets=(1, 10))
+        RunReport(metrics=metrics).finish()
+        metrics.observe("log_in", 0.5)
+        self.assertEqual(metrics.histograms["log_in"].counts, [1, 1])
+        self.assertEqual(metrics.counters, {'items{decision="old"}': 1})
+        self.assertEqual(metrics.runs_cnt, 2)
@@ -0,0 +1,238 @@
+# pylint: disable-all
+
+import json
+import threading
+import time
+import unittest
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Bot
+
+from flatfindr.metrics import Metrics
+from flatfindr.notifier import DIGEST_SEPARATOR, Notifier, TokenBucket
+
+""" Test the rate-limited notifier, against a local fake of the Telegram Bot API """
+
+TOKEN = "123456:fake-token"
+
+
+class FakeBotApi:
+    def __init__(self):
+        self.requests = []  # (time, method, params)
+        # (HTTP status, description, retry after) of the next answers
+        self.errors = deque()
+        self.blocked = set()  # Chat ids answered with 403
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                params = json.loads(body or b"{}")
+                # The bot sends the chat ids as strings
+                chat_id = params["chat_id"] = int(params["chat_id"])
+                if chat_id in fake.blocked:
+                    return self.answer(
+                        403,
+                        {
+                            "ok": False,
+                            "error_code": 403,
+                            "description": "Forbidden: bot was blocked by the user",
+                        },
+                    )
+                if fake.errors:
+                    status, description, retry_after = fake.errors.popleft()
+                    answer = {
+                        "ok": False,
+                        "error_code": status,
+                        "description": description,
+                    }
+                    if retry_after is not None:
+                        answer["parameters"] = {"retry_after": retry_after}
+                    return self.answer(status, answer)
+                fake.requests.append((time.monotonic(), method, params))
+                message = {
+                    "message_id": len(fake.requests),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                }
+                if method == "sendMessage":
+                    message["text"] = params["text"]
+                self.answer(
+                    200,
+                    {
+                        "ok": True,
+                        "result": [message] if method == "sendMediaGroup" else message,
+                    },
+                )
+
+            def answer(self, status, content):
+                data = json.dumps(content).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def texts(self, chat_id=None):
+        return [
+            params["text"]
+            for _, method, params in self.requests
+            if method == "sendMessage" and chat_id in (None, params["chat_id"])
+        ]
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_bucket(self):
+        bucket = TokenBucket(rate=2, capacity=2, now=0)
+        self.assertEqual(bucket.get_delay(0), 0)
+        bucket.take(0)
+        bucket.take(0)
+        self.assertAlmostEqual(bucket.get_delay(0), 0.5)
+        self.assertAlmostEqual(bucket.get_delay(0.25), 0.25)
+        self.assertEqual(bucket.get_delay(0.5), 0)
+        # The tokens don't pile up beyond the capacity
+        self.assertEqual(bucket.get_delay(100), 0)
+        self.assertEqual(bucket.tokens, 2)
+
+
+class TestNotifier(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeBotApi()
+        self.bot = Bot(TOKEN, base_url=self.api.url + "/bot")
+        self.metrics = Metrics()
+
+    def tearDown(self):
+        self.api.stop()
+
+    def make_notifier(self, **kwargs):
+        kwargs.setdefault("metrics", self.metrics)
+        notifier = Notifier(self.bot, **kwargs)
+        self.addCleanup(notifier.close, 5)
+        return notifier
+
+    def test_send(self):
+        notifier = self.make_notifier().start()
+        self.assertTrue(notifier.send_message(1, "<b>first</b>", parse_mode="HTML"))
+        notifier.send_message(2, "second")
+        notifier.send_photo(1, "https://example.com/photo.jpg")
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(len(notifier), 0)
+        self.assertEqual(sorted(self.api.texts()), ["<b>first</b>", "second"])
+        self.assertEqual(self.api.requests[0][2]["parse_mode"], "HTML")
+        self.assertIn("sendPhoto", [method for _, method, _ in self.api.requests])
+        self.assertEqual(self.metrics.counters['notifications{status="sent"}'], 3)
+        self.assertEqual(self.metrics.histograms["notification_delay"].cnt, 3)
+
+    def test_chat_rate(self):
+        notifier = self.make_notifier(chat_rate=10, chat_burst=1)
+        for i in range(4):
+            notifier.send_message(1, str(i))
+        notifier.send_message(2, "other chat")
+        notifier.start()
+        self.assertTrue(notifier.flush(5))
+        times = [t for t, _, params in self.api.requests if params["chat_id"] == 1]
+        self.assertEqual(self.api.texts(1), ["0", "1", "2", "3"])
+        for previous, following in zip(times, times[1:]):
+            self.assertGreaterEqual(following - previous, 0.08)
+        # The other chat doesn't wait for the first one
+        self.assertLess(self.api.texts().index("other chat"), 2)
+
+    def test_global_rate(self):
+        notifier = self.make_notifier(global_rate=20)
+        for chat_id in range(30):
+            notifier.send_message(chat_id, "hello")
+        started = time.monotonic()
+        notifier.start()
+        self.assertTrue(notifier.flush(5))
+        # 20 messages at once, then 20 per second
+        self.assertGreaterEqual(time.monotonic() - started, 0.4)
+        self.assertEqual(len(self.api.requests), 30)
+
+    def test_retry_after(self):
+        self.api.errors.append((429, "Too Many Requests: retry after 1", 1))
+        notifier = self.make_notifier().start()
+        started = time.monotonic()
+        notifier.send_message(1, "hello")
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.api.texts(), ["hello"])
+        self.assertGreaterEqual(self.api.requests[0][0] - started, 0.9)
+        self.assertEqual(self.metrics.counters["notifications_rate_limited"], 1)
+        self.assertEqual(self.metrics.counters['notifications{status="sent"}'], 1)
+
+    def test_network_error(self):
+        self.api.errors.append((502, "Bad Gateway", None))
+        notifier = self.make_notifier(retry_delay=0.05).start()
+        notifier.send_message(1, "hello")
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.api.texts(), ["hello"])
+        self.assertEqual(self.metrics.counters['notifications{status="retried"}'], 1)
+
+    def test_max_retries(self):
+        self.api.errors.extend([(502, "Bad Gateway", None)] * 3)
+        notifier = self.make_notifier(retry_delay=0.01, max_retries=2).start()
+        notifier.send_message(1, "hello")
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.api.texts(), [])
+        self.assertEqual(self.metrics.counters['notifications{status="retried"}'], 2)
+        self.assertEqual(self.metrics.counters['notifications{status="failed"}'], 1)
+
+    def test_blocked(self):
+        self.api.blocked.add(1)
+        notifier = self.make_notifier(chat_rate=100)
+        for i in range(3):
+            notifier.send_message(1, str(i))
+        notifier.send_message(2, "hello")
+        notifier.start()
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.api.texts(), ["hello"])
+        # The next messages of the blocked chat are not sent
+        self.assertEqual(self.metrics.counters['notifications{status="failed"}'], 3)
+
+    def test_digest(self):
+        notifier = self.make_notifier(digest=True, chat_rate=100)
+        notifier.send_message(1, "first ad", parse_mode="HTML")
+        notifier.send_message(1, "second ad", parse_mode="HTML")
+        notifier.send_message(1, "plain text")
+        notifier.send_message(1, "no digest", digest=False)
+        notifier.send_message(1, "x" * 4090)
+        notifier.send_message(1, "too long to be coalesced")
+        notifier.start()
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(
+            self.api.texts(),
+            [
+                "first ad" + DIGEST_SEPARATOR + "second ad",
+                "plain text",
+                "no digest",
+                "x" * 4090,
+                "too long to be coalesced",
+            ],
+        )
+        self.assertEqual(self.metrics.counters["notifications_coalesced"], 1)
+        self.assertEqual(self.metrics.counters['notifications{status="sent"}'], 6)
+
+    def test_max_queued(self):
+        notifier = self.make_notifier(max_queued=2)
+        self.assertTrue(notifier.send_message(1, "first"))
+        self.assertTrue(notifier.send_message(1, "second"))
+        self.assertFalse(notifier.send_message(1, "third"))
+        self.assertEqual(len(notifier), 2)
+        self.assertEqual(self.metrics.counters['notifications{status="dropped"}'], 1)
+        notifier.start()
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.api.texts(), ["first", "second"])
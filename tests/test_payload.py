@@ -0,0 +1,63 @@
+# pylint: disable-all
+
+import json
+import os
+import time
+import unittest
+
+from flatfindr.payload import (
+    extract_item_details,
+    find_listing,
+    get_first_int,
+    get_payloads,
+)
+
+""" Test the extraction of the item details from the JSON payloads of Marketplace pages """
+
+FIXTURES_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "fixtures", "marketplace"
+)
+
+
+def load_fixtures():
+    with open(os.path.join(FIXTURES_PATH, "expected.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    pages = {}
+    for name in expected:
+        with open(os.path.join(FIXTURES_PATH, name), encoding="utf-8") as f:
+            pages[name] = f.read()
+    return pages, expected
+
+
+class TestPayload(unittest.TestCase):
+    def setUp(self):
+        self.pages, self.expected = load_fixtures()
+
+    def test_corpus(self):
+        for name, html in self.pages.items():
+            with self.subTest(page=name):
+                self.assertEqual(
+                    extract_item_details(get_payloads(html)), self.expected[name]
+                )
+
+    def test_find_listing(self):
+        listing = {"listing_price": {"amount": "1200"}}
+        self.assertIs(find_listing([{"a": 1}, {"b": [{"c": listing}]}]), listing)
+        self.assertIsNone(find_listing({"a": [1, "listing_price"]}))
+
+    def test_get_first_int(self):
+        self.assertEqual(get_first_int("2 chambres · 1 salle de bain"), 2)
+        self.assertEqual(get_first_int("1 300 $"), 1300)
+        self.assertEqual(get_first_int("1,450.00"), 1450)
+        self.assertIsNone(get_first_int("Studio"))
+        self.assertIsNone(get_first_int(None))
+
+    def test_speed(self):
+        runs = 200
+        start = time.perf_counter()
+        for _ in range(runs):
+            for html in self.pages.values():
+                extract_item_details(get_payloads(html))
+        per_page = (time.perf_counter() - start) / (runs * len(self.pages))
+        # A few dozens of microseconds on a laptop: far below the cost of a single webdriver call
+        self.assertLess(per_page, 0.005)
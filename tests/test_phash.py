@@ -0,0 +1,113 @@
+# pylint: disable-all
+
+import io
+import os
+import random
+import tempfile
+import unittest
+
+from PIL import Image, ImageDraw
+
+from flatfindr.phash import ImageIndex, dhash, get_distance, is_plain
+
+""" Test the perceptual hashes of the photos and their index """
+
+
+def make_photo(seed, size=(640, 480), fmt="PNG", quality=90):
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.rectangle(
+            [x, y, x + rng.randrange(50, 300), y + rng.randrange(50, 300)],
+            fill=tuple(rng.randrange(256) for _ in range(3)),
+        )
+    output = io.BytesIO()
+    image.save(output, fmt, quality=quality)
+    return output.getvalue()
+
+
+def resize(data, size):
+    with Image.open(io.BytesIO(data)) as image:
+        output = io.BytesIO()
+        image.resize(size).convert("RGB").save(output, "JPEG", quality=60)
+    return output.getvalue()
+
+
+class TestPhash(unittest.TestCase):
+    def test_dhash(self):
+        photo = make_photo(1)
+        value = dhash(photo)
+        self.assertLess(value, 1 << 64)
+        self.assertEqual(dhash(photo), value)
+        # A resized and recompressed copy has (almost) the same hash
+        self.assertLessEqual(get_distance(value, dhash(resize(photo, (320, 240)))), 5)
+        # Another photo has a different one
+        self.assertGreater(get_distance(value, dhash(make_photo(2))), 5)
+
+    def test_is_plain(self):
+        output = io.BytesIO()
+        Image.new("RGB", (100, 100), "white").save(output, "PNG")
+        self.assertTrue(is_plain(dhash(output.getvalue())))
+        self.assertFalse(is_plain(dhash(make_photo(1))))
+
+    def test_index(self):
+        index = ImageIndex()
+        photos = [dhash(make_photo(seed)) for seed in range(6)]
+        index.add("a", photos[:3])
+        index.add("b", photos[3:5])
+        self.assertEqual(len(index), 2)
+        copies = [dhash(resize(make_photo(seed), (320, 240))) for seed in range(3)]
+        self.assertEqual(index.query(copies), [("a", 3)])
+        self.assertTrue(index.is_duplicate(copies))
+        # A single shared photo is not enough for an item with several photos
+        self.assertFalse(index.is_duplicate([photos[3], photos[5]]))
+        # But it is for an item with a single photo
+        self.assertTrue(index.is_duplicate([photos[3]]))
+        self.assertFalse(index.is_duplicate([photos[5]]))
+        self.assertFalse(index.is_duplicate([]))
+        index.remove("a")
+        self.assertNotIn("a", index)
+        self.assertEqual(index.query(copies), [])
+        self.assertEqual(sum(len(entries) for entries in index.buckets.values()), 2 * 6)
+
+    def test_within_threshold(self):
+        # Two hashes differing by at most `threshold` bits always share a chunk
+        rng = random.Random(0)
+        index = ImageIndex(threshold=5)
+        values = [rng.getrandbits(64) for _ in range(200)]
+        for i, value in enumerate(values):
+            index.add(str(i), [value])
+        for i, value in enumerate(values):
+            for bit in rng.sample(range(64), 5):
+                value ^= 1 << bit
+            self.assertIn((str(i), 1), index.query([value]))
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "db.json.phash")
+            index = ImageIndex(path=path)
+            index.add("a", [dhash(make_photo(1))])
+            index.save()
+            self.assertFalse(index.dirty)
+            loaded = ImageIndex(path=path)
+            loaded.load()
+            self.assertEqual(loaded.hashes, index.hashes)
+            self.assertTrue(loaded.is_duplicate([dhash(make_photo(1))]))
+            self.assertFalse(loaded.dirty)
+            # The next changes are appended to the journal
+            snapshot_size = os.path.getsize(path)
+            loaded.add("b", [dhash(make_photo(2))])
+            loaded.remove("a")
+            loaded.save()
+            self.assertEqual(os.path.getsize(path), snapshot_size)
+            self.assertTrue(os.path.isfile(path + ".journal"))
+            reloaded = ImageIndex(path=path)
+            reloaded.load()
+            self.assertEqual(reloaded.hashes, loaded.hashes)
+            self.assertEqual(sorted(reloaded.hashes), ["b"])
+            # Hashes of another size are not comparable
+            other = ImageIndex(path=path, hash_size=16)
+            other.load()
+            self.assertEqual(len(other), 0)
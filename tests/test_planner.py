@@ -0,0 +1,76 @@
+# pylint: disable-all
+
+import unittest
+
+from flatfindr.planner import haversine, matches, plan_searches
+
+""" Test the coalescing of the users searches """
+
+PLATEAU = {"lat": 45.5254, "lng": -73.5724, "radius": 2}
+MILE_END = {"lat": 45.5236, "lng": -73.5985, "radius": 1.5}
+QUEBEC_CITY = {"lat": 46.8139, "lng": -71.2080, "radius": 2}
+
+
+class TestPlanner(unittest.TestCase):
+    def test_haversine(self):
+        self.assertAlmostEqual(haversine(45.5254, -73.5724, 45.5254, -73.5724), 0)
+        self.assertAlmostEqual(
+            haversine(
+                **{"lat1": 45.5017, "lng1": -73.5673, "lat2": 46.8139, "lng2": -71.2080}
+            ),
+            233,
+            delta=2,
+        )
+
+    def test_overlapping_searches_are_merged(self):
+        searches = {
+            1: {**PLATEAU, "min_price": 1200, "max_price": 1750, "min_bedrooms": 2},
+            2: {**MILE_END, "min_price": 1000, "max_price": 1500, "min_bedrooms": 1},
+            3: {**QUEBEC_CITY, "min_price": 800, "max_price": 1200, "min_bedrooms": 1},
+        }
+        plans = plan_searches(searches)
+        self.assertEqual(len(plans), 2)
+        query, chat_ids = next(plan for plan in plans if len(plan[1]) == 2)
+        self.assertEqual(sorted(chat_ids), [1, 2])
+        self.assertEqual(query["min_price"], 1000)
+        self.assertEqual(query["max_price"], 1750)
+        self.assertEqual(query["min_bedrooms"], 1)
+        for search in (PLATEAU, MILE_END):
+            distance = haversine(
+                query["lat"], query["lng"], search["lat"], search["lng"]
+            )
+            self.assertLessEqual(distance + search["radius"], query["radius"])
+
+    def test_max_radius(self):
+        # A chain of overlapping searches, 2 km apart
+        searches = {
+            i: {"lat": 45.5 + 0.018 * i, "lng": -73.57, "radius": 1.5} for i in range(6)
+        }
+        plans = plan_searches(searches, max_radius=4)
+        self.assertEqual(len(plans), 2)
+        for query, chat_ids in plans:
+            self.assertLessEqual(query["radius"], 4)
+            for chat_id in chat_ids:
+                search = searches[chat_id]
+                distance = haversine(
+                    query["lat"], query["lng"], search["lat"], search["lng"]
+                )
+                self.assertLessEqual(distance + search["radius"], query["radius"])
+
+    def test_disjoint_prices_are_not_merged(self):
+        searches = {
+            1: {**PLATEAU, "min_price": 500, "max_price": 900},
+            2: {**PLATEAU, "min_price": 2000, "max_price": 3000},
+        }
+        self.assertEqual(len(plan_searches(searches)), 2)
+
+    def test_matches(self):
+        criteria = {**PLATEAU, "min_price": 1200, "max_price": 1750, "min_bedrooms": 2}
+        self.assertTrue(matches({"price": 1500, "bedrooms": 2}, criteria))
+        self.assertTrue(matches({"price": 0, "bedrooms": 0}, criteria))
+        self.assertFalse(matches({"price": 1800, "bedrooms": 2}, criteria))
+        self.assertFalse(matches({"price": 1500, "bedrooms": 1}, criteria))
+        self.assertTrue(matches({"price": 1500, "lat": 45.53, "lng": -73.57}, criteria))
+        self.assertFalse(
+            matches({"price": 1500, **{"lat": 45.5236, "lng": -73.62}}, criteria)
+        )
@@ -0,0 +1,39 @@
+# pylint: disable-all
+
+import threading
+import time
+import unittest
+
+from flatfindr.politeness import Politeness
+
+""" Test the Politeness Class """
+
+
+class TestPoliteness(unittest.TestCase):
+    def test_pause(self):
+        politeness = Politeness(delays={"page": (0.05, 0.05)})
+        self.assertEqual(politeness.pause("page"), 0)  # first page: no wait
+        self.assertGreater(politeness.pause("page"), 0.03)
+        time.sleep(0.06)
+        # the time spent since the previous page counts towards the delay
+        self.assertEqual(politeness.pause("page"), 0)
+        self.assertEqual(politeness.pause("unknown"), 0)
+
+    def test_scale(self):
+        politeness = Politeness(scale=0)
+        politeness.pause("page")
+        self.assertEqual(politeness.pause("page"), 0)
+
+    def test_shared_between_threads(self):
+        politeness = Politeness(delays={"page": (0.02, 0.02)})
+        politeness.pause("page")
+        start = time.monotonic()
+        threads = [
+            threading.Thread(target=politeness.pause, args=("page",)) for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 3 pages spaced out by 0.02 s each, whatever the number of threads
+        self.assertGreaterEqual(time.monotonic() - start, 0.055)
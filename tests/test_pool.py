@@ -0,0 +1,81 @@
+# pylint: disable-all
+
+import threading
+import time
+import unittest
+
+from flatfindr.pool import DriverPool
+
+""" Test the DriverPool Class with fake webdrivers """
+
+
+class FakeDriver:
+    def __init__(self):
+        self.alive = True
+        self.quit_cnt = 0
+
+    @property
+    def current_url(self):
+        if not self.alive:
+            raise ConnectionError("browser is dead")
+        return "about:blank"
+
+    def quit(self):
+        self.alive = False
+        self.quit_cnt += 1
+
+
+class TestDriverPool(unittest.TestCase):
+    def test_reuse(self):
+        pool = DriverPool(FakeDriver, max_size=2)
+        with pool.leased() as lease:
+            lease.logged_in = True
+            driver = lease.driver
+        with pool.leased() as lease:
+            self.assertIs(lease.driver, driver)
+            self.assertTrue(lease.logged_in)
+        self.assertEqual(len(pool), 1)
+
+    def test_unhealthy_driver_is_replaced(self):
+        pool = DriverPool(FakeDriver)
+        lease = pool.lease()
+        driver = lease.driver
+        pool.release(lease)
+        driver.alive = False
+        with pool.leased() as lease:
+            self.assertIsNot(lease.driver, driver)
+            self.assertFalse(lease.logged_in)
+
+    def test_discard_on_error(self):
+        pool = DriverPool(FakeDriver)
+        with self.assertRaises(ValueError):
+            with pool.leased() as lease:
+                raise ValueError
+        self.assertEqual(lease.driver.quit_cnt, 1)
+        self.assertEqual(len(pool), 0)
+
+    def test_max_size(self):
+        pool = DriverPool(FakeDriver, max_size=1)
+        lease = pool.lease()
+        with self.assertRaises(TimeoutError):
+            pool.lease(timeout=0.05)
+        threading.Timer(0.05, pool.release, args=(lease,)).start()
+        self.assertIs(pool.lease(timeout=2).driver, lease.driver)
+
+    def test_idle_eviction(self):
+        pool = DriverPool(FakeDriver, idle_timeout=0.01)
+        lease = pool.lease()
+        pool.release(lease)
+        time.sleep(0.02)
+        pool.evict_idle()
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(lease.driver.quit_cnt, 1)
+
+    def test_close(self):
+        pool = DriverPool(FakeDriver)
+        idle, leased = pool.lease(), pool.lease()
+        pool.release(idle)
+        pool.close()
+        self.assertFalse(idle.driver.alive)
+        pool.release(leased)
+        self.assertFalse(leased.driver.alive)
@@ -0,0 +1,69 @@
+# pylint: disable-all
+
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+
+from flatfindr.replay import Recorder, ReplayServer, clean_page, get_key, load_index
+
+""" Test the record and replay of pages, with a fake webdriver """
+
+MAIN_URL = "https://www.facebook.com"
+FEED_URL = MAIN_URL + "/marketplace/category/propertyrentals?minPrice=1200"
+ITEM_URL = MAIN_URL + "/marketplace/item/123/"
+
+
+class FakeDriver:
+    def __init__(self, current_url, page_source):
+        self.current_url = current_url
+        self.page_source = page_source
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_key(self):
+        self.assertEqual(get_key(ITEM_URL), "/marketplace/item/123/")
+        self.assertEqual(
+            get_key(FEED_URL), "/marketplace/category/propertyrentals?minPrice=1200"
+        )
+        self.assertEqual(get_key(MAIN_URL), "/")
+
+    def test_clean_page(self):
+        html = (
+            '<script src="x.js"></script><a href="https://www.facebook.com/marketplace/item/1/">a</a>'
+            "<SCRIPT>\nalert(1)\n</SCRIPT ><span dir='auto'>Description</span>"
+        )
+        self.assertEqual(
+            clean_page(html, MAIN_URL),
+            "<a href=\"/marketplace/item/1/\">a</a><span dir='auto'>Description</span>",
+        )
+
+    def test_record_and_replay(self):
+        recorder = Recorder(self.directory, MAIN_URL)
+        recorder.index["criteria"] = {"min_price": 1200}
+        recorder.snapshot(FakeDriver(FEED_URL, f'<a href="{ITEM_URL}">item</a>'))
+        recorder.snapshot(FakeDriver(ITEM_URL + "?ref=search", "<span>item</span>"))
+        self.assertEqual(load_index(self.directory)["criteria"], {"min_price": 1200})
+        with ReplayServer(self.directory) as server:
+            feed_url = server.url + get_key(FEED_URL)
+            with urllib.request.urlopen(feed_url) as response:
+                self.assertEqual(
+                    response.read().decode(),
+                    '<a href="/marketplace/item/123/">item</a>',
+                )
+                self.assertIn(
+                    "default-src 'self'", response.headers["Content-Security-Policy"]
+                )
+            # An item link without the query string of the recorded page
+            with urllib.request.urlopen(server.url + get_key(ITEM_URL)) as response:
+                self.assertEqual(response.read().decode(), "<span>item</span>")
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(server.url + "/marketplace/item/456/")
+            self.assertEqual(server.requests_cnt, 3)
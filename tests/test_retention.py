@@ -0,0 +1,169 @@
+# pylint: disable-all
+
+import json
+import os
+import tempfile
+import unittest
+from datetime import date
+
+from flatfindr.dedup import NearDuplicateIndex
+from flatfindr.retention import Retention, Tombstones, get_url_hash
+from flatfindr.storage import DEFAULT_COLUMNS, JSONStorage, SQLiteStorage
+from flatfindr.table import Table, description_fingerprint
+
+""" Test the retention policy of the database """
+
+TODAY = date(2022, 3, 1)
+
+
+def make_row(i, seen):
+    row = dict.fromkeys(DEFAULT_COLUMNS, "")
+    row["url"] = f"https://www.facebook.com/marketplace/item/{i}/"
+    row["state"] = "new"
+    row["images"] = []
+    row["description"] = f"Superbe 4 1/2 numéro {i}"
+    row["seen"] = seen
+    return [row[column] for column in DEFAULT_COLUMNS]
+
+
+def make_db(table):
+    return {"columns": table.columns, "data": table}
+
+
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def test_tombstones(self):
+        tombstones = Tombstones()
+        tombstones.add("https://a/", "f1", "2022-03-01")
+        tombstones.add("https://b/", "", "2022-03-10")
+        self.assertTrue(tombstones.has_url("https://a/"))
+        self.assertTrue(tombstones.has_fingerprint("f1"))
+        self.assertFalse(tombstones.has_url("https://c/"))
+        self.assertEqual(tombstones.expire(TODAY), 0)
+        self.assertEqual(tombstones.expire(date(2022, 3, 2)), 1)
+        self.assertFalse(tombstones.has_fingerprint("f1"))
+        self.assertEqual(
+            Tombstones(tombstones.to_list()).to_list(),
+            [[get_url_hash("https://b/"), "", "2022-03-10"]],
+        )
+
+    def test_prune_batch(self):
+        table = Table(DEFAULT_COLUMNS)
+        table.extend([make_row(i, "2022-02-01") for i in range(5)])
+        table.append(make_row(5, "2022-02-28"))
+        table.append(make_row(6, "2022-02-01"))  # Not at the head: kept for now
+        tombstones = Tombstones()
+        retention = Retention(days=14, batch=3)
+        pruned = retention.prune(make_db(table), tombstones, TODAY)
+        self.assertEqual(
+            pruned,
+            [
+                (
+                    make_row(i, "")[0],
+                    description_fingerprint(f"Superbe 4 1/2 numéro {i}"),
+                    "2022-02-01",
+                )
+                for i in range(3)
+            ],
+        )
+        self.assertEqual(len(retention.prune(make_db(table), tombstones, TODAY)), 2)
+        self.assertEqual(retention.prune(make_db(table), tombstones, TODAY), [])
+        self.assertEqual(list(table.column("seen")), ["2022-02-28", "2022-02-01"])
+        self.assertEqual(len(tombstones), 5)
+        self.assertTrue(tombstones.has_url(make_row(4, "")[0]))
+        self.assertEqual(Retention(days=None).count_expired(table, TODAY), 0)
+
+    def test_archive(self):
+        table = Table(DEFAULT_COLUMNS)
+        table.extend([make_row(0, "2022-02-01"), make_row(1, "")])
+        retention = Retention(days=14, archive_path=self.path("db.json.archive"))
+        retention.prune(make_db(table), Tombstones(), TODAY)
+        with open(self.path("db.json.archive")) as f:
+            archived = [json.loads(line) for line in f]
+        self.assertEqual(len(archived), 1)
+        self.assertEqual(archived[0]["description"], "Superbe 4 1/2 numéro 0")
+        self.assertEqual(len(table), 1)  # Never expires without a `seen` date
+
+    def test_storages(self):
+        for storage_type, name in (
+            (JSONStorage, "db.json"),
+            (SQLiteStorage, "db.sqlite"),
+        ):
+            with self.subTest(storage=storage_type.__name__):
+                storage = storage_type(self.path(name))
+                table = storage.new_table()
+                table.extend([make_row(i, "2022-02-01") for i in range(3)])
+                storage.save(make_db(table))
+                tombstones = Tombstones()
+                pruned = Retention(days=14, batch=2).prune(
+                    make_db(table), tombstones, TODAY
+                )
+                storage.drop([(url, seen) for url, _, seen in pruned])
+                table.append(make_row(3, "2022-02-28"))
+                storage.save(make_db(table))
+                storage.save_tombstones(tombstones.to_list())
+                storage.close()
+                storage = storage_type(self.path(name))
+                db = storage.load()
+                self.assertEqual(
+                    list(db["data"]),
+                    [make_row(2, "2022-02-01"), make_row(3, "2022-02-28")],
+                )
+                self.assertEqual(db["data"].get(1, "description"), make_row(3, "")[9])
+                self.assertEqual(storage.load_tombstones(), tombstones.to_list())
+                storage.close()
+
+    def test_remove_near_duplicate(self):
+        index = NearDuplicateIndex()
+        index.add("a", "Superbe 4 1/2 lumineux près du métro")
+        index.remove("a")
+        index.remove("b")
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.buckets, {})
+
+    def test_shared_sqlite(self):
+        # Two scrapers pruning the same database: each one removes its own expired items, and keeps the other's tombstones
+        path = self.path("db.sqlite")
+        storage = SQLiteStorage(path)
+        table = storage.new_table()
+        table.extend([make_row(i, "2022-02-01") for i in range(10)])
+        storage.save(make_db(table))
+        storage.close()
+        first, second = SQLiteStorage(path), SQLiteStorage(path)
+        first_db, second_db = first.load(), second.load()
+        second_db["data"].extend([make_row(i, "2022-02-28") for i in range(10, 20)])
+        second.save(second_db)
+        for storage, db, url in (
+            (first, first_db, "https://a/"),
+            (second, second_db, "https://b/"),
+        ):
+            tombstones = Tombstones()
+            tombstones.add(url, "", "2022-03-10")
+            pruned = Retention(days=14, batch=10).prune(db, tombstones, TODAY)
+            self.assertEqual(len(pruned), 10)
+            storage.drop([(url, seen) for url, _, seen in pruned])
+            storage.save(db)
+            storage.save_tombstones(tombstones.to_list(), TODAY)
+        first.close()
+        second.close()
+        storage = SQLiteStorage(path)
+        self.assertEqual(
+            list(storage.load()["data"]),
+            [make_row(i, "2022-02-28") for i in range(10, 20)],
+        )
+        tombstones = Tombstones(storage.load_tombstones())
+        self.assertEqual(len(tombstones), 12)
+        self.assertTrue(tombstones.has_url("https://a/"))
+        self.assertTrue(tombstones.has_url("https://b/"))
+        # The expired tombstones are removed at the next save
+        storage.save_tombstones([], date(2022, 3, 11))
+        self.assertEqual(len(storage.load_tombstones()), 10)
+        storage.close()
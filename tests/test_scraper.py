@@ -0,0 +1,196 @@
+# pylint: disable-all
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+from datetime import date, timedelta
+
+from flatfindr.geocoding import Geocoder, LocalBackend
+from flatfindr.metrics import Metrics
+from flatfindr.politeness import Politeness
+from flatfindr.pool import Lease
+from flatfindr.scraper import ONE_WEEK, Scraper
+from flatfindr.storage import get_storage
+
+""" Test the Scraper Class, with a fake webdriver """
+
+
+class FakeDriver:
+    def __init__(self):
+        self.urls = []  # The visited pages
+
+    def get(self, url):
+        self.urls.append(url)
+
+    def quit(self):
+        pass
+
+
+ITEM_URL = "https://www.facebook.com/marketplace/item/{}/"
+PLACES = [
+    {"address": "2212 Rue d'Iberville, Montréal, QC", "lat": 45.5307, "lng": -73.5563}
+]
+
+
+class FakeScraper(Scraper):
+    """A scraper whose items pages are read from `pages`, as {url: item details}."""
+
+    pages = {}
+
+    def scrape_item_details(self, item_url):
+        item_details = super().scrape_item_details(item_url)
+        item_details.update(self.pages.get(item_url, {}))
+        return item_details
+
+
+def make_page(description, address="", days=1):
+    return {
+        "published": (date.today() - timedelta(days=days)).isoformat(),
+        "price": "1500",
+        "bedrooms": "2",
+        "address": address,
+        "images": [],
+        "description": description,
+    }
+
+
+def make_scraper(db_path, driver=None, cls=Scraper, **kwargs):
+    return cls(
+        db_path=db_path,
+        lease=Lease(driver or FakeDriver()),
+        politeness=Politeness(scale=0),
+        metrics=Metrics(),
+        geocoder=Geocoder(backend=LocalBackend(PLACES), cache_path=None),
+        **kwargs,
+    )
+
+
+class TestScraper(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "db.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_is_old(self):
+        scraper = make_scraper(self.db_path)
+        today = date.today()
+        for days, old in (
+            (0, False),
+            (ONE_WEEK - 1, False),
+            (ONE_WEEK, True),
+            (30, True),
+        ):
+            with self.subTest(days=days):
+                published = (today - timedelta(days=days)).isoformat()
+                self.assertEqual(scraper.is_old({"published": published}), old)
+        self.assertFalse(scraper.is_old({"published": ""}))
+        self.assertFalse(scraper.is_old({}))
+
+    def test_update_db(self):
+        FakeScraper.pages = {
+            ITEM_URL.format(1): make_page(
+                "Superbe 4 1/2 lumineux près du métro", "2212 Rue d'Iberville"
+            ),
+            ITEM_URL.format(2): make_page("Beau 3 1/2, échange possible"),
+            ITEM_URL.format(3): make_page("Grand 5 1/2 avec terrasse", days=30),
+            ITEM_URL.format(4): make_page("Superbe 4 1/2 lumineux près du métro"),
+            ITEM_URL.format(5): make_page("Joli 2 1/2 meublé au 3e étage"),
+        }
+        for name in ("db.json", "db.db"):
+            with self.subTest(db=name):
+                db_path = os.path.join(self.tmp_dir.name, name)
+                driver = FakeDriver()
+                scraper = make_scraper(db_path, driver, FakeScraper)
+                links = [ITEM_URL.format(i) for i in (1, 2, 3, 1)]
+                self.assertEqual(scraper.add_items_links(links), 3)
+                self.assertEqual(scraper.add_items_links(links), 0)
+                scraper.update_db()
+                self.assertEqual(driver.urls, links[:3])
+                self.assertEqual(scraper.items_links, [])
+                self.assertEqual(
+                    [item["url"] for item in scraper.new_items], [ITEM_URL.format(1)]
+                )
+                self.assertEqual(scraper.new_items[0]["lat"], 45.5307)
+                # Another run on the saved database: the seen links are skipped, and the reposts are not interesting
+                driver = FakeDriver()
+                scraper = make_scraper(db_path, driver, FakeScraper)
+                links = [ITEM_URL.format(i) for i in range(1, 6)]
+                self.assertEqual(scraper.add_items_links(links), 2)
+                scraper.update_db()
+                self.assertEqual(driver.urls, links[3:])
+                self.assertEqual(
+                    [item["url"] for item in scraper.new_items], [ITEM_URL.format(5)]
+                )
+                storage = get_storage(db_path)
+                db = storage.load()
+                rows = [dict(zip(db["columns"], data)) for data in db["data"]]
+                storage.close()
+                self.assertEqual([row["url"] for row in rows], links)
+                self.assertEqual(
+                    [row["state"] for row in rows], ["new", "NI", "NI", "NI", "new"]
+                )
+                self.assertEqual(rows[1]["description"], "")
+                self.assertEqual(rows[0]["lng"], -73.5563)
+                self.assertEqual(rows[4]["seen"], date.today().isoformat())
+
+    def test_scrape_in_parallel(self):
+        def describe(i):
+            return f"Logement {i} " + " ".join(f"piece{i}x{j}" for j in range(8))
+
+        # Some reposts, swaps and old ads among the new ones
+        FakeScraper.pages = {
+            ITEM_URL.format(i): make_page(
+                describe(i - 1 if i % 6 == 4 else i)
+                + (", échange possible" if i % 6 == 2 else ""),
+                days=30 if i % 7 == 6 else 1,
+            )
+            for i in range(24)
+        }
+        links = [ITEM_URL.format(i) for i in range(24)]
+        save_db = Scraper.save_db
+        results = {}
+        for workers in (1, 3):
+            drivers = []
+            checkpoints = []  # The number of rows of each save
+
+            def load_driver(scraper, headless=True):
+                scraper.driver = FakeDriver()
+                drivers.append(scraper.driver)
+
+            def count_rows(scraper):
+                checkpoints.append(len(scraper.db["data"]))
+                return save_db(scraper)
+
+            db_path = os.path.join(self.tmp_dir.name, f"db-{workers}.db")
+            scraper = make_scraper(db_path, cls=FakeScraper)
+            scraper.add_items_links(links)
+            with unittest.mock.patch.object(
+                Scraper, "load_driver", load_driver
+            ), unittest.mock.patch.object(
+                Scraper, "restore_session", return_value=True
+            ), unittest.mock.patch.object(
+                Scraper, "save_db", count_rows
+            ):
+                items_details = scraper.update_db(max_items=30, workers=workers)
+            # Each page is scraped once, by one of the webdrivers
+            self.assertEqual(len(drivers), workers - 1)
+            urls = scraper.driver.urls + [url for d in drivers for url in d.urls]
+            self.assertEqual(sorted(urls), sorted(links))
+            storage = get_storage(db_path)
+            db = storage.load()
+            storage.close()
+            results[workers] = (
+                items_details,
+                scraper.new_items,
+                [dict(zip(db["columns"], data)) for data in db["data"]],
+                checkpoints,
+            )
+        self.assertGreater(len(results[1][1]), 10)
+        self.assertLess(len(results[1][1]), len(links))
+        self.assertGreater(len(results[1][3]), 1)
+        self.assertEqual(len(results[1][2]), len(links))
+        # The same as a serial run, saved at the same checkpoints
+        self.assertEqual(results[3], results[1])
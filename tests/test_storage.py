@@ -0,0 +1,144 @@
+# pylint: disable-all
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from flatfindr.storage import (
+    DEFAULT_COLUMNS,
+    JSONStorage,
+    SQLiteStorage,
+    get_storage,
+    migrate_json_to_sqlite,
+)
+
+""" Test the storage backends """
+
+
+def make_row(i, state="new"):
+    return [
+        f"https://www.facebook.com/marketplace/item/{i}/",
+        state,
+        "2022-02-11",
+        1500 + i,
+        2,
+        70,
+        f"{i} Rue Saint-Denis",
+        "Non meublé",
+        [f"https://scontent.xx.fbcdn.net/{i}.jpg"],
+        f"Superbe 4 1/2 numéro {i}",
+        45.5254,
+        -73.5724,
+        "2022-02-12",
+    ]
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def test_get_storage(self):
+        self.assertIsInstance(get_storage(self.path("db.json")), JSONStorage)
+        self.assertIsInstance(get_storage(self.path("db.sqlite")), SQLiteStorage)
+        self.assertIsInstance(get_storage(self.path("db.db")), SQLiteStorage)
+
+    def test_sqlite_round_trip(self):
+        storage = SQLiteStorage(self.path("db.sqlite"))
+        self.assertIsNone(storage.load())
+        db = {"columns": list(DEFAULT_COLUMNS), "data": [make_row(0)]}
+        storage.save(db)
+        db["data"].append(make_row(1, state="NI"))
+        storage.save(db)
+        storage.save(db)  # nothing new, nothing inserted
+        storage.close()
+
+        loaded = SQLiteStorage(self.path("db.sqlite")).load()
+        self.assertEqual(loaded, db)
+
+    def test_sqlite_backfill(self):
+        columns = [column for column in DEFAULT_COLUMNS if column != "lat"]
+        rows = [make_row(i) for i in range(3)]
+        for i, row in enumerate(rows):
+            row[10] += i / 100
+        storage = SQLiteStorage(self.path("db.sqlite"))
+        db = {
+            "columns": columns,
+            "data": [[value for j, value in enumerate(row) if j != 10] for row in rows],
+        }
+        storage.save(db)
+        # Another writer of the database removes an item
+        other = SQLiteStorage(self.path("db.sqlite"))
+        other_db = other.load()
+        other_db["data"].drop(1)
+        other.drop([(rows[0][0], rows[0][-1])])
+        other.save(other_db)
+        other.close()
+        # The new column is written by url, not by position
+        storage.save({"columns": list(DEFAULT_COLUMNS), "data": rows})
+        storage.close()
+        loaded = SQLiteStorage(self.path("db.sqlite")).load()
+        self.assertEqual(
+            [dict(zip(loaded["columns"], data)) for data in loaded["data"]],
+            [dict(zip(DEFAULT_COLUMNS, row)) for row in rows[1:]],
+        )
+
+    def test_sqlite_wal_and_indexes(self):
+        storage = SQLiteStorage(self.path("db.sqlite"))
+        storage.save({"columns": list(DEFAULT_COLUMNS), "data": [make_row(0)]})
+        storage.close()
+        connection = sqlite3.connect(self.path("db.sqlite"))
+        journal_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+        indexes = {row[1] for row in connection.execute("PRAGMA index_list(listings)")}
+        connection.close()
+        self.assertEqual(journal_mode, "wal")
+        for column in ("url", "published", "state"):
+            self.assertIn(f"idx_listings_{column}", indexes)
+
+    def test_migrate_json_to_sqlite(self):
+        db = {"columns": list(DEFAULT_COLUMNS), "data": [make_row(i) for i in range(5)]}
+        JSONStorage(self.path("db.json")).save(db)
+        cnt = migrate_json_to_sqlite(self.path("db.json"), self.path("db.sqlite"))
+        self.assertEqual(cnt, 5)
+        self.assertEqual(SQLiteStorage(self.path("db.sqlite")).load(), db)
+        with self.assertRaises(FileExistsError):
+            migrate_json_to_sqlite(self.path("db.json"), self.path("db.sqlite"))
+
+    def test_json_journal(self):
+        storage = JSONStorage(self.path("db.json"), compact_every=3)
+        self.assertIsNone(storage.load())
+        db = {"columns": list(DEFAULT_COLUMNS), "data": []}
+        storage.save(db)  # creates the snapshot
+        db["data"].append(make_row(0))
+        db["data"].append(make_row(1))
+        storage.save(db)
+        with open(self.path("db.json")) as db_file:
+            self.assertEqual(db_file.read().count("marketplace"), 0)
+        self.assertEqual(JSONStorage(self.path("db.json")).load(), db)
+
+        db["data"].append(make_row(2))
+        storage.save(db)  # 3 journaled items: compacted into the snapshot
+        self.assertFalse(os.path.isfile(self.path("db.json.journal")))
+        self.assertEqual(JSONStorage(self.path("db.json")).load(), db)
+
+    def test_json_journal_interrupted_save(self):
+        storage = JSONStorage(self.path("db.json"))
+        db = {"columns": list(DEFAULT_COLUMNS), "data": []}
+        storage.save(db)
+        db["data"].append(make_row(0))
+        storage.save(db)
+        with open(self.path("db.json.journal"), "ab") as journal_file:
+            journal_file.write(b'["https://www.facebook.com/marketpl')
+
+        storage = JSONStorage(self.path("db.json"))
+        loaded = storage.load()
+        self.assertEqual(loaded, db)
+        loaded["data"].append(make_row(1))
+        storage.save(loaded)
+        self.assertEqual(JSONStorage(self.path("db.json")).load(), loaded)
@@ -0,0 +1,137 @@
+# pylint: disable-all
+
+import json
+import os
+import tempfile
+import unittest
+
+from flatfindr.storage import DEFAULT_COLUMNS, JSONStorage, SQLiteStorage
+from flatfindr.table import (
+    Column,
+    EnumColumn,
+    IntColumn,
+    Table,
+    TextColumn,
+    description_fingerprint,
+)
+
+""" Test the columnar representation of the database """
+
+DESCRIPTION = DEFAULT_COLUMNS.index("description")
+
+
+def make_row(i, state="new"):
+    return [
+        f"https://www.facebook.com/marketplace/item/{i}/",
+        state,
+        "2022-02-11",
+        1500 + i,
+        2,
+        "",
+        f"{i} Rue Saint-Denis",
+        "Non meublé",
+        [f"https://scontent.xx.fbcdn.net/{i}.jpg"] if state == "new" else [],
+        f"Superbe 4 1/2 numéro {i}" if state == "new" else "",
+        45.5254,
+        "",
+        "2022-02-12",
+    ]
+
+
+class TestTable(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def test_round_trip(self):
+        rows = [make_row(0), make_row(1, state="NI"), make_row(2)]
+        table = Table(DEFAULT_COLUMNS)
+        table.extend(rows)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(list(table), rows)
+        self.assertEqual(table[-1], rows[-1])
+        self.assertEqual(table[1:], rows[1:])
+        self.assertEqual(table, rows)
+        self.assertEqual(table.get(1, "state"), "NI")
+        self.assertIsInstance(table.data[DEFAULT_COLUMNS.index("price")], IntColumn)
+        self.assertIsInstance(table.data[DEFAULT_COLUMNS.index("state")], EnumColumn)
+        with self.assertRaises(IndexError):
+            table[3]
+
+    def test_fallback(self):
+        table = Table(DEFAULT_COLUMNS)
+        table.append(make_row(0))
+        row = make_row(1)
+        row[DEFAULT_COLUMNS.index("price")] = "1 500 $"
+        row[DEFAULT_COLUMNS.index("published")] = "il y a 2 jours"
+        table.append(row)
+        self.assertEqual(list(table), [make_row(0), row])
+        self.assertIs(type(table.data[DEFAULT_COLUMNS.index("price")]), Column)
+
+    def test_add_column(self):
+        table = Table(DEFAULT_COLUMNS[:-3])
+        table.append(make_row(0)[:-3])
+        table.add_column("lat")
+        table.add_column("lng", "")
+        table.add_column("seen", "2022-02-13")
+        table.append(make_row(1))
+        self.assertEqual(list(table.column("lat")), ["", 45.5254])
+        self.assertEqual(list(table.column("seen")), ["2022-02-13", "2022-02-12"])
+
+    def test_fingerprints(self):
+        table = Table(DEFAULT_COLUMNS)
+        table.extend([make_row(0), make_row(1, state="NI")])
+        self.assertEqual(
+            list(table.fingerprints("description")),
+            [description_fingerprint(make_row(0)[DESCRIPTION]), ""],
+        )
+
+    def test_json_lazy_descriptions(self):
+        storage = JSONStorage(self.path("db.json"), compact_every=100)
+        rows = [make_row(i, state="NI" if i % 2 else "new") for i in range(4)]
+        storage.save({"columns": list(DEFAULT_COLUMNS), "data": list(rows)})
+        db = storage.load()
+        description = db["data"].data[DEFAULT_COLUMNS.index("description")]
+        self.assertIsInstance(description, TextColumn)
+        self.assertEqual(description.texts, {})  # Nothing held in memory
+        db["data"].append(make_row(4))
+        storage.save(db)  # Journaled
+        db = JSONStorage(self.path("db.json")).load()
+        self.assertEqual(list(db["data"]), rows + [make_row(4)])
+        self.assertEqual(db["data"].get(4, "description"), make_row(4)[DESCRIPTION])
+
+    def test_json_legacy_snapshot(self):
+        rows = [make_row(0), make_row(1)]
+        with open(self.path("db.json"), "w") as f:
+            json.dump({"columns": list(DEFAULT_COLUMNS), "data": rows}, f)
+        storage = JSONStorage(self.path("db.json"))
+        db = storage.load()
+        self.assertTrue(storage.rewrite)
+        storage.save(db)  # Rewritten one item per line
+        description = db["data"].data[DEFAULT_COLUMNS.index("description")]
+        self.assertEqual(description.texts, {})
+        self.assertEqual(list(db["data"]), rows)
+        self.assertFalse(JSONStorage(self.path("db.json")).rewrite)
+
+    def test_sqlite_lazy_descriptions(self):
+        storage = SQLiteStorage(self.path("db.sqlite"))
+        rows = [make_row(0), make_row(1, state="NI")]
+        storage.save({"columns": list(DEFAULT_COLUMNS), "data": list(rows)})
+        db = storage.load()
+        self.assertEqual(list(db["data"]), rows)
+        self.assertEqual(
+            db["data"].data[DEFAULT_COLUMNS.index("description")].texts, {}
+        )
+        storage.close()
+
+    def test_changed_on_disk(self):
+        storage = JSONStorage(self.path("db.json"))
+        storage.save({"columns": list(DEFAULT_COLUMNS), "data": [make_row(0)]})
+        db = storage.load()
+        storage.compact({"columns": list(DEFAULT_COLUMNS), "data": [make_row(1)]})
+        self.assertEqual(db["data"].get(0, "description"), "")
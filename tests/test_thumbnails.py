@@ -0,0 +1,152 @@
+# pylint: disable-all
+
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from flatfindr.thumbnails import ThumbnailCache, get_image_key, make_thumbnail
+
+""" Test the thumbnails cache, with images served by a local HTTP server """
+
+
+def make_image(width, height, color):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(output, "PNG")
+    return output.getvalue()
+
+
+class ImageServer:
+    def __init__(self, images):
+        self.images = images  # {path: bytes}
+        self.requests_cnt = 0
+        self.release = threading.Event()
+        self.release.set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests_cnt += 1
+                server.release.wait(5)
+                image = server.images.get(self.path.split("?")[0])
+                if image is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(image)))
+                self.end_headers()
+                self.wfile.write(image)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class TestThumbnails(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "thumbnails")
+        red = make_image(1200, 600, "red")
+        self.server = ImageServer(
+            {"/red.png": red, "/copy.png": red, "/blue.png": make_image(50, 40, "blue")}
+        )
+        self.cache = ThumbnailCache(self.path, size=(320, 320), max_workers=2)
+
+    def tearDown(self):
+        self.cache.close()
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def test_get_image_key(self):
+        self.assertEqual(
+            get_image_key("https://scontent.xx.fbcdn.net/v/t1/1_n.jpg?oh=1&oe=2"),
+            "https://scontent.xx.fbcdn.net/v/t1/1_n.jpg",
+        )
+
+    def test_make_thumbnail(self):
+        with Image.open(
+            io.BytesIO(make_thumbnail(make_image(1200, 600, "red")))
+        ) as image:
+            self.assertEqual(image.format, "JPEG")
+            self.assertEqual(image.size, (320, 160))
+
+    def test_download(self):
+        urls = [self.server.url + "/red.png?oe=1", self.server.url + "/blue.png"]
+        self.assertEqual(self.cache.submit(urls), 2)
+        paths = self.cache.wait(urls, timeout=5)
+        self.assertEqual(len(paths), 2)
+        for path in paths:
+            self.assertTrue(os.path.isfile(path))
+        with Image.open(paths[0]) as image:
+            self.assertEqual(image.size, (320, 160))
+        with Image.open(paths[1]) as image:
+            # A small image is not enlarged
+            self.assertEqual(image.size, (50, 40))
+        # The signature of the url changed, but the image is cached
+        self.assertEqual(self.cache.get(self.server.url + "/red.png?oe=2"), paths[0])
+        self.assertEqual(self.cache.submit([self.server.url + "/red.png?oe=2"]), 0)
+        self.assertEqual(self.server.requests_cnt, 2)
+
+    def test_content_addressed(self):
+        urls = [self.server.url + "/red.png", self.server.url + "/copy.png"]
+        self.cache.submit(urls)
+        paths = self.cache.wait(urls, timeout=5)
+        # The same image under two urls is stored once
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(self.cache.get(urls[0]), self.cache.get(urls[1]))
+        self.assertEqual(len(self.cache), 2)
+
+    def test_in_flight(self):
+        url = self.server.url + "/red.png"
+        self.server.release.clear()
+        self.assertEqual(self.cache.submit([url]), 1)
+        # Already being downloaded
+        self.assertEqual(self.cache.submit([url]), 0)
+        self.assertIsNone(self.cache.get(url))
+        self.server.release.set()
+        self.assertEqual(len(self.cache.wait([url], timeout=5)), 1)
+        self.assertEqual(self.server.requests_cnt, 1)
+
+    def test_wait_deadline(self):
+        urls = [self.server.url + "/red.png", self.server.url + "/blue.png"]
+        self.server.release.clear()
+        self.assertEqual(self.cache.submit(urls), 2)
+        start = time.monotonic()
+        # The timeout is shared by all the images
+        self.assertEqual(self.cache.wait(urls, timeout=0.5), [])
+        self.assertLess(time.monotonic() - start, 0.9)
+        self.server.release.set()
+        self.assertEqual(len(self.cache.wait(urls, timeout=5)), 2)
+
+    def test_not_found(self):
+        url = self.server.url + "/missing.png"
+        self.cache.submit([url])
+        self.assertEqual(self.cache.wait([url], timeout=5), [])
+        self.assertEqual(len(self.cache), 0)
+
+    def test_reload(self):
+        url = self.server.url + "/blue.png"
+        self.cache.submit([url])
+        path = self.cache.wait([url], timeout=5)[0]
+        # The index is saved every SAVE_EVERY thumbnails, or when flushed
+        self.assertIsNone(ThumbnailCache(self.path).get(url))
+        self.cache.flush()
+        cache = ThumbnailCache(self.path)
+        self.assertEqual(cache.get(url), path)
+        self.assertEqual(cache.submit([url]), 0)
+        cache.close()